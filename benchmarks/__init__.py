@@ -0,0 +1,70 @@
+# howtographql-graphene-tutorial-fixed -- benchmarks/__init__.py
+#
+# Copyright © 2017 Sean Bolton.
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE
+# LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION
+# WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+"""Stand-alone benchmarks for the hackernews backend.
+
+Each benchmark is a module in this package that can be run from the project directory, e.g.:
+
+    $ python -m benchmarks.vote_ingestion
+
+setup_django() gives each run a fresh, file-based SQLite database (so that multiple threads can
+share it), created with the current models, and never touches db.sqlite3.
+"""
+
+import os
+import tempfile
+import time
+
+
+def setup_django(**overrides):
+    """Configure Django for a benchmark run, with a fresh database in a temporary directory, and
+    with any settings in `overrides` applied. Returns the path of the database file.
+    """
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'hackernews.settings')
+    import django
+    from django.conf import settings
+    from django.core.management import call_command
+
+    db_path = os.path.join(tempfile.mkdtemp(prefix='hackernews-bench-'), 'bench.sqlite3')
+    settings.DATABASES['default']['NAME'] = db_path
+    for name, value in overrides.items():
+        setattr(settings, name, value)
+    django.setup()
+    call_command('migrate', run_syncdb=True, verbosity=0)
+    return db_path
+
+
+def report(name, count, seconds, unit='ops'):
+    """Print one line of benchmark results."""
+    print('{:<40} {:>8} {} in {:8.3f}s = {:10.1f} {}/s'.format(
+        name, count, unit, seconds, count / seconds, unit))
+
+
+class Timer(object):
+    """A context manager measuring wall-clock time, in `elapsed` seconds."""
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.elapsed = time.perf_counter() - self.start
@@ -0,0 +1,111 @@
+# howtographql-graphene-tutorial-fixed -- benchmarks/connection_rows.py
+#
+# Copyright © 2017 Sean Bolton.
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE
+# LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION
+# WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+"""Compare connection pages built from model instances and from compact rows.
+
+    $ python -m benchmarks.connection_rows [--links 5000] [--page 1000] [--repeat 20]
+
+The same allLinks page is executed with CONNECTION_ROWS off (a model instance per edge) and on
+(a __slots__ row of the selected columns per edge, see hackernews/rows.py). Throughput is the best
+of `--repeat` executions of each. Memory is measured with tracemalloc, both as the peak during an
+execution and as the size of the page's nodes themselves.
+"""
+
+import argparse
+import tracemalloc
+
+from benchmarks import Timer, report, setup_django
+
+
+PAGE_QUERY = '''
+  query Page($first: Int) {
+    viewer {
+      allLinks(orderBy: id_ASC, first: $first) {
+        edges { node { id url description createdAt voteCount } }
+      }
+    }
+  }
+'''
+
+
+def execute(schema, page):
+    result = schema.execute(PAGE_QUERY, variable_values={'first': page})
+    assert not result.errors, result.errors
+    return result
+
+
+def measure(schema, queryset_for, page, repeat):
+    """Return (the best execution time, the peak memory of one execution, the size of the page's
+    nodes alone).
+    """
+    execute(schema, page)  # warm up
+    best = None
+    for _ in range(repeat):
+        with Timer() as timer:
+            execute(schema, page)
+        best = timer.elapsed if best is None else min(best, timer.elapsed)
+    tracemalloc.start()
+    execute(schema, page)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    tracemalloc.start()
+    nodes = list(queryset_for()[:page])
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del nodes
+    return best, peak, size
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--links', type=int, default=5000)
+    parser.add_argument('--page', type=int, default=1000)
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    setup_django(DEBUG=False, WARMUP_ON_STARTUP=False)
+    from django.conf import settings
+    from graphene_django.settings import graphene_settings
+    from hackernews.rows import RowQuerySet, row_class
+    from links.models import LinkModel
+
+    LinkModel.objects.bulk_create(
+        LinkModel(description='Link {}'.format(i), url='http://example.com/{}'.format(i))
+        for i in range(args.links))
+    schema = graphene_settings.SCHEMA
+    columns = ('id', 'created_at', 'description', 'url', 'vote_count')
+    paths = [
+        ('model instances', False, lambda: LinkModel.objects.order_by('id')),
+        ('rows', True, lambda: RowQuerySet(LinkModel.objects.order_by('id'),
+                                           row_class(LinkModel, columns))),
+    ]
+    for name, rows, queryset_for in paths:
+        settings.CONNECTION_ROWS = rows
+        best, peak, size = measure(schema, queryset_for, args.page, args.repeat)
+        report('page of {} links, {}'.format(args.page, name), args.page, best, 'edges')
+        print('{:<40} {:10.1f} KiB peak, {:10.1f} KiB for the nodes ({:.0f} bytes each)'.format(
+            '', peak / 1024, size / 1024, size / args.page))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,137 @@
+# howtographql-graphene-tutorial-fixed -- benchmarks/db_write_throughput.py
+#
+# Copyright © 2017 Sean Bolton.
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE
+# LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION
+# WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+"""Compare concurrent write throughput with SQLite's defaults and with our connection tuning.
+
+    $ python -m benchmarks.db_write_throughput [--threads 16] [--votes 2000]
+
+Each configuration runs in its own Python process, since Django can only be set up once per
+process:
+
+- 'defaults' is what settings.py used to do: rollback journal, synchronous=FULL, no PRAGMAs, and
+  a new connection for every request (CONN_MAX_AGE=0).
+- 'tuned' is the current configuration: SQLITE_PRAGMAS (WAL, synchronous=NORMAL, mmap, busy
+  timeout) and persistent connections.
+
+Every thread runs createVote mutations, one "request" at a time, ending each the way Django's
+request_finished signal does, with close_old_connections().
+"""
+
+import argparse
+import subprocess
+import sys
+import threading
+
+from benchmarks import Timer, report, setup_django
+
+
+CONFIGURATIONS = {
+    'defaults': {'SQLITE_PRAGMAS': {}, 'CONN_MAX_AGE': 0},
+    'tuned': {'CONN_MAX_AGE': 60},
+}
+
+CREATE_VOTE = '''
+  mutation CreateVoteMutation($input: CreateVoteInput!) {
+    createVote(input: $input) {
+      vote { id }
+    }
+  }
+'''
+
+
+def run(schema, users, links, threads):
+    from django.db import close_old_connections, connection
+    from graphene.relay import Node
+
+    errors = []
+
+    def worker(my_users):
+        for user in my_users:
+            class Auth(object):
+                META = {'HTTP_AUTHORIZATION': 'Bearer {}'.format(user.token)}
+            for link in links:
+                variables = {'input': {
+                    'linkId': Node.to_global_id('Link', link.pk),
+                    'userId': Node.to_global_id('User', user.pk),
+                }}
+                result = schema.execute(CREATE_VOTE, variable_values=variables, context_value=Auth)
+                if result.errors:
+                    errors.extend(result.errors)
+                close_old_connections()
+        connection.close()
+
+    workers = [threading.Thread(target=worker, args=(users[i::threads],)) for i in range(threads)]
+    with Timer() as timer:
+        for w in workers:
+            w.start()
+        for w in workers:
+            w.join()
+    return timer.elapsed, errors
+
+
+def run_configuration(name, args):
+    overrides = dict(CONFIGURATIONS[name])
+    conn_max_age = overrides.pop('CONN_MAX_AGE')
+    setup_django(**overrides)
+    from django.conf import settings
+    from django.db import connection
+    settings.DATABASES['default']['CONN_MAX_AGE'] = conn_max_age
+    connection.settings_dict['CONN_MAX_AGE'] = conn_max_age
+    from hackernews.schema import schema
+    from links.models import LinkModel
+    from users.models import UserModel
+
+    links = [LinkModel.objects.create(description='Link {}'.format(i),
+                                      url='http://example.com/{}'.format(i))
+             for i in range(args.links)]
+    users = [UserModel.objects.create(name='User {}'.format(i), password='abc123',
+                                      email='user{}@example.com'.format(i))
+             for i in range(args.votes // args.links)]
+    connection.close()
+    elapsed, errors = run(schema, users, links, args.threads)
+    report('createVote, SQLite ' + name, len(users) * len(links), elapsed, 'votes')
+    if errors:
+        print('    {} errors, e.g.: {}'.format(len(errors), errors[0]))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--threads', type=int, default=16)
+    parser.add_argument('--votes', type=int, default=2000)
+    parser.add_argument('--links', type=int, default=5)
+    parser.add_argument('--configuration', choices=sorted(CONFIGURATIONS),
+                        help='Run only this configuration, in this process.')
+    args = parser.parse_args()
+
+    if args.configuration:
+        run_configuration(args.configuration, args)
+        return
+    for name in ('defaults', 'tuned'):
+        sys.stdout.flush()
+        subprocess.check_call([sys.executable, '-m', 'benchmarks.db_write_throughput',
+                               '--threads', str(args.threads), '--votes', str(args.votes),
+                               '--links', str(args.links), '--configuration', name])
+
+
+if __name__ == '__main__':
+    main()
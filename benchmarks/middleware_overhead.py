@@ -0,0 +1,102 @@
+# howtographql-graphene-tutorial-fixed -- benchmarks/middleware_overhead.py
+#
+# Copyright © 2017 Sean Bolton.
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE
+# LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION
+# WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+"""Measure the per-request time that the lean /graphql/ middleware profile saves.
+
+    $ python -m benchmarks.middleware_overhead [--requests 2000] [--rounds 5]
+
+Each query is posted to /graphql/ through two WSGI handlers in turn: Django's WSGIHandler, with
+the full MIDDLEWARE stack, and the MIDDLEWARE_PROFILES handler for /graphql/ (see
+hackernews/handlers.py). '{ __typename }' is answered almost without executing anything, so its
+times are close to the pure request-handling overhead; the allLinks page shows the saving
+relative to a typical query.
+"""
+
+import argparse
+import json
+
+from benchmarks import Timer, setup_django
+
+
+QUERIES = {
+    'typename': '{ __typename }',
+    'allLinks': '{ viewer { allLinks(first: 10) { edges { node { id url voteCount } } } } }',
+}
+
+
+def run(handler, environ_for, requests):
+    def start_response(status, headers):
+        assert status.startswith('200'), status
+    with Timer() as timer:
+        for _ in range(requests):
+            response = handler(environ_for(), start_response)
+            b''.join(response)
+            response.close()
+    return timer.elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--rounds', type=int, default=5)
+    args = parser.parse_args()
+
+    # every request comes from the same address, so keep rate limiting and admission control
+    # from turning the benchmark's requests away
+    setup_django(DEBUG=False, ALLOWED_HOSTS=['testserver'], WARMUP_ON_STARTUP=False,
+                 RATE_LIMITS={}, GRAPHQL_MAX_CONCURRENCY=0)
+    from django.conf import settings
+    from django.core.handlers.wsgi import WSGIHandler
+    from django.test import RequestFactory
+    from hackernews.handlers import MiddlewareProfileHandler
+    from links.models import LinkModel
+
+    for i in range(10):
+        LinkModel.objects.create(description='Link {}'.format(i),
+                                 url='http://example.com/{}'.format(i))
+    handlers = [
+        ('full MIDDLEWARE', WSGIHandler()),
+        ('/graphql/ profile', MiddlewareProfileHandler(settings.MIDDLEWARE_PROFILES['/graphql/'])),
+    ]
+    factory = RequestFactory()
+    for name, query in QUERIES.items():
+        body = json.dumps({'query': query})
+        def environ_for():
+            return factory.post('/graphql/', body, content_type='application/json').environ
+        for _, handler in handlers:
+            run(handler, environ_for, args.requests // 10)  # warm up
+        # alternate the handlers over several rounds, and keep each one's best round
+        best = [None] * len(handlers)
+        for _ in range(args.rounds):
+            for i, (_, handler) in enumerate(handlers):
+                elapsed = run(handler, environ_for, args.requests)
+                best[i] = elapsed if best[i] is None else min(best[i], elapsed)
+        times = [elapsed / args.requests * 1e6 for elapsed in best]
+        for (label, _), time in zip(handlers, times):
+            print('{:<10} {:<20} {:10.1f} us/request'.format(name, label, time))
+        print('{:<10} {:<20} {:10.1f} us/request ({:.0%})'.format(
+            name, 'saved', times[0] - times[1], (times[0] - times[1]) / times[0]))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,109 @@
+# howtographql-graphene-tutorial-fixed -- benchmarks/vote_ingestion.py
+#
+# Copyright © 2017 Sean Bolton.
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE
+# LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION
+# WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+"""Compare createVote throughput using per-vote transactions and write-behind batching.
+
+    $ python -m benchmarks.vote_ingestion [--threads 16] [--votes 2000]
+
+Each of the worker threads runs createVote mutations for its own set of users against a handful of
+links, simulating a traffic spike on popular links.
+"""
+
+import argparse
+import threading
+
+from benchmarks import Timer, report, setup_django
+
+
+CREATE_VOTE = '''
+  mutation CreateVoteMutation($input: CreateVoteInput!) {
+    createVote(input: $input) {
+      vote { id }
+    }
+  }
+'''
+
+
+def run(schema, users, links, threads):
+    from graphene.relay import Node
+
+    errors = []
+
+    def worker(my_users):
+        from django.db import connection
+        for user in my_users:
+            class Auth(object):
+                META = {'HTTP_AUTHORIZATION': 'Bearer {}'.format(user.token)}
+            for link in links:
+                variables = {'input': {
+                    'linkId': Node.to_global_id('Link', link.pk),
+                    'userId': Node.to_global_id('User', user.pk),
+                }}
+                result = schema.execute(CREATE_VOTE, variable_values=variables, context_value=Auth)
+                if result.errors:
+                    errors.extend(result.errors)
+        connection.close()
+
+    workers = [threading.Thread(target=worker, args=(users[i::threads],)) for i in range(threads)]
+    with Timer() as timer:
+        for w in workers:
+            w.start()
+        for w in workers:
+            w.join()
+    return timer.elapsed, errors
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--threads', type=int, default=16)
+    parser.add_argument('--votes', type=int, default=2000)
+    parser.add_argument('--links', type=int, default=5)
+    args = parser.parse_args()
+
+    setup_django()
+    from django.conf import settings
+    from hackernews.schema import schema
+    from links.models import LinkModel, VoteModel
+    from links.votequeue import get_vote_writer
+    from users.models import UserModel
+
+    links = [LinkModel.objects.create(description='Link {}'.format(i),
+                                      url='http://example.com/{}'.format(i))
+             for i in range(args.links)]
+    users = [UserModel.objects.create(name='User {}'.format(i), password='abc123',
+                                      email='user{}@example.com'.format(i))
+             for i in range(args.votes // args.links)]
+    count = len(users) * len(links)
+
+    for label, write_behind in (('per-vote transactions', False), ('write-behind batches', True)):
+        VoteModel.objects.all().delete()
+        settings.VOTE_WRITE_BEHIND = write_behind
+        elapsed, errors = run(schema, users, links, args.threads)
+        report('createVote, ' + label, count, elapsed, 'votes')
+        if errors:
+            print('    {} errors, e.g.: {}'.format(len(errors), errors[0]))
+    get_vote_writer().stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,9 @@
+from django.apps import AppConfig
+
+
+class HackernewsConfig(AppConfig):
+    name = 'hackernews'
+
+    def ready(self):
+        from hackernews.database import install_connection_handlers
+        install_connection_handlers()
@@ -0,0 +1,150 @@
+# howtographql-graphene-tutorial-fixed -- hackernews/coalescing.py
+#
+# Copyright © 2017 Sean Bolton.
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE
+# LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION
+# WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+"""Coalescing identical, concurrent GraphQL queries into one execution ("single flight").
+
+When a page gets popular, many anonymous clients ask for exactly the same thing at the same moment,
+say the front page, and each of their requests would run the same resolvers and the same SQL. With
+GRAPHQL_COALESCE_QUERIES enabled, hackernews/views.py runs each anonymous query operation through
+the process-wide SingleFlight: the first request for a given (document, variables, operation name)
+executes it, and any identical request arriving while that execution is still in flight waits for
+it, and then answers with the same serialized response body, instead of executing again.
+
+Only requests whose response cannot depend on who is asking are coalesced:
+
+- no Authorization header, so there is no viewer, and no user-specific data such as Link.votes'
+  viewer votes;
+- query operations only, never mutations;
+- not from a sticky client (see hackernews/routers.py), which must read its own writes from the
+  primary, while the execution it would join may be reading from the replica.
+
+Waiting requests still count against their own client's rate limit. A waiting request that hasn't
+had its answer after `timeout` seconds (normally GRAPHQL_OPERATION_TIMEOUT, plus a little) stops
+waiting and executes the operation itself.
+
+This only coalesces requests in flight at the same time, in the same process; nothing is kept
+once an execution has finished, so there is no staleness beyond what each execution had anyway.
+SingleFlight.stats counts the 'executions' that ran and the requests 'coalesced' into them, i.e.
+the executions saved. They are logged (at INFO, to the 'hackernews.coalescing' logger) every
+GRAPHQL_COALESCE_STATS_INTERVAL seconds, by the first execution to finish after the interval is up.
+"""
+
+import logging
+import threading
+import time
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+
+class Flight(object):
+    """One execution in flight, and the means for the requests waiting on it to get its outcome."""
+    __slots__ = ('result', 'error', 'done')
+
+    def __init__(self):
+        self.result = None
+        self.error = None
+        self.done = threading.Event()
+
+
+class SingleFlight(object):
+    """Runs at most one call per key at a time; callers arriving with the same key while it runs
+    wait for it, and share its result (or its exception).
+    """
+    def __init__(self, timeout=None, stats_interval=None):
+        self.timeout = timeout
+        self.flights = {}  # key -> Flight
+        self.lock = threading.Lock()
+        self.stats = {'executions': 0, 'coalesced': 0}
+        self.stats_interval = stats_interval  # seconds between logging the stats, None for never
+        self.stats_logged = time.monotonic()
+
+    def do(self, key, function):
+        """Return function(), or the result of the identical call already running for `key`."""
+        with self.lock:
+            flight = self.flights.get(key)
+            if flight is None:
+                flight = self.flights[key] = Flight()
+                leader = True
+            else:
+                leader = False
+                self.stats['coalesced'] += 1
+        if not leader:
+            if flight.done.wait(self.timeout):
+                if flight.error is not None:
+                    raise flight.error
+                return flight.result
+            # the execution we were waiting for is taking too long, run our own
+            with self.lock:
+                self.stats['coalesced'] -= 1
+                self.stats['executions'] += 1
+            return function()
+        try:
+            flight.result = function()
+            return flight.result
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            with self.lock:
+                del self.flights[key]
+                self.stats['executions'] += 1
+                stats = self.stats_due()
+            flight.done.set()
+            if stats:
+                self.log_stats(stats)
+
+    def stats_due(self):
+        """Return a copy of the stats if it is time to log them, or None. Call it holding the
+        lock.
+        """
+        if self.stats_interval is None:
+            return None
+        now = time.monotonic()
+        if now - self.stats_logged < self.stats_interval:
+            return None
+        self.stats_logged = now
+        return dict(self.stats)
+
+    @staticmethod
+    def log_stats(stats):
+        requests = stats['executions'] + stats['coalesced']
+        logger.info('Query coalescing: %d request(s), %d execution(s), %d coalesced (%.0f%%)',
+                    requests, stats['executions'], stats['coalesced'],
+                    100.0 * stats['coalesced'] / requests if requests else 0.0)
+
+
+single_flight = None
+single_flight_lock = threading.Lock()
+
+def get_single_flight():
+    """Return the process-wide SingleFlight, creating it on first use."""
+    global single_flight
+    with single_flight_lock:
+        if single_flight is None:
+            timeout = getattr(settings, 'GRAPHQL_OPERATION_TIMEOUT', None)
+            single_flight = SingleFlight(
+                timeout and timeout + 1.0,
+                stats_interval=getattr(settings, 'GRAPHQL_COALESCE_STATS_INTERVAL', None))
+        return single_flight
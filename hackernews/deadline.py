@@ -0,0 +1,140 @@
+# howtographql-graphene-tutorial-fixed -- hackernews/deadline.py
+#
+# Copyright © 2017 Sean Bolton.
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE
+# LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION
+# WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+"""Per-operation deadlines, enforced between connection pages and by the database itself.
+
+GraphQLView runs each operation inside deadline(GRAPHQL_OPERATION_TIMEOUT). A deadline is kept in
+a thread local (graphql-core's default executor resolves everything in the request's thread), and
+is enforced in two places:
+
+- Between pages: QuerySetConnectionField calls check_deadline() before it resolves each
+  connection, so an operation with many nested connections stops at the next one once its time is
+  up. The fields already resolved are returned, along with a DeadlineExceeded error for each
+  connection that was skipped: partial data rather than a request that never ends.
+- Inside a query: each database connection the operation uses is limited to the time remaining
+  when the operation starts (or when the connection is opened). On PostgreSQL, that is the
+  statement_timeout, after which the server cancels the statement. SQLite has no such setting, so
+  a progress handler, which SQLite calls every PROGRESS_HANDLER_OPS virtual machine instructions,
+  interrupts the statement once the deadline has passed. Either way the query fails with a
+  DatabaseError, which deadline_errors() turns into DeadlineExceeded.
+
+The limits are removed from the connections when the operation ends, since persistent connections
+(CONN_MAX_AGE) go on to serve other requests.
+"""
+
+import contextlib
+import threading
+import time
+
+from django.db import DatabaseError, connections
+
+PROGRESS_HANDLER_OPS = 1000
+
+state = threading.local()
+
+
+class DeadlineExceeded(Exception):
+    def __init__(self):
+        super().__init__('The operation ran out of time, so its results are incomplete.')
+
+
+def remaining():
+    """Return the seconds left until this thread's deadline, or None if it has none."""
+    deadline = getattr(state, 'deadline', None)
+    return None if deadline is None else deadline - time.monotonic()
+
+
+def check_deadline():
+    """Raise DeadlineExceeded if this thread's deadline has passed."""
+    left = remaining()
+    if left is not None and left <= 0:
+        raise DeadlineExceeded()
+
+
+@contextlib.contextmanager
+def deadline_errors():
+    """Turn database errors caused by the deadline (cancelled or interrupted statements) into
+    DeadlineExceeded.
+    """
+    try:
+        yield
+    except DatabaseError as e:
+        left = remaining()
+        if left is not None and left <= 0:
+            raise DeadlineExceeded() from e
+        raise
+
+
+@contextlib.contextmanager
+def deadline(seconds):
+    """Give the code in this block `seconds` to run (no limit if None or 0). Nested deadlines
+    leave the outer one in force.
+    """
+    if not seconds or getattr(state, 'deadline', None) is not None:
+        yield
+        return
+    state.deadline = time.monotonic() + seconds
+    state.limited = []
+    try:
+        for connection in connections.all():
+            if connection.connection is not None:
+                limit_connection(connection)
+        yield
+    finally:
+        for connection in state.limited:
+            unlimit_connection(connection)
+        state.deadline = state.limited = None
+
+
+# ========== database limits ==========
+
+def limit_connection(connection):
+    if connection.vendor == 'sqlite':
+        deadline = state.deadline
+        connection.connection.set_progress_handler(lambda: time.monotonic() > deadline,
+                                                   PROGRESS_HANDLER_OPS)
+    elif connection.vendor == 'postgresql':
+        with connection.cursor() as cursor:
+            cursor.execute('SET statement_timeout = %s', [max(1, int(remaining() * 1000))])
+    else:
+        return
+    state.limited.append(connection)
+
+
+def unlimit_connection(connection):
+    if connection.connection is None:
+        return  # closed meanwhile, and the limit with it
+    try:
+        if connection.vendor == 'sqlite':
+            connection.connection.set_progress_handler(None, 0)
+        elif connection.vendor == 'postgresql':
+            with connection.cursor() as cursor:
+                cursor.execute('RESET statement_timeout')
+    except DatabaseError:
+        connection.close()
+
+
+def limit_new_connection(sender, connection, **kwargs):
+    """connection_created handler: limit connections opened while a deadline is running."""
+    if getattr(state, 'deadline', None) is not None:
+        limit_connection(connection)
@@ -0,0 +1,130 @@
+# howtographql-graphene-tutorial-fixed -- hackernews/encoders.py
+#
+# Copyright © 2017 Sean Bolton.
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE
+# LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION
+# WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+"""Pluggable JSON encoders for the GraphQL responses.
+
+For big pages, serializing the result is a large share of a request's time. GraphQLView (see
+hackernews/views.py) encodes its responses with the process-wide encoder from get_encoder(),
+which is an instance of the class named by GRAPHQL_JSON_ENCODER, or by default:
+
+- OrjsonEncoder, if the optional orjson package is installed: several times faster than json, and
+  it serializes datetimes itself;
+- otherwise JSONEncoder, the standard library's json, with one reused json.JSONEncoder, so no
+  per-call encoder construction, and without escaping non-ASCII text.
+
+Both are compact, and serialize datetimes, dates and times (as ISO 8601), UUIDs and Decimals, as
+may appear in 'extensions' or custom scalars, directly rather than failing. Responses are only
+pretty-printed when shown in GraphiQL.
+
+An encoder has two methods: encode(data), returning the whole document as a str or bytes, and
+iterencode(data), returning it as an iterable of bytes chunks, for streaming responses.
+
+Streaming (GRAPHQL_STREAMING_RESPONSES): a large page's response exists twice at the end of a
+request, once as the result dicts, and once as the serialized document. A streaming response
+serializes the dicts as the server writes the response out, CHUNK_SIZE bytes at a time, so only
+one chunk of the serialized document exists at once. JSONEncoder streams with json's pure-Python
+iterencode(), which is slower than its C one-shot encoder, so this trades time for memory.
+orjson can't stream, so OrjsonEncoder's iterencode() is one chunk.
+"""
+
+import datetime
+import decimal
+import json
+import threading
+import uuid
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+CHUNK_SIZE = 64 * 1024
+
+
+def json_default(value):
+    """Serialize the values that json can't."""
+    if isinstance(value, (datetime.datetime, datetime.date, datetime.time)):
+        return value.isoformat()
+    if isinstance(value, (uuid.UUID, decimal.Decimal)):
+        return str(value)
+    raise TypeError('{!r} is not JSON serializable'.format(value))
+
+
+def chunked(pieces, size=CHUNK_SIZE):
+    """Gather the str `pieces` into UTF-8 chunks of at least `size` bytes (but the last)."""
+    buffer = []
+    length = 0
+    for piece in pieces:
+        buffer.append(piece)
+        length += len(piece)
+        if length >= size:
+            yield ''.join(buffer).encode()
+            buffer = []
+            length = 0
+    if buffer:
+        yield ''.join(buffer).encode()
+
+
+class JSONEncoder(object):
+    """Compact JSON, with the standard library's json."""
+    def __init__(self):
+        self.encoder = json.JSONEncoder(separators=(',', ':'), ensure_ascii=False,
+                                        default=json_default)
+
+    def encode(self, data):
+        return self.encoder.encode(data)
+
+    def iterencode(self, data):
+        return chunked(self.encoder.iterencode(data))
+
+
+class OrjsonEncoder(object):
+    """Compact JSON, with orjson."""
+    def __init__(self):
+        if orjson is None:
+            raise ImportError('OrjsonEncoder needs the orjson package')
+
+    def encode(self, data):
+        return orjson.dumps(data, default=json_default)
+
+    def iterencode(self, data):
+        return [self.encode(data)]
+
+
+encoder = None
+encoder_lock = threading.Lock()
+
+def get_encoder():
+    """Return the process-wide response encoder, creating it on first use."""
+    global encoder
+    with encoder_lock:
+        if encoder is None:
+            path = getattr(settings, 'GRAPHQL_JSON_ENCODER', None)
+            if path:
+                encoder = import_string(path)()
+            else:
+                encoder = OrjsonEncoder() if orjson is not None else JSONEncoder()
+        return encoder
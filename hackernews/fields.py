@@ -0,0 +1,146 @@
+# howtographql-graphene-tutorial-fixed -- hackernews/fields.py
+#
+# Copyright © 2017 Sean Bolton.
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE
+# LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION
+# WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+import functools
+
+from django.conf import settings
+from django.db.models.query import QuerySet
+from graphene import relay
+from graphene.relay.connection import PageInfo
+from graphql_relay.connection.arrayconnection import (connection_from_list_slice,
+                                                       get_offset_with_default)
+from promise import Promise, is_thenable
+
+from hackernews.deadline import check_deadline, deadline_errors
+from hackernews.rows import RowQuerySet, as_rows
+from hackernews.sharding import ConcatenatedQuerySet
+
+
+# ========== connection fields ==========
+
+# graphene's ConnectionField (2.0) calls len() on whatever its resolver returns, which for a
+# QuerySet means fetching every row, only to then return a page of them. QuerySetConnectionField
+# instead counts the rows with a COUNT query and fetches just the requested page with
+# LIMIT/OFFSET. When there are no 'first' or 'last' arguments, the whole list is wanted anyway, so
+# it is fetched with one query, and counted with len(). A ConcatenatedQuerySet, gathering rows from
+# several databases (see hackernews/sharding.py), is paginated the same way. A ConnectionSlice is a
+# page that a DataLoader has already fetched, along with the total count, for the arguments
+# connection_page() found (see users/schema.py).
+#
+# Either way, the count is kept on the connection as 'length', so that a custom field like
+# VoteConnection.count can use it without another query.
+#
+# Each connection is also where an operation that has run out of time stops (see
+# hackernews/deadline.py): the connection becomes an error, rather than more queries.
+#
+# With CONNECTION_ROWS enabled, the page's nodes are compact rows holding just the selected
+# columns, rather than model instances, where the node type allows it (see hackernews/rows.py).
+
+class ConnectionSlice(object):
+    """The rows of a connection from offset `start`, as fetched for connection_page()'s
+    arguments, of `length` rows in all.
+    """
+    __slots__ = ('items', 'start', 'length')
+
+    def __init__(self, items, start, length):
+        self.items = items
+        self.start = start
+        self.length = length
+
+
+def connection_page(args):
+    """Return the (offset, limit) of the rows that a connection's arguments select, with None
+    for no limit, or None if they count from the end ('last', 'before').
+    """
+    if args.get('last') is not None or args.get('before') is not None:
+        return None
+    return get_offset_with_default(args.get('after'), -1) + 1, args.get('first')
+
+
+def resolve_as_rows(resolver, node_type, root, info, **args):
+    resolved = resolver(root, info, **args)
+    if is_thenable(resolved):
+        # e.g. from a DataLoader
+        return Promise.resolve(resolved).then(lambda value: as_rows(value, node_type, info))
+    return as_rows(resolved, node_type, info)
+
+
+class QuerySetConnectionField(relay.ConnectionField):
+    @classmethod
+    def connection_resolver(cls, resolver, connection_type, root, info, **args):
+        check_deadline()
+        if getattr(settings, 'CONNECTION_ROWS', False):
+            resolver = functools.partial(resolve_as_rows, resolver, connection_type._meta.node)
+        # As graphene's ConnectionField.connection_resolver(), with deadline errors translated both
+        # here and in the then() of a resolver's Promise, which runs after this has returned.
+        def on_resolve(resolved):
+            with deadline_errors():
+                return cls.resolve_connection(connection_type, args, resolved)
+        with deadline_errors():
+            resolved = resolver(root, info, **args)
+        if is_thenable(resolved):
+            return Promise.resolve(resolved).then(on_resolve)
+        return on_resolve(resolved)
+
+    @classmethod
+    def resolve_connection(cls, connection_type, args, resolved):
+        if (isinstance(resolved, connection_type)
+                or not isinstance(resolved, (QuerySet, ConcatenatedQuerySet, RowQuerySet))):
+            if isinstance(resolved, ConnectionSlice):
+                return cls.resolve_slice(connection_type, args, resolved)
+            return super().resolve_connection(connection_type, args, resolved)
+        queryset = resolved
+        if args.get('first') is None and args.get('last') is None:
+            resolved = list(queryset)
+            length = len(resolved)
+        else:
+            length = queryset.count()
+        connection = connection_from_list_slice(
+            resolved,
+            args,
+            slice_start=0,
+            list_length=length,
+            list_slice_length=length,
+            connection_type=connection_type,
+            edge_type=connection_type.Edge,
+            pageinfo_type=PageInfo,
+        )
+        connection.iterable = queryset
+        connection.length = length
+        return connection
+
+    @staticmethod
+    def resolve_slice(connection_type, args, resolved):
+        connection = connection_from_list_slice(
+            resolved.items,
+            args,
+            slice_start=resolved.start,
+            list_length=resolved.length,
+            list_slice_length=len(resolved.items),
+            connection_type=connection_type,
+            edge_type=connection_type.Edge,
+            pageinfo_type=PageInfo,
+        )
+        connection.iterable = resolved.items
+        connection.length = resolved.length
+        return connection
@@ -0,0 +1,115 @@
+# howtographql-graphene-tutorial-fixed -- hackernews/handlers.py
+#
+# Copyright © 2017 Sean Bolton.
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE
+# LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION
+# WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+"""Per-path middleware profiles, so that /graphql/ doesn't pay for middleware it never uses.
+
+Django runs every request through the whole MIDDLEWARE stack. The GraphQL endpoint authenticates
+by bearer token (users.schema.get_user_from_auth_token()), and never looks at sessions, Django
+auth users, messages, CSRF cookies or frame options, so for it that stack is pure overhead. The
+MIDDLEWARE_PROFILES setting maps URL path prefixes to shorter middleware lists, and
+ProfiledWSGIHandler, the WSGI application in hackernews/wsgi.py, sends each request to a handler
+built with the list for its path (the longest matching prefix), or with MIDDLEWARE otherwise, so
+that /admin/ keeps the full stack.
+
+Leaving out CsrfViewMiddleware is safe for /graphql/ because CSRF attacks ride on cookies, and the
+endpoint ignores cookies: a forged cross-site request carries no bearer token. GraphiQL still gets
+its CSRF cookie from GraphQLView's own ensure_csrf_cookie decorator.
+
+The test client uses its own handler, with the full MIDDLEWARE stack. See
+benchmarks/middleware_overhead.py for the per-request time saved.
+"""
+
+import logging
+
+import django
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured, MiddlewareNotUsed
+from django.core.handlers.exception import convert_exception_to_response
+from django.core.handlers.wsgi import WSGIHandler
+from django.utils.module_loading import import_string
+
+logger = logging.getLogger('django.request')
+
+
+class MiddlewareProfileHandler(WSGIHandler):
+    """A WSGIHandler that runs the middleware in `middleware`, rather than settings.MIDDLEWARE."""
+
+    def __init__(self, middleware):
+        self.middleware = list(middleware)
+        super().__init__()
+
+    def load_middleware(self):
+        # the same as BaseHandler.load_middleware() (Django 1.11), for new-style middleware only
+        self._request_middleware = []
+        self._view_middleware = []
+        self._template_response_middleware = []
+        self._response_middleware = []
+        self._exception_middleware = []
+        handler = convert_exception_to_response(self._get_response)
+        for middleware_path in reversed(self.middleware):
+            middleware = import_string(middleware_path)
+            try:
+                mw_instance = middleware(handler)
+            except MiddlewareNotUsed as exc:
+                logger.debug('MiddlewareNotUsed(%r): %s', middleware_path, exc)
+                continue
+            if mw_instance is None:
+                raise ImproperlyConfigured(
+                    'Middleware factory {} returned None.'.format(middleware_path))
+            if hasattr(mw_instance, 'process_view'):
+                self._view_middleware.insert(0, mw_instance.process_view)
+            if hasattr(mw_instance, 'process_template_response'):
+                self._template_response_middleware.append(mw_instance.process_template_response)
+            if hasattr(mw_instance, 'process_exception'):
+                self._exception_middleware.append(mw_instance.process_exception)
+            handler = convert_exception_to_response(mw_instance)
+        self._middleware_chain = handler
+
+
+class ProfiledWSGIHandler(object):
+    """A WSGI application that picks the middleware profile by the request's path."""
+
+    def __init__(self, profiles=None):
+        if profiles is None:
+            profiles = getattr(settings, 'MIDDLEWARE_PROFILES', {})
+        self.default = WSGIHandler()
+        # longest prefix first, so that the most specific profile wins
+        self.profiles = [(prefix, MiddlewareProfileHandler(middleware))
+                         for prefix, middleware in sorted(profiles.items(),
+                                                          key=lambda item: -len(item[0]))]
+
+    def handler_for(self, path):
+        for prefix, handler in self.profiles:
+            if path.startswith(prefix):
+                return handler
+        return self.default
+
+    def __call__(self, environ, start_response):
+        handler = self.handler_for(environ.get('PATH_INFO', '/'))
+        return handler(environ, start_response)
+
+
+def get_wsgi_application():
+    """Like django.core.wsgi.get_wsgi_application(), returning a ProfiledWSGIHandler."""
+    django.setup(set_prefix=False)
+    return ProfiledWSGIHandler()
@@ -0,0 +1,103 @@
+# howtographql-graphene-tutorial-fixed -- hackernews/idempotency.py
+#
+# Copyright © 2017 Sean Bolton.
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE
+# LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION
+# WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+"""Idempotent Relay mutations, keyed by clientMutationId.
+
+Mobile clients retry mutations on flaky networks, and without help, each retry runs the whole
+mutation again (and createLink creates a duplicate link each time). Decorating a ClientIDMutation's
+mutate_and_get_payload() with @idempotent stores the fields of each successful payload in Django's
+cache, keyed by (auth token, mutation name, clientMutationId), for IDEMPOTENCY_TTL seconds. A replay
+within that window gets the stored payload back, without authenticating or touching any tables.
+
+Only requests carrying both a bearer token and a non-empty clientMutationId are cached, since
+without a token there is no way to tell one client's replay from another client's new request. The
+token, rather than the user, is part of the key precisely so that a replay needs no user lookup.
+Failed mutations are not cached, so retrying a failure runs the mutation again.
+
+A retry can arrive while the original request is still executing. So that the two don't both run
+the mutation, the key is first reserved with the cache's atomic add(), holding IN_PROGRESS for at
+most IDEMPOTENCY_LOCK_TIMEOUT seconds. Whichever request reserves it runs the mutation; the other
+polls the cache for up to IDEMPOTENCY_WAIT seconds for the payload, and then gives up with a
+"request in progress" error that the client can retry. If the mutation fails, the reservation is
+released, and a waiting request goes on to run the mutation itself.
+
+The cache alias is IDEMPOTENCY_CACHE. The default local-memory cache works within one process (and
+in tests); deployments with several worker processes should point it at a shared backend such as
+memcached or Redis, so that a retry landing on a different worker is still recognized.
+"""
+
+import functools
+import hashlib
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+
+
+# the value of a reserved key, until the payload replaces it
+IN_PROGRESS = 'idempotency:in-progress'
+
+POLL_INTERVAL = 0.05
+
+
+def get_idempotency_key(context, mutation_name, client_mutation_id):
+    """Return the cache key for a mutation request, or None if the request can't be made
+    idempotent.
+    """
+    auth = getattr(context, 'META', {}).get('HTTP_AUTHORIZATION', None)
+    if not client_mutation_id or not auth or not auth.startswith('Bearer '):
+        return None
+    digest = hashlib.sha256('\0'.join((auth[7:], mutation_name, client_mutation_id)).encode())
+    return 'idempotency:' + digest.hexdigest()
+
+
+def idempotent(mutate_and_get_payload):
+    """Decorator making a ClientIDMutation's mutate_and_get_payload() idempotent. Apply it beneath
+    @classmethod.
+    """
+    @functools.wraps(mutate_and_get_payload)
+    def wrapper(cls, root, info, **input):
+        key = get_idempotency_key(info.context, cls.__name__, input.get('client_mutation_id'))
+        if key is None:
+            return mutate_and_get_payload(cls, root, info, **input)
+        cache = caches[getattr(settings, 'IDEMPOTENCY_CACHE', 'default')]
+        deadline = time.monotonic() + getattr(settings, 'IDEMPOTENCY_WAIT', 5.0)
+        while not cache.add(key, IN_PROGRESS, getattr(settings, 'IDEMPOTENCY_LOCK_TIMEOUT', 30)):
+            fields = cache.get(key)
+            if fields is not None and fields != IN_PROGRESS:
+                return cls(**fields)
+            if time.monotonic() >= deadline:
+                raise Exception('This request is already in progress; retry it later.')
+            if fields is not None:
+                time.sleep(POLL_INTERVAL)
+            # otherwise, it was released after a failure (or expired): try to reserve it again
+        try:
+            payload = mutate_and_get_payload(cls, root, info, **input)
+        except Exception:
+            cache.delete(key)
+            raise
+        fields = {name: getattr(payload, name) for name in cls._meta.fields
+                  if name != 'client_mutation_id'}
+        cache.set(key, fields, getattr(settings, 'IDEMPOTENCY_TTL', 600))
+        return payload
+    return wrapper
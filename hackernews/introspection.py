@@ -0,0 +1,167 @@
+# howtographql-graphene-tutorial-fixed -- hackernews/introspection.py
+#
+# Copyright © 2017 Sean Bolton.
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE
+# LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION
+# WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+"""Introspection results and the schema SDL, computed once and served from memory.
+
+GraphiQL, the Relay compiler and schema-diff tools all send the full introspection query, which is
+the most expensive document we serve: it walks every type, field and argument in the schema. Its
+result can only change when the code does, so IntrospectionCache keeps it, already encoded as
+JSON, with an ETag (a hash of the JSON) so that GET requests can be answered with 304 Not Modified.
+
+Any query document whose operations select nothing but __schema, __type and __typename, with no
+variables, is answered from the cache. Documents are keyed by their printed AST, so the same query
+with different whitespace or comments shares an entry. The standard introspection query is
+computed when the cache is prepared (see hackernews/wsgi.py); other variants, such as GraphiQL's,
+are computed on first use.
+
+Computing the standard result at startup can be skipped altogether by running
+'./manage.py snapshot_schema' at build time, which writes schema.json (the introspection result,
+as the Relay compiler expects it) and schema.graphql (the SDL) to SCHEMA_SNAPSHOT_DIR. prepare()
+uses the snapshot only if its SDL matches the running schema, so a stale snapshot is ignored.
+"""
+
+import functools
+import hashlib
+import json
+import os
+import threading
+
+from django.conf import settings
+from graphql import print_ast
+from graphql.language.ast import Field, OperationDefinition
+from graphql.utils.introspection_query import introspection_query
+
+from hackernews.utils import parse_query
+
+INTROSPECTION_FIELDS = ('__schema', '__type', '__typename')
+
+
+class IntrospectionResult(object):
+    """A cached response body, and its ETag."""
+    __slots__ = ('body', 'etag')
+
+    def __init__(self, body):
+        self.body = body
+        self.etag = '"{}"'.format(hashlib.sha256(body.encode()).hexdigest())
+
+
+@functools.lru_cache(maxsize=256)
+def introspection_key(query, operation_name=None):
+    """Return the cache key for `query` if it is a pure introspection query, or None. It is asked
+    of every request, so the answers are cached.
+    """
+    if not query or '__' not in query:
+        return None
+    document = parse_query(query)
+    if document is None:
+        return None
+    for definition in document.definitions:
+        if not isinstance(definition, OperationDefinition):
+            continue
+        if definition.operation != 'query' or definition.variable_definitions:
+            return None
+        for selection in definition.selection_set.selections:
+            if (not isinstance(selection, Field) or
+                    selection.name.value not in INTROSPECTION_FIELDS):
+                return None
+    return '{}\0{}'.format(operation_name or '', print_ast(document))
+
+
+class IntrospectionCache(object):
+    """The introspection results of one schema, by query, plus its SDL."""
+
+    # Each variant of the introspection query gets an entry; more than a handful of different
+    # ones is a sign of someone making up queries, which are then not cached.
+    MAX_ENTRIES = 16
+
+    def __init__(self, schema):
+        self.schema = schema
+        self.results = {}
+        self.lock = threading.Lock()
+        self.sdl = None
+
+    def get_sdl(self):
+        """Return the schema SDL, and its ETag."""
+        if self.sdl is None:
+            self.sdl = IntrospectionResult(str(self.schema))
+        return self.sdl
+
+    def prepare(self, snapshot_dir=None):
+        """Compute, or load from a valid snapshot, the result of the standard introspection
+        query, and the SDL.
+        """
+        sdl = self.get_sdl().body
+        data = None
+        if snapshot_dir:
+            try:
+                with open(os.path.join(snapshot_dir, 'schema.graphql')) as f:
+                    if f.read() == sdl:
+                        with open(os.path.join(snapshot_dir, 'schema.json')) as f:
+                            data = json.load(f)['data']
+            except (OSError, ValueError, KeyError):
+                data = None
+        if data is not None:
+            self.store(introspection_key(introspection_query), data)
+        else:
+            self.get(introspection_query)
+
+    def store(self, key, data):
+        result = IntrospectionResult(json.dumps({'data': data}, separators=(',', ':')))
+        with self.lock:
+            if len(self.results) < self.MAX_ENTRIES:
+                self.results[key] = result
+        return result
+
+    def get(self, query, operation_name=None):
+        """Return the IntrospectionResult for `query`, or None if it isn't a pure introspection
+        query (or fails).
+        """
+        key = introspection_key(query, operation_name)
+        if key is None:
+            return None
+        result = self.results.get(key)
+        if result is None:
+            execution_result = self.schema.execute(query, operation_name=operation_name)
+            if execution_result.errors or execution_result.invalid:
+                return None
+            result = self.store(key, execution_result.data)
+        return result
+
+
+introspection_caches = {}
+introspection_caches_lock = threading.Lock()
+
+def get_introspection_cache(schema):
+    """Return the process-wide IntrospectionCache for `schema`."""
+    with introspection_caches_lock:
+        if schema not in introspection_caches:
+            introspection_caches[schema] = IntrospectionCache(schema)
+        return introspection_caches[schema]
+
+
+def prepare_introspection(schema=None):
+    """Fill the introspection cache of `schema` (by default, the GRAPHENE['SCHEMA']) at startup."""
+    if schema is None:
+        from graphene_django.settings import graphene_settings
+        schema = graphene_settings.SCHEMA
+    get_introspection_cache(schema).prepare(getattr(settings, 'SCHEMA_SNAPSHOT_DIR', None))
@@ -0,0 +1,52 @@
+# howtographql-graphene-tutorial-fixed -- hackernews/management/commands/snapshot_schema.py
+#
+# Copyright © 2017 Sean Bolton.
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE
+# LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION
+# WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+import json
+import os
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from graphene_django.settings import graphene_settings
+
+
+class Command(BaseCommand):
+    help = ('Write the schema introspection result (schema.json) and SDL (schema.graphql), for the '
+            'Relay compiler, schema-diff tooling, and the server to load at startup instead of '
+            'computing them (see hackernews/introspection.py).')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--output-dir', default=getattr(settings, 'SCHEMA_SNAPSHOT_DIR', None),
+                            help='The directory to write to (default: SCHEMA_SNAPSHOT_DIR).')
+
+    def handle(self, *args, **options):
+        output_dir = options['output_dir']
+        if not output_dir:
+            raise CommandError('No --output-dir given, and SCHEMA_SNAPSHOT_DIR is not set.')
+        os.makedirs(output_dir, exist_ok=True)
+        schema = graphene_settings.SCHEMA
+        with open(os.path.join(output_dir, 'schema.json'), 'w') as f:
+            json.dump({'data': schema.introspect()}, f, indent=2, sort_keys=True)
+            f.write('\n')
+        with open(os.path.join(output_dir, 'schema.graphql'), 'w') as f:
+            f.write(str(schema))
+        self.stdout.write('Wrote schema.json and schema.graphql to {}.'.format(output_dir))
@@ -0,0 +1,220 @@
+# howtographql-graphene-tutorial-fixed -- hackernews/nodecache.py
+#
+# Copyright © 2017 Sean Bolton.
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE
+# LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION
+# WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+"""A read-through cache of model rows, for Relay Node lookups by global id.
+
+Node.get_node_from_global_id() is behind Query.node, and behind createVote's and createLink's checks
+of the ids they are given, so a popular link is fetched by primary key thousands of times a minute.
+NodeCache keeps those rows in two tiers:
+
+- a small in-process LRU (NODE_CACHE_LOCAL_SIZE entries), which costs no network round trip, and
+- the NODE_CACHE Django cache backend, shared between worker processes when it is memcached or
+  Redis, whose entries live for NODE_CACHE_TTL seconds.
+
+What is cached is a tuple of column values, not a model instance, and every lookup builds a fresh
+instance from it, so callers are free to modify and save what they get.
+
+Counter columns, listed in a model's COUNTER_FIELDS, change with every vote, and are left out of
+the cached tuple. They come back as deferred fields, which Django loads from the database if and
+when they are read. This way record_votes() never has to invalidate anything, and createVote, which
+only needs a link's pk, created_at and posted_by, is served entirely from the cache.
+
+Every other change must invalidate the row. Saves and deletes do so through model signals, both
+immediately and again when the transaction commits, so that a concurrent reader can't re-cache the
+old row in between. Writes that bypass the signals (QuerySet.update(), bulk_create()) must call
+invalidate() themselves. Other processes' LRU tiers can't be reached, so local entries also expire
+after NODE_CACHE_LOCAL_TTL seconds, which bounds how stale they can get.
+
+Stampede protection: when a hot row is missing from both tiers, only one thread per process loads
+it (the others wait on a per-key lock and then find it in the LRU), and across processes, the first
+to add a lease key to the shared cache loads it while the others poll the shared tier briefly
+before giving up and querying the database themselves.
+"""
+
+import math
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.exceptions import ValidationError
+from django.db import router, transaction
+from django.db.models.signals import post_delete, post_save
+
+
+class NodeCache(object):
+    """A two-tier read-through cache of model rows, keyed by model and primary key."""
+
+    # the number of locks the keys are spread over, for per-key locking without a lock per key
+    LOCK_STRIPES = 64
+    # how long to wait for another process that holds the lease on a row, in seconds
+    LEASE_WAIT = 0.05
+    LEASE_POLL = 0.005
+
+    def __init__(self, cache_alias='default', ttl=300, local_size=1000, local_ttl=5.0):
+        self.cache_alias = cache_alias
+        self.ttl = ttl
+        self.local_size = local_size
+        self.local_ttl = local_ttl
+        self.fields = {}  # model -> the attnames of the columns that are cached
+        self.local = OrderedDict()  # key -> (expiry time, values), least recently used first
+        self.local_lock = threading.Lock()
+        self.key_locks = [threading.Lock() for _ in range(self.LOCK_STRIPES)]
+        # approximate counts, since they are updated without locking
+        self.stats = {'local_hits': 0, 'shared_hits': 0, 'misses': 0}
+
+    @property
+    def cache(self):
+        return caches[self.cache_alias] if self.cache_alias else None
+
+    def register(self, model):
+        """Cache `model`'s rows, and invalidate them whenever one is saved or deleted."""
+        counters = set(getattr(model, 'COUNTER_FIELDS', ()))
+        self.fields[model] = tuple(f.attname for f in model._meta.concrete_fields
+                                   if f.attname not in counters)
+        post_save.connect(self.on_change, sender=model, weak=False)
+        post_delete.connect(self.on_change, sender=model, weak=False)
+
+    @staticmethod
+    def make_key(model, pk):
+        return 'node:{}:{}'.format(model._meta.label_lower, pk)
+
+    def get(self, model, pk):
+        """Return the `model` instance with primary key `pk`, or None if there is none."""
+        try:
+            pk = model._meta.pk.to_python(pk)
+        except ValidationError:
+            return None
+        if pk is None:
+            return None
+        key = self.make_key(model, pk)
+        values = self.get_local(key)
+        if values is not None:
+            self.stats['local_hits'] += 1
+        else:
+            with self.key_locks[hash(key) % self.LOCK_STRIPES]:
+                values = self.get_local(key)  # another thread may have loaded it meanwhile
+                if values is None:
+                    values = self.get_shared(key)
+                    if values is not None:
+                        self.stats['shared_hits'] += 1
+                    else:
+                        self.stats['misses'] += 1
+                        values = self.load(model, pk, key)
+                        if values is None:
+                            return None
+                    self.set_local(key, values)
+        return model.from_db(router.db_for_read(model), self.fields[model], values)
+
+    def get_local(self, key):
+        if not self.local_size:
+            return None
+        with self.local_lock:
+            entry = self.local.get(key)
+            if entry is None:
+                return None
+            if entry[0] < time.monotonic():
+                del self.local[key]
+                return None
+            self.local.move_to_end(key)
+            return entry[1]
+
+    def set_local(self, key, values):
+        if not self.local_size:
+            return
+        with self.local_lock:
+            self.local[key] = (time.monotonic() + self.local_ttl, values)
+            self.local.move_to_end(key)
+            while len(self.local) > self.local_size:
+                self.local.popitem(last=False)
+
+    def get_shared(self, key):
+        cache = self.cache
+        return cache.get(key) if cache is not None else None
+
+    def load(self, model, pk, key):
+        """Fetch the row from the database, and store it in the shared tier."""
+        cache = self.cache
+        lease = key + ':lease'
+        # Cache timeouts are whole seconds (memcached truncates 0.5 to 0, which never expires), so
+        # that a lease whose holder died can't block the row's loading for ever.
+        lease_timeout = max(1, int(math.ceil(self.LEASE_WAIT * 10)))
+        leased = cache is not None and cache.add(lease, 1, lease_timeout)
+        if cache is not None and not leased:
+            deadline = time.monotonic() + self.LEASE_WAIT
+            while time.monotonic() < deadline:
+                time.sleep(self.LEASE_POLL)
+                values = cache.get(key)
+                if values is not None:
+                    return values
+        try:
+            # from the primary, since a lagging replica could re-cache a row that was just changed
+            rows = list(model._default_manager.db_manager(router.db_for_write(model))
+                        .filter(pk=pk).values_list(*self.fields[model])[:1])
+            if not rows:
+                return None
+            values = tuple(rows[0])
+            if cache is not None:
+                cache.set(key, values, self.ttl)
+            return values
+        finally:
+            if leased:
+                cache.delete(lease)
+
+    def invalidate(self, model, pks):
+        """Forget the cached rows of `model` with the primary keys `pks`."""
+        keys = [self.make_key(model, pk) for pk in pks]
+        with self.local_lock:
+            for key in keys:
+                self.local.pop(key, None)
+        cache = self.cache
+        if cache is not None:
+            cache.delete_many(keys)
+
+    def on_change(self, sender, instance, using=None, **kwargs):
+        pks = [instance.pk]
+        self.invalidate(sender, pks)
+        transaction.on_commit(lambda: self.invalidate(sender, pks), using=using)
+
+    def clear(self):
+        """Empty the in-process tier (the shared tier is left to expire)."""
+        with self.local_lock:
+            self.local.clear()
+
+
+node_cache = None
+node_cache_lock = threading.Lock()
+
+def get_node_cache():
+    """Return the process-wide NodeCache, creating it on first use."""
+    global node_cache
+    with node_cache_lock:
+        if node_cache is None:
+            node_cache = NodeCache(
+                cache_alias=getattr(settings, 'NODE_CACHE', 'default'),
+                ttl=getattr(settings, 'NODE_CACHE_TTL', 300),
+                local_size=getattr(settings, 'NODE_CACHE_LOCAL_SIZE', 1000),
+                local_ttl=getattr(settings, 'NODE_CACHE_LOCAL_TTL', 5.0),
+            )
+        return node_cache
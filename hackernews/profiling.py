@@ -0,0 +1,153 @@
+# howtographql-graphene-tutorial-fixed -- hackernews/profiling.py
+#
+# Copyright © 2017 Sean Bolton.
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE
+# LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION
+# WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+"""On-demand cProfile and tracemalloc capture of single GraphQL executions.
+
+When one particular request is slow, or allocates far too much, a staff user can have that request
+run under the profilers, on the real server, with its real data. A request asks for it with the
+header 'X-GraphQL-Profile', or the query parameter 'profile', set to a comma-separated list of:
+
+- 'cpu': run the execution under cProfile, and save the pstats dump, for pstats, snakeviz, etc.;
+- 'memory': trace the execution's allocations with tracemalloc, and save the
+  GRAPHQL_PROFILE_TOP_ALLOCATIONS source lines that allocated the most;
+
+or 'all' for both. The switch is only honored for requests authenticated with the token of a user
+with is_staff set, and only if GRAPHQL_PROFILE_DIR names the directory to save the results in;
+anyone else's request runs as usual. A profiled response says where its results went in
+'extensions':
+
+    "extensions": {"profile": {"id": "20171120T120000-3f2a9c1e",
+                               "files": ["20171120T120000-3f2a9c1e.pstats",
+                                         "20171120T120000-3f2a9c1e.memory.txt"]}}
+
+with the file names relative to GRAPHQL_PROFILE_DIR. Only the execution itself (resolvers and
+SQL) is profiled, not parsing, validation or serialization. cProfile only sees the request's own
+thread, which is where graphql-core's default executor resolves everything. tracemalloc is
+process-wide, so while it is running, concurrent requests' allocations are counted too (and every
+allocation in the process is slower).
+
+Requests that don't ask for profiling cost one header and one query parameter lookup.
+"""
+
+import cProfile
+import contextlib
+import datetime
+import logging
+import os
+import threading
+import tracemalloc
+import uuid
+
+from django.conf import settings
+
+from users.schema import get_user_from_auth_token
+
+logger = logging.getLogger(__name__)
+
+PROFILE_HEADER = 'HTTP_X_GRAPHQL_PROFILE'
+PROFILE_PARAMETER = 'profile'
+PROFILE_KINDS = ('cpu', 'memory')
+
+
+def requested_profiles(request):
+    """Return the kinds of profile that `request` asks for, and is allowed, if any."""
+    value = request.META.get(PROFILE_HEADER) or request.GET.get(PROFILE_PARAMETER)
+    if not value or not getattr(settings, 'GRAPHQL_PROFILE_DIR', None):
+        return ()
+    if value.strip() == 'all':
+        kinds = PROFILE_KINDS
+    else:
+        kinds = tuple(kind for kind in PROFILE_KINDS
+                      if kind in [v.strip() for v in value.split(',')])
+    try:
+        user = kinds and get_user_from_auth_token(request)
+    except Exception:  # an unknown token
+        return ()
+    return kinds if user and user.is_staff else ()
+
+
+# tracemalloc is process-wide, so it runs while any profiled execution needs it (and is left
+# alone if something else, such as PYTHONTRACEMALLOC, started it).
+memory_profiles = 0
+started_tracemalloc = False
+memory_profiles_lock = threading.Lock()
+
+def start_tracing_memory():
+    """Make sure tracemalloc is running, and return a snapshot of the allocations so far."""
+    global memory_profiles, started_tracemalloc
+    with memory_profiles_lock:
+        if memory_profiles == 0 and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            started_tracemalloc = True
+        memory_profiles += 1
+    return tracemalloc.take_snapshot()
+
+
+def stop_tracing_memory():
+    """Return a snapshot of the allocations so far, and stop tracemalloc if nothing else needs
+    it.
+    """
+    global memory_profiles, started_tracemalloc
+    snapshot = tracemalloc.take_snapshot()
+    with memory_profiles_lock:
+        memory_profiles -= 1
+        if memory_profiles == 0 and started_tracemalloc:
+            tracemalloc.stop()
+            started_tracemalloc = False
+    return snapshot
+
+
+@contextlib.contextmanager
+def profiling(kinds):
+    """Profile the block, as `kinds` say. Yields a dict, which is filled in afterwards with the
+    reference to the results: their 'id', and the names of their 'files'.
+    """
+    profile_id = '{:%Y%m%dT%H%M%S}-{}'.format(datetime.datetime.utcnow(), uuid.uuid4().hex[:8])
+    reference = {'id': profile_id, 'files': []}
+    profiler = cProfile.Profile() if 'cpu' in kinds else None
+    before = start_tracing_memory() if 'memory' in kinds else None
+    if profiler:
+        profiler.enable()
+    try:
+        yield reference
+    finally:
+        if profiler:
+            profiler.disable()
+        after = stop_tracing_memory() if before is not None else None
+        directory = settings.GRAPHQL_PROFILE_DIR
+        try:
+            os.makedirs(directory, exist_ok=True)
+            if profiler:
+                name = profile_id + '.pstats'
+                profiler.dump_stats(os.path.join(directory, name))
+                reference['files'].append(name)
+            if after is not None:
+                name = profile_id + '.memory.txt'
+                top = getattr(settings, 'GRAPHQL_PROFILE_TOP_ALLOCATIONS', 25)
+                with open(os.path.join(directory, name), 'w') as f:
+                    for stat in after.compare_to(before, 'lineno')[:top]:
+                        f.write('{}\n'.format(stat))
+                reference['files'].append(name)
+        except OSError:
+            logger.warning('Saving profile %s failed', profile_id, exc_info=True)
+            reference['error'] = 'The profile could not be saved.'
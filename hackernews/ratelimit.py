@@ -0,0 +1,186 @@
+# howtographql-graphene-tutorial-fixed -- hackernews/ratelimit.py
+#
+# Copyright © 2017 Sean Bolton.
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE
+# LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION
+# WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+"""Per-client rate limits and admission control for the GraphQL endpoint.
+
+Rate limits: each client (by bearer token, or by address for anonymous clients, see
+hackernews.utils.client_id()) has a token bucket per kind of operation, 'query' and 'mutation',
+configured by RATE_LIMITS as (tokens per second, bucket size). Each operation takes one token; a
+client that finds its bucket empty gets a 429 response, with a Retry-After header saying when the
+next token will be there. The bucket size is the burst a client may send after being idle. Rate
+limits are opt-in (RATE_LIMITS is empty by default): anonymous clients are keyed by REMOTE_ADDR,
+which behind a proxy is the proxy's address unless it is rewritten to the client's.
+
+By default the buckets live in each worker process (TokenBucket), so a client's budget is
+multiplied by the number of processes. With RATE_LIMIT_CACHE naming a cache shared by all the
+processes (memcached, Redis, ...), CacheTokenBucket enforces one budget across them. Django's
+cache API has no compare-and-set, so it approximates the bucket with a counter per fixed window of
+size / rate seconds, using the atomic add() and incr(): the same long-run rate, though a client
+can squeeze up to two buckets' worth into the moments around a window boundary.
+
+Admission control: AdmissionGate lets at most GRAPHQL_MAX_CONCURRENCY GraphQL requests per process
+execute at once. A request arriving at a full gate waits up to GRAPHQL_ADMISSION_TIMEOUT seconds
+for a slot, and is then turned away with a 503 and Retry-After: GRAPHQL_RETRY_AFTER. Under
+overload, clients get a fast answer that they can back off from, instead of queueing in the server
+until they time out, which would make them retry and add to the load.
+"""
+
+import math
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+
+from hackernews.utils import client_id
+
+
+# ========== rate limits ==========
+
+class TokenBucket(object):
+    """In-process token buckets, one per key: `rate` tokens per second, holding at most `size`.
+    Only the `max_keys` most recently used buckets are kept; a forgotten bucket starts full again.
+    """
+    def __init__(self, rate, size, max_keys=10000):
+        self.rate = rate
+        self.size = size
+        self.max_keys = max_keys
+        self.buckets = OrderedDict()  # key -> (tokens, time.monotonic() when counted)
+        self.lock = threading.Lock()
+
+    def take(self, key):
+        """Take a token from `key`'s bucket. Return 0 if there was one, or else the number of
+        seconds until there will be.
+        """
+        now = time.monotonic()
+        with self.lock:
+            tokens, then = self.buckets.pop(key, (self.size, now))
+            tokens = min(self.size, tokens + (now - then) * self.rate)
+            if tokens >= 1:
+                tokens -= 1
+                wait = 0
+            else:
+                wait = (1 - tokens) / self.rate
+            self.buckets[key] = (tokens, now)
+            if len(self.buckets) > self.max_keys:
+                self.buckets.popitem(last=False)
+        return wait
+
+
+class CacheTokenBucket(object):
+    """Approximate token buckets shared through the Django cache `cache_alias`; see above."""
+    def __init__(self, rate, size, cache_alias, prefix='ratelimit'):
+        self.rate = rate
+        self.size = size
+        self.window = size / rate
+        self.cache = caches[cache_alias]
+        self.prefix = prefix
+
+    def take(self, key):
+        now = time.time()
+        window = int(now // self.window)
+        cache_key = '{}:{}:{}'.format(self.prefix, key, window)
+        timeout = int(math.ceil(self.window)) + 1
+        self.cache.add(cache_key, 0, timeout)
+        try:
+            count = self.cache.incr(cache_key)
+        except ValueError:  # expired between add() and incr()
+            self.cache.add(cache_key, 1, timeout)
+            count = 1
+        if count <= self.size:
+            return 0
+        return (window + 1) * self.window - now
+
+
+class RateLimitExceeded(Exception):
+    def __init__(self, retry_after):
+        self.retry_after = max(1, int(math.ceil(retry_after)))
+        super().__init__('Rate limit exceeded, retry in {} second(s).'.format(self.retry_after))
+
+
+limiters = {}
+limiters_lock = threading.Lock()
+
+def get_rate_limiter(kind):
+    """Return the process-wide limiter for operations of `kind` ('query' or 'mutation'), or None
+    if they aren't limited.
+    """
+    with limiters_lock:
+        if kind not in limiters:
+            limit = (getattr(settings, 'RATE_LIMITS', None) or {}).get(kind)
+            cache_alias = getattr(settings, 'RATE_LIMIT_CACHE', None)
+            if not limit:
+                limiters[kind] = None
+            elif cache_alias:
+                limiters[kind] = CacheTokenBucket(*limit, cache_alias=cache_alias,
+                                                  prefix='ratelimit:' + kind)
+            else:
+                limiters[kind] = TokenBucket(*limit)
+        return limiters[kind]
+
+
+def check_rate_limit(request, kind):
+    """Raise RateLimitExceeded if `request`'s client has used up its budget for `kind`."""
+    limiter = get_rate_limiter(kind)
+    if limiter is not None:
+        wait = limiter.take(client_id(request))
+        if wait:
+            raise RateLimitExceeded(wait)
+
+
+# ========== admission control ==========
+
+class AdmissionGate(object):
+    """Admits at most `max_concurrency` callers at once (any number, if 0), making the others wait
+    for up to `timeout` seconds.
+    """
+    def __init__(self, max_concurrency, timeout=0.1):
+        self.semaphore = max_concurrency and threading.BoundedSemaphore(max_concurrency)
+        self.timeout = timeout
+        self.stats = {'admitted': 0, 'rejected': 0}
+
+    def enter(self):
+        """Return whether the caller was admitted; if so, it must call leave() when done."""
+        if self.semaphore and not self.semaphore.acquire(timeout=self.timeout):
+            self.stats['rejected'] += 1
+            return False
+        self.stats['admitted'] += 1
+        return True
+
+    def leave(self):
+        if self.semaphore:
+            self.semaphore.release()
+
+
+gate = None
+gate_lock = threading.Lock()
+
+def get_admission_gate():
+    """Return the process-wide AdmissionGate, creating it on first use."""
+    global gate
+    with gate_lock:
+        if gate is None:
+            gate = AdmissionGate(getattr(settings, 'GRAPHQL_MAX_CONCURRENCY', 0),
+                                 getattr(settings, 'GRAPHQL_ADMISSION_TIMEOUT', 0.1))
+        return gate
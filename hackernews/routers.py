@@ -0,0 +1,128 @@
+# howtographql-graphene-tutorial-fixed -- hackernews/routers.py
+#
+# Copyright © 2017 Sean Bolton.
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE
+# LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION
+# WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+"""Routing GraphQL queries to a read replica, and mutations to the primary database.
+
+With DATABASE_REPLICA_URL set, settings.py adds a 'replica' database (REPLICA_DATABASE), and
+ReplicaRouter sends reads to it, but only while a GraphQL query operation is being executed:
+hackernews/views.py runs each query operation inside reading_from_replica(), and each mutation
+inside reading_from_primary(). Everything else, such as the mutations' own reads (validation,
+duplicate checks), the write-behind flusher, management commands and cache fills (including the
+in-memory front page and leaderboard), reads from the primary, as does everything when no replica
+is configured. Writes always go to the primary.
+
+Replicas lag behind the primary, so a client that has just voted could reload the page and not
+see its vote. To give clients read-your-writes consistency, every mutation marks its client (by
+auth token, or by address for anonymous clients) as sticky in the STICKY_CACHE cache for
+REPLICA_STICKY_SECONDS, and a sticky client's queries read from the primary. The window should
+comfortably exceed the usual replication lag. Use a shared cache backend so that stickiness
+follows the client across worker processes.
+
+To try this locally with two SQLite files (without actual replication, the replica just has
+whatever was copied into it):
+
+    $ export DATABASE_URL=sqlite:///primary.sqlite3 DATABASE_REPLICA_URL=sqlite:///replica.sqlite3
+    $ ./manage.py migrate && ./manage.py migrate --database replica
+    $ ./manage.py test hackernews  # also runs the tests that need a replica
+"""
+
+import contextlib
+import threading
+
+from django.conf import settings
+from django.core.cache import caches
+
+from hackernews.utils import client_id
+
+PRIMARY = 'default'
+
+state = threading.local()
+
+
+def replica_database():
+    """Return the alias of the replica database, or None if there is none."""
+    return getattr(settings, 'REPLICA_DATABASE', None)
+
+
+@contextlib.contextmanager
+def reading_from(alias):
+    """Route this thread's reads to the database `alias` (None: the primary) in this block."""
+    previous = getattr(state, 'read_alias', None)
+    state.read_alias = alias
+    try:
+        yield
+    finally:
+        state.read_alias = previous
+
+
+def reading_from_primary():
+    return reading_from(None)
+
+
+def reading_from_replica(request=None):
+    """Route this thread's reads to the replica in this block, unless `request` comes from a
+    sticky client.
+    """
+    if request is not None and is_sticky(request):
+        return reading_from(None)
+    return reading_from(replica_database())
+
+
+# ========== read-your-writes stickiness ==========
+
+def sticky_key(request):
+    return 'db-sticky:' + client_id(request)
+
+
+def make_sticky(request):
+    """Send `request`'s client's reads to the primary for the next REPLICA_STICKY_SECONDS."""
+    if replica_database():
+        cache = caches[getattr(settings, 'STICKY_CACHE', 'default')]
+        cache.set(sticky_key(request), 1, getattr(settings, 'REPLICA_STICKY_SECONDS', 5))
+
+
+def is_sticky(request):
+    if not replica_database():
+        return False
+    cache = caches[getattr(settings, 'STICKY_CACHE', 'default')]
+    return cache.get(sticky_key(request)) is not None
+
+
+# ========== database router ==========
+
+class ReplicaRouter(object):
+    """Reads from the replica inside reading_from_replica(), and from the primary otherwise;
+    writes to the primary.
+    """
+    def db_for_read(self, model, **hints):
+        return getattr(state, 'read_alias', None) or PRIMARY
+
+    def db_for_write(self, model, **hints):
+        return PRIMARY
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # the replica holds the same rows as the primary
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return True
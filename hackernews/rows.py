@@ -0,0 +1,208 @@
+# howtographql-graphene-tutorial-fixed -- hackernews/rows.py
+#
+# Copyright © 2017 Sean Bolton.
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE
+# LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION
+# WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+"""Compact rows, rather than model instances, for the nodes of connection pages.
+
+For each edge of a LinkConnection or VoteConnection page, Django normally builds a full model
+instance, with its ModelState, its pre_init and post_init signals, and every column, only for the
+schema to read a few attributes from it. With CONNECTION_ROWS enabled, QuerySetConnectionField
+(see hackernews/fields.py) instead fetches just the columns that the query's 'edges { node { ... }
+}' selection needs, with values_list(), into instances of a small class with __slots__ for those
+columns, and nothing else.
+
+A row resolves like its model instance would, as far as the node type's fields go:
+
+- a model field's GraphQL field (e.g. 'createdAt') reads the column's attribute ('created_at');
+- 'pk' is the primary key;
+- a foreign key (e.g. Link.postedBy) is looked up through hackernews/nodecache.py, from its id
+  column ('posted_by_id'), rather than with a query per row.
+
+Fields with their own resolvers must say which columns those read, in the node type's ROW_COLUMNS
+(for example, Link.votes needs only the link's 'id'). If a selection includes a field that can't
+be resolved from columns, the page is fetched as model instances, as usual. The node types accept
+rows as their own through is_row_of() in their is_type_of().
+
+benchmarks/connection_rows.py compares the two paths' memory and throughput.
+"""
+
+import functools
+
+from django.db.models import QuerySet
+from graphene.utils.str_converters import to_camel_case
+from graphql.language import ast
+
+from hackernews.nodecache import get_node_cache
+from hackernews.sharding import ConcatenatedQuerySet
+
+
+class Row(object):
+    """The base class of the row classes made by row_class()."""
+    __slots__ = ()
+    model = None
+
+    def __init__(self, *values):
+        for name, value in zip(self.__slots__, values):
+            setattr(self, name, value)
+
+    def __repr__(self):
+        return '<{} row {}>'.format(self.model.__name__, self.pk)
+
+
+def related_object(field, self):
+    """Return the object that the foreign key `field` of the row `self` refers to."""
+    pk = getattr(self, field.attname)
+    if pk is None:
+        return None
+    model = field.related_model
+    if model in get_node_cache().fields:
+        return get_node_cache().get(model, pk)
+    return model._default_manager.filter(pk=pk).first()
+
+
+@functools.lru_cache(maxsize=None)
+def row_class(model, columns):
+    """Return the Row class holding the `columns` (attnames, a tuple) of `model`."""
+    pk_name = model._meta.pk.attname
+    namespace = {
+        '__slots__': columns,
+        'model': model,
+        'pk': property(lambda self: getattr(self, pk_name)),
+    }
+    for field in model._meta.concrete_fields:
+        if field.is_relation and field.attname in columns:
+            namespace[field.name] = property(functools.partial(related_object, field))
+    return type(model.__name__ + 'Row', (Row,), namespace)
+
+
+def is_row_of(root, model):
+    """Whether `root` is a Row of `model`."""
+    return isinstance(root, Row) and root.model is model
+
+
+# ========== what a selection needs ==========
+
+@functools.lru_cache(maxsize=None)
+def field_columns(node_type):
+    """Return a dict mapping the GraphQL field names of `node_type` (a DjangoObjectType) that can
+    be resolved from a Row to the columns that they need.
+    """
+    model = node_type._meta.model
+    columns = {'__typename': ()}
+    for field in model._meta.concrete_fields:
+        if not hasattr(node_type, 'resolve_' + field.name):
+            columns[to_camel_case(field.name)] = (field.attname,)
+    # DjangoObjectType's resolve_id() reads 'pk', which a Row has too
+    columns['id'] = (model._meta.pk.attname,)
+    columns.update(getattr(node_type, 'ROW_COLUMNS', {}))
+    return columns
+
+
+def selected_fields(selections, path, fragments):
+    """Return the names of the fields selected at `path` (a list of field names) below
+    `selections` (field ASTs, or their selection set's selections), following fragments.
+    """
+    names = set()
+    for selection in selections:
+        if isinstance(selection, ast.FragmentSpread):
+            names |= selected_fields(fragments[selection.name.value].selection_set.selections,
+                                     path, fragments)
+        elif isinstance(selection, ast.InlineFragment):
+            names |= selected_fields(selection.selection_set.selections, path, fragments)
+        elif not path:
+            names.add(selection.name.value)
+        elif selection.name.value == path[0] and selection.selection_set:
+            names |= selected_fields(selection.selection_set.selections, path[1:], fragments)
+    return names
+
+
+def node_columns(node_type, info):
+    """Return the columns that the connection field being resolved (per `info`) needs for each of
+    its nodes, or None if some of the selected fields can't be resolved from a Row.
+    """
+    fields = set()
+    for field_ast in info.field_asts:
+        if field_ast.selection_set:
+            fields |= selected_fields(field_ast.selection_set.selections, ['edges', 'node'],
+                                      info.fragments)
+    available = field_columns(node_type)
+    pk_name = node_type._meta.model._meta.pk.attname
+    columns = [pk_name]
+    for name in sorted(fields):
+        if name not in available:
+            return None
+        columns.extend(c for c in available[name] if c not in columns)
+    return tuple(columns)
+
+
+# ========== row querysets ==========
+
+class RowQuerySet(object):
+    """The rows of a QuerySet (or a ConcatenatedQuerySet) as instances of `row_class`, fetched
+    with values_list(). Like ConcatenatedQuerySet, it supports just what QuerySetConnectionField
+    and the connections' 'count' fields need: count(), iteration and slicing.
+    """
+    def __init__(self, queryset, row_class):
+        self.row_class = row_class
+        if isinstance(queryset, ConcatenatedQuerySet):
+            self.values = ConcatenatedQuerySet(self.values_list(qs) for qs in queryset.querysets)
+        else:
+            self.values = self.values_list(queryset)
+
+    def values_list(self, queryset):
+        # Django (1.11) can't ORDER BY an extra() select, such as links/search.py's search_rank,
+        # that isn't in the values_list(), so those come along too, after the row's columns, and
+        # are ignored.
+        columns = self.row_class.__slots__ + tuple(queryset.query.extra_select)
+        return queryset.prefetch_related(None).values_list(*columns)
+
+    def count(self):
+        return self.values.count()
+
+    def __len__(self):
+        return self.count()
+
+    def __iter__(self):
+        make_row = self.row_class
+        return (make_row(*values) for values in self.values)
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            make_row = self.row_class
+            return [make_row(*values) for values in self.values[key]]
+        return self.row_class(*self.values[key])
+
+
+def as_rows(resolved, node_type, info):
+    """Return `resolved` as a RowQuerySet, if it is a QuerySet of `node_type`'s model whose
+    selected fields can all be resolved from rows, or else `resolved` itself.
+    """
+    model = node_type._meta.model
+    if isinstance(resolved, ConcatenatedQuerySet):
+        if not all(qs.model is model for qs in resolved.querysets):
+            return resolved
+    elif not isinstance(resolved, QuerySet) or resolved.model is not model:
+        return resolved
+    columns = node_columns(node_type, info)
+    if columns is None:
+        return resolved
+    return RowQuerySet(resolved, row_class(model, columns))
@@ -38,8 +38,9 @@ INSTALLED_APPS = [
     'django.contrib.messages',
     'django.contrib.staticfiles',
     'graphene_django',
-    'links',
-    'users',
+    'hackernews.apps.HackernewsConfig',
+    'links.apps.LinksConfig',
+    'users.apps.UsersConfig',
 ]
 
 MIDDLEWARE = [
@@ -52,6 +53,16 @@ MIDDLEWARE = [
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
 
+# Requests whose path starts with one of these prefixes run the given middleware instead of
+# MIDDLEWARE (see hackernews/handlers.py). The GraphQL endpoint authenticates by bearer token, so
+# it needs no sessions, auth, messages, CSRF or clickjacking middleware.
+MIDDLEWARE_PROFILES = {
+    '/graphql/': [
+        'django.middleware.security.SecurityMiddleware',
+        'django.middleware.common.CommonMiddleware',
+    ],
+}
+
 ROOT_URLCONF = 'hackernews.urls'
 
 TEMPLATES = [
@@ -76,10 +87,63 @@ WSGI_APPLICATION = 'hackernews.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/1.11/ref/settings/#databases
 
+# The database is configured from the environment (see hackernews/database.py): DATABASE_URL is an
+# SQLite or Postgres URL, CONN_MAX_AGE is how long, in seconds, connections are kept open between
+# requests (0 to close them after each request), and CONN_HEALTH_CHECKS=0 disables the check of
+# persistent connections at the start of each request.
+
+from hackernews.database import parse_database_url
+
+CONN_MAX_AGE = int(os.environ.get('CONN_MAX_AGE', '60'))
+CONN_HEALTH_CHECKS = os.environ.get('CONN_HEALTH_CHECKS', '1') != '0'
+
 DATABASES = {
+    'default': parse_database_url(os.environ.get('DATABASE_URL', 'sqlite:///db.sqlite3'),
+                                  conn_max_age=CONN_MAX_AGE, base_dir=BASE_DIR),
+}
+
+# With DATABASE_REPLICA_URL, GraphQL queries read from this replica, while mutations and everything
+# else use the primary (see hackernews/routers.py). After a mutation, a client's queries keep
+# reading from the primary for REPLICA_STICKY_SECONDS, as recorded in the STICKY_CACHE cache.
+if os.environ.get('DATABASE_REPLICA_URL'):
+    DATABASES['replica'] = parse_database_url(os.environ['DATABASE_REPLICA_URL'],
+                                              conn_max_age=CONN_MAX_AGE, base_dir=BASE_DIR)
+    REPLICA_DATABASE = 'replica'
+else:
+    REPLICA_DATABASE = None
+REPLICA_STICKY_SECONDS = 5
+STICKY_CACHE = 'default'
+
+# With VOTE_SHARD_URLS, a comma-separated list of database URLs, votes are stored in those
+# databases, by a hash of the link id, rather than in the default one (see links/shards.py). Each
+# shard's vote ids start VOTE_SHARD_ID_SPAN above the previous shard's. The number and order of
+# the shards must not change once they hold votes.
+VOTE_SHARDS = []
+for i, url in enumerate(filter(None, os.environ.get('VOTE_SHARD_URLS', '').split(','))):
+    DATABASES['votes_{}'.format(i)] = parse_database_url(url.strip(), conn_max_age=CONN_MAX_AGE,
+                                                         base_dir=BASE_DIR)
+    VOTE_SHARDS.append('votes_{}'.format(i))
+VOTE_SHARD_ID_SPAN = 10 ** 12
+
+DATABASE_ROUTERS = ['links.shards.VoteShardRouter', 'hackernews.routers.ReplicaRouter']
+
+# PRAGMAs run on every new SQLite connection; see hackernews/database.py.
+SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'mmap_size': 256 * 1024 * 1024,
+    'busy_timeout': 5000,  # milliseconds
+}
+
+
+# Caches
+# https://docs.djangoproject.com/en/1.11/topics/cache/
+# The local-memory cache is per process; use a shared backend (memcached, Redis) in production so
+# that every worker process sees the same entries.
+
+CACHES = {
     'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': os.path.join(BASE_DIR, 'db.sqlite3'),
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
     }
 }
 
@@ -125,3 +189,133 @@ STATIC_URL = '/static/'
 GRAPHENE = {
     'SCHEMA': 'hackernews.schema.schema',
 }
+
+
+# ========== hackernews application settings ==========
+
+# The maximum number of items accepted by one bulk createLinks or createVotes mutation.
+BULK_MUTATION_MAX_ITEMS = 100
+
+# Write-behind vote ingestion: when enabled, createVote hands validated votes to a flusher thread
+# that writes them in batches, one transaction per batch. See links/votequeue.py for the
+# durability semantics. A batch is written when it reaches VOTE_WRITE_BEHIND_MAX_BATCH votes, or
+# VOTE_WRITE_BEHIND_MAX_DELAY seconds after its first vote; createVote gives up waiting for its
+# batch after VOTE_WRITE_BEHIND_TIMEOUT seconds.
+VOTE_WRITE_BEHIND = False
+VOTE_WRITE_BEHIND_MAX_BATCH = 100
+VOTE_WRITE_BEHIND_MAX_DELAY = 0.005
+VOTE_WRITE_BEHIND_TIMEOUT = 5.0
+
+# Idempotent mutations: successful createLink(s)/createVote(s) payloads are cached under
+# (auth token, mutation, clientMutationId) for IDEMPOTENCY_TTL seconds, in the IDEMPOTENCY_CACHE
+# cache, so that client retries return the original result. See hackernews/idempotency.py. A retry
+# arriving while the original is still executing waits up to IDEMPOTENCY_WAIT seconds for its
+# result; the original holds its key for at most IDEMPOTENCY_LOCK_TIMEOUT seconds.
+IDEMPOTENCY_CACHE = 'default'
+IDEMPOTENCY_TTL = 600
+IDEMPOTENCY_WAIT = 5.0
+IDEMPOTENCY_LOCK_TIMEOUT = 30
+
+# How long, in seconds, the result of the grouped query behind Viewer.topDomains is cached.
+TOP_DOMAINS_CACHE_TTL = 60
+
+# Whether createLink(s) return an existing link with the same canonical URL, rather than creating a
+# duplicate, when the request doesn't say (with 'returnExisting').
+RETURN_EXISTING_LINKS = False
+
+# The "gravity" with which a link's hot_score decays with age (see links/scores.py).
+HOT_SCORE_GRAVITY = 1.8
+
+# The cache of LinkModel and UserModel rows behind Relay Node lookups (see hackernews/nodecache.py):
+# rows are kept for NODE_CACHE_TTL seconds in the NODE_CACHE cache (None to disable this tier), and
+# the NODE_CACHE_LOCAL_SIZE most recently used of them for NODE_CACHE_LOCAL_TTL seconds in each
+# process (0 to disable this tier).
+NODE_CACHE = 'default'
+NODE_CACHE_TTL = 300
+NODE_CACHE_LOCAL_SIZE = 1000
+NODE_CACHE_LOCAL_TTL = 5.0
+
+# The in-memory window of the newest links that serves the front page (see links/frontpage.py):
+# it holds FRONT_PAGE_SIZE links, checks the database for other processes' new links and votes
+# every FRONT_PAGE_CHECK_INTERVAL seconds, and is reloaded at least every FRONT_PAGE_MAX_AGE seconds.
+FRONT_PAGE_SIZE = 100
+FRONT_PAGE_CHECK_INTERVAL = 1.0
+FRONT_PAGE_MAX_AGE = 60.0
+
+# The vote counts behind Viewer.topLinks (see links/leaderboard.py): the top LEADERBOARD_SIZE links
+# are ranked, other processes' votes are fetched every LEADERBOARD_SYNC_INTERVAL seconds, and the
+# counts are rebuilt from the votes table every LEADERBOARD_REBUILD_INTERVAL seconds.
+LEADERBOARD_SIZE = 100
+LEADERBOARD_SYNC_INTERVAL = 1.0
+LEADERBOARD_REBUILD_INTERVAL = 3600.0
+
+# Where './manage.py snapshot_schema' writes schema.json and schema.graphql, and where the server
+# looks for them at startup (see hackernews/introspection.py); None to always compute them.
+SCHEMA_SNAPSHOT_DIR = os.path.join(BASE_DIR, 'schema')
+
+# Whether hackernews/wsgi.py warms up the process before it serves requests, and whether that
+# process is a pre-fork master (e.g. gunicorn --preload) whose memory the workers will share; see
+# hackernews/warmup.py. WARMUP_QUERIES may be set to replace the default warm-up operations.
+WARMUP_ON_STARTUP = True
+WARMUP_PRE_FORK = False
+
+# Per-client rate limits on GraphQL operations, as (tokens per second, bucket size) for each kind
+# of operation, or None for no limit; see hackernews/ratelimit.py. The buckets are kept in each
+# process, unless RATE_LIMIT_CACHE names a cache shared by all of them. Rate limiting is off
+# unless enabled here, e.g.:
+#
+#     RATE_LIMITS = {
+#         'query': (20.0, 100),
+#         'mutation': (5.0, 50),
+#     }
+#
+# Anonymous clients are told apart by REMOTE_ADDR. Behind a reverse proxy or load balancer every
+# request comes from the proxy's address, so they would all share one bucket: only enable rate
+# limits there if the proxy (or a middleware trusted to read its X-Forwarded-For header) sets
+# REMOTE_ADDR to the real client address.
+RATE_LIMITS = {}
+RATE_LIMIT_CACHE = None
+
+# Admission control: at most GRAPHQL_MAX_CONCURRENCY GraphQL requests execute at once in each
+# process (0 for no limit). Others wait up to GRAPHQL_ADMISSION_TIMEOUT seconds, and then get a 503
+# response with Retry-After: GRAPHQL_RETRY_AFTER (seconds).
+GRAPHQL_MAX_CONCURRENCY = 16
+GRAPHQL_ADMISSION_TIMEOUT = 0.1
+GRAPHQL_RETRY_AFTER = 1
+
+# The time, in seconds, that one GraphQL operation may take (None for no limit). Once it is up,
+# the remaining connections resolve to errors, and running SQL statements are cancelled; see
+# hackernews/deadline.py.
+GRAPHQL_OPERATION_TIMEOUT = 10.0
+
+# Whether identical anonymous GraphQL queries that arrive while one of them is executing wait for
+# that execution and share its response, rather than each executing; see hackernews/coalescing.py.
+GRAPHQL_COALESCE_QUERIES = True
+# How often, in seconds, the counts of coalesced and executed queries are logged at INFO (None
+# for never).
+GRAPHQL_COALESCE_STATS_INTERVAL = 300
+
+# Apollo-tracing execution traces in the responses' extensions (see hackernews/tracing.py): staff
+# users' requests with the header 'X-GraphQL-Tracing: 1' are traced (anyone's, if
+# GRAPHQL_TRACING_HEADER is enabled, which is for development only), and a random
+# GRAPHQL_TRACING_SAMPLE_RATE fraction of the others are. With GRAPHQL_TRACING_FILE set, traces are
+# also appended to that file, one JSON object per line.
+GRAPHQL_TRACING_HEADER = False
+GRAPHQL_TRACING_SAMPLE_RATE = 0.0
+GRAPHQL_TRACING_FILE = None
+
+# The directory where staff users' on-demand profiles of their GraphQL requests are saved, or None
+# to ignore such requests; and the number of top allocation sites in a memory profile. See
+# hackernews/profiling.py.
+GRAPHQL_PROFILE_DIR = None
+GRAPHQL_PROFILE_TOP_ALLOCATIONS = 25
+
+# Whether connection pages fetch their nodes' selected columns into compact rows, rather than
+# building model instances, where the selection allows it; see hackernews/rows.py.
+CONNECTION_ROWS = False
+
+# The class that encodes GraphQL responses as JSON (None for the fastest available), and whether
+# responses are streamed as they are serialized, rather than serialized in full first; see
+# hackernews/encoders.py.
+GRAPHQL_JSON_ENCODER = None
+GRAPHQL_STREAMING_RESPONSES = False
@@ -0,0 +1,130 @@
+# howtographql-graphene-tutorial-fixed -- hackernews/sharding.py
+#
+# Copyright © 2017 Sean Bolton.
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE
+# LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION
+# WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+"""Generic helpers for storing one model's rows across several databases ("shards").
+
+links/shards.py uses these to spread VoteModel over the VOTE_SHARDS databases. Rows are assigned
+to a shard by hashing a key with shard_index(), and each shard's primary keys start at a different
+floor (set_id_floor()), so that a primary key is unique across shards and tells which shard holds
+the row. Because shard i's ids are all below shard i+1's, the rows of all the shards in id order
+are just each shard's rows in id order, one shard after the other, which is what
+ConcatenatedQuerySet pages through.
+
+Django has no distributed transactions: atomic() opens a transaction on each database, and
+commits them one after the other, so a failure between the commits leaves the later-entered
+databases committed and the others not. Callers order the databases so that the state that can be
+repaired afterwards (e.g. counters, by './manage.py recompute_scores --recount') commits last.
+"""
+
+import contextlib
+import zlib
+
+from django.db import connections, transaction
+
+
+def shard_index(key, n):
+    """Return the shard, 0 to n-1, for `key`. Unlike hash(), this is the same in every process."""
+    return zlib.crc32(str(key).encode()) % n
+
+
+@contextlib.contextmanager
+def atomic(*aliases):
+    """Like transaction.atomic(), on each of the databases `aliases` (None for the default
+    database), entered in the given order. The last one entered commits first.
+    """
+    with contextlib.ExitStack() as stack:
+        entered = set()
+        for alias in aliases:
+            alias = alias or 'default'
+            if alias not in entered:
+                entered.add(alias)
+                stack.enter_context(transaction.atomic(using=alias))
+        yield
+
+
+def set_id_floor(using, model, floor):
+    """Make new rows of `model` in database `using` get primary keys above `floor`, unless they
+    already do.
+    """
+    connection = connections[using]
+    table = model._meta.db_table
+    with connection.cursor() as cursor:
+        if connection.vendor == 'sqlite':
+            # AUTOINCREMENT tables keep their highest id in sqlite_sequence
+            cursor.execute('INSERT INTO sqlite_sequence (name, seq) SELECT %s, 0 WHERE NOT EXISTS '
+                           '(SELECT 1 FROM sqlite_sequence WHERE name = %s)', [table, table])
+            cursor.execute('UPDATE sqlite_sequence SET seq = %s WHERE name = %s AND seq < %s',
+                           [floor, table, floor])
+        elif connection.vendor == 'postgresql':
+            cursor.execute('SELECT setval(pg_get_serial_sequence(%s, %s), GREATEST(%s, '
+                           '(SELECT COALESCE(MAX({pk}), 0) FROM {table})))'.format(
+                               pk=connection.ops.quote_name(model._meta.pk.column),
+                               table=connection.ops.quote_name(table)),
+                           [table, model._meta.pk.column, floor])
+
+
+# ========== scatter-gather ==========
+
+class ConcatenatedQuerySet(object):
+    """The rows of several QuerySets (typically the same query on different shards), one QuerySet
+    after the other. It supports what QuerySetConnectionField and the connections' 'count' fields
+    need: count(), which adds up one COUNT query per QuerySet, iteration, and slicing, which only
+    queries the QuerySets that the slice overlaps, with LIMIT/OFFSET.
+    """
+    def __init__(self, querysets):
+        self.querysets = list(querysets)
+        self._counts = None
+
+    def counts(self):
+        if self._counts is None:
+            self._counts = [qs.count() for qs in self.querysets]
+        return self._counts
+
+    def count(self):
+        return sum(self.counts())
+
+    def __len__(self):
+        return self.count()
+
+    def __iter__(self):
+        for qs in self.querysets:
+            yield from qs
+
+    def __getitem__(self, key):
+        if not isinstance(key, slice):
+            rows = self[key:key + 1]
+            if not rows:
+                raise IndexError('ConcatenatedQuerySet index out of range')
+            return rows[0]
+        start, stop, step = key.indices(self.count())
+        assert step == 1, 'ConcatenatedQuerySet does not support slice steps'
+        rows = []
+        offset = 0
+        for qs, n in zip(self.querysets, self.counts()):
+            lo, hi = max(start - offset, 0), min(stop - offset, n)
+            if lo < hi:
+                rows.extend(qs[lo:hi])
+            offset += n
+            if offset >= stop:
+                break
+        return rows
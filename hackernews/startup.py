@@ -0,0 +1,161 @@
+# howtographql-graphene-tutorial-fixed -- hackernews/startup.py
+#
+# Copyright © 2017 Sean Bolton.
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE
+# LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION
+# WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+"""A report of where a worker's startup time goes, by phase and by imported module.
+
+Run it through './manage.py startup_report', which starts a fresh interpreter with
+'python -m hackernews.startup', since startup can only be measured in a process that hasn't
+started up yet.
+
+ImportTimer hooks into the import system (sys.meta_path) and times the execution of every module
+imported after it is installed. For each module it records the cumulative time, including the
+modules it imported in turn, and the self time, excluding them. (Python 3.7's '-X importtime'
+reports the same thing, but this works on Python 3.6 as well.) The phases are the steps that
+hackernews/wsgi.py goes through: configuring Django, building the WSGI application (which imports
+every app's models), importing the schema, and warming up (see hackernews/warmup.py).
+"""
+
+import argparse
+import os
+import sys
+import time
+from importlib.abc import MetaPathFinder
+
+
+class TimingLoader(object):
+    """Wraps a module loader, timing its exec_module()."""
+
+    def __init__(self, loader, timer):
+        self.loader = loader
+        self.timer = timer
+
+    def __getattr__(self, name):
+        return getattr(self.loader, name)
+
+    def create_module(self, spec):
+        return self.loader.create_module(spec)
+
+    def exec_module(self, module):
+        self.timer.stack.append(0.0)
+        start = time.perf_counter()
+        try:
+            self.loader.exec_module(module)
+        finally:
+            elapsed = time.perf_counter() - start
+            children = self.timer.stack.pop()
+            if self.timer.stack:
+                self.timer.stack[-1] += elapsed
+            self.timer.modules[module.__name__] = (elapsed, elapsed - children)
+
+
+class ImportTimer(MetaPathFinder):
+    """Times the import of every module imported while it is installed."""
+
+    def __init__(self):
+        self.modules = {}  # name -> (cumulative seconds, self seconds)
+        self.stack = []  # the time spent in nested imports, for each import in progress
+
+    def install(self):
+        sys.meta_path.insert(0, self)
+
+    def uninstall(self):
+        sys.meta_path.remove(self)
+
+    def find_spec(self, fullname, path, target=None):
+        for finder in sys.meta_path:
+            if finder is self or not hasattr(finder, 'find_spec'):
+                continue
+            spec = finder.find_spec(fullname, path, target)
+            if spec is not None:
+                if hasattr(spec.loader, 'exec_module'):
+                    spec.loader = TimingLoader(spec.loader, self)
+                return spec
+        return None
+
+    def top_level(self):
+        """Return the total self time of each top-level package's modules, in seconds."""
+        packages = {}
+        for name, (cumulative, self_time) in self.modules.items():
+            package = name.partition('.')[0]
+            packages[package] = packages.get(package, 0.0) + self_time
+        return packages
+
+
+def profile_startup(warm_up=True):
+    """Start up the application the way hackernews/wsgi.py does, and return the ImportTimer and
+    a list of (phase, seconds).
+    """
+    timer = ImportTimer()
+    timer.install()
+    phases = []
+    def phase(name, function):
+        start = time.perf_counter()
+        function()
+        phases.append((name, time.perf_counter() - start))
+    try:
+        os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'hackernews.settings')
+        import django
+        from django.conf import settings
+        phase('configure settings', lambda: settings.INSTALLED_APPS)
+        phase('set up Django (import apps and models)', django.setup)
+        def build_handler():
+            # hackernews/wsgi.py's, with its middleware profiles, see hackernews/handlers.py
+            from hackernews import handlers
+            return handlers.get_wsgi_application()
+        phase('build the WSGI handler (load middleware)', build_handler)
+        phase('import and build the schema', lambda: __import__('hackernews.schema'))
+        if warm_up:
+            from hackernews import warmup
+            phase('warm up (see hackernews/warmup.py)', lambda: warmup.warm_up(pre_fork=False))
+    finally:
+        timer.uninstall()
+    return timer, phases
+
+
+def format_report(timer, phases, top=25):
+    lines = ['Startup phases:']
+    for name, seconds in phases:
+        lines.append('  {:>9.1f} ms  {}'.format(seconds * 1000, name))
+    lines.append('  {:>9.1f} ms  total'.format(sum(seconds for _, seconds in phases) * 1000))
+    lines.append('')
+    lines.append('Import time by top-level package (self time of all its modules):')
+    packages = sorted(timer.top_level().items(), key=lambda item: item[1], reverse=True)
+    for package, seconds in packages[:top]:
+        lines.append('  {:>9.1f} ms  {}'.format(seconds * 1000, package))
+    lines.append('')
+    lines.append('Slowest modules to import:')
+    lines.append('  {:>12}  {:>12}  {}'.format('cumulative', 'self', 'module'))
+    modules = sorted(timer.modules.items(), key=lambda item: item[1][0], reverse=True)
+    for name, (cumulative, self_time) in modules[:top]:
+        lines.append('  {:>9.1f} ms  {:>9.1f} ms  {}'.format(
+            cumulative * 1000, self_time * 1000, name))
+    return '\n'.join(lines)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--top', type=int, default=25)
+    parser.add_argument('--no-warmup', dest='warm_up', action='store_false')
+    args = parser.parse_args()
+    timer, phases = profile_startup(warm_up=args.warm_up)
+    print(format_report(timer, phases, top=args.top))
@@ -0,0 +1,240 @@
+# howtographql-graphene-tutorial-fixed -- hackernews/tracing.py
+#
+# Copyright © 2017 Sean Bolton.
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE
+# LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION
+# WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+"""Apollo-tracing-compatible execution traces, in the responses' 'extensions'.
+
+Averages say which resolvers are slow in general, but not why one particular request was slow. A
+traced request gets the timing of every field resolver in its resolver tree (Link.votes,
+VoteConnection.count and all the rest) back in its response, in the Apollo tracing format[1]:
+
+    {"data": {...},
+     "extensions": {"tracing": {
+         "version": 1, "startTime": "2017-11-20T12:00:00.000Z", "endTime": "...", "duration": ns,
+         "execution": {"resolvers": [
+             {"path": ["viewer", "allLinks", "edges", 0, "node", "votes"], "parentType": "Link",
+              "fieldName": "votes", "returnType": "VoteConnection", "startOffset": ns,
+              "duration": ns},
+             ...]}}}}
+
+Offsets and durations are in nanoseconds from the start of the request's GraphQL handling. A
+resolver's duration ends when its value is ready (when its Promise resolves, for DataLoader-backed
+fields), not when the subtree below it is complete. The 'parsing' and 'validation' phases of the
+format are not reported separately; they are the time before the first resolver's startOffset.
+
+Which requests are traced (see hackernews/views.py):
+
+- a request sending the header 'X-GraphQL-Tracing: 1' with the auth token of a user with is_staff
+  set, or from any client at all with GRAPHQL_TRACING_HEADER enabled (for development only: a
+  trace exposes the server's timings, and a traced request is never coalesced);
+- in production, a random GRAPHQL_TRACING_SAMPLE_RATE fraction of all the others.
+
+Traced requests are never coalesced with others (see hackernews/coalescing.py), since their
+responses are their own. With GRAPHQL_TRACING_FILE set, every trace is also appended to that file,
+one JSON object per line, with the query and operation name, for offline analysis.
+
+Tracing adds a middleware to every field resolution, so it costs real time, but only for the
+requests being traced; the others run without it.
+
+[1] https://github.com/apollographql/apollo-tracing
+"""
+
+import datetime
+import json
+import logging
+import random
+import threading
+import time
+from collections import defaultdict, deque
+
+from django.conf import settings
+from graphql.language.ast import Field, FragmentSpread, InlineFragment
+from graphql.type.definition import get_named_type, is_leaf_type
+from promise import is_thenable
+
+from users.schema import get_user_from_auth_token
+
+logger = logging.getLogger(__name__)
+
+TRACING_HEADER = 'HTTP_X_GRAPHQL_TRACING'
+
+
+def format_time(moment):
+    """Return `moment` (a UTC datetime) in RFC 3339 format, like JavaScript's toISOString()."""
+    return moment.strftime('%Y-%m-%dT%H:%M:%S.%f')[:-3] + 'Z'
+
+
+class Tracer(object):
+    """Records the timing of one GraphQL request's field resolvers. It is a graphql-core
+    middleware, so is passed to the execution along with any others.
+    """
+    def __init__(self, query=None, operation_name=None):
+        self.query = query
+        self.operation_name = operation_name
+        self.start_time = datetime.datetime.utcnow()
+        self.start = time.perf_counter()
+        self.resolvers = []
+        # graphql-core (2.0) doesn't tell resolvers where they are in the response (ResolveInfo
+        # has no path), so each resolution of an object leaves its path for each of the fields
+        # selected beneath it, keyed by the object and the field's AST node, and each of those
+        # fields takes it when it is resolved. The same object can be at several paths (a
+        # singleton such as Viewer's True, a repeated list item, aliases of one field), so the
+        # paths queue up, and each resolution takes one. Entries keep their object alive, so
+        # that its id() can't be reused while they are queued.
+        self.paths = defaultdict(deque)  # (id(object), id(field AST)) -> deque of (object, path)
+        self.child_fields = {}  # ids of a field's AST nodes -> the Fields selected beneath it
+
+    def offset(self):
+        """Return the nanoseconds since the start of the trace."""
+        return int((time.perf_counter() - self.start) * 1e9)
+
+    def resolve(self, next, root, info, **args):
+        parent_path = []
+        if root is not info.root_value:
+            key = (id(root), id(info.field_asts[0]))
+            queued = self.paths.get(key)
+            if queued:
+                parent_path = queued.popleft()[1]
+                if not queued:
+                    del self.paths[key]
+        alias = info.field_asts[0].alias
+        path = parent_path + [alias.value if alias else info.field_name]
+        start = self.offset()
+        try:
+            result = next(root, info, **args)
+        except Exception:
+            self.record(path, info, start)
+            raise
+        if is_thenable(result):
+            def rejected(error):
+                self.record(path, info, start)
+                raise error
+            return result.then(lambda value: self.resolved(path, info, start, value), rejected)
+        return self.resolved(path, info, start, result)
+
+    def resolved(self, path, info, start, value):
+        self.record(path, info, start)
+        # Only values of object types have fields; scalars are never parents. (Viewer, for one,
+        # resolves to True.)
+        if value is None or is_leaf_type(get_named_type(info.return_type)):
+            return value
+        fields = self.get_child_fields(info)
+        if isinstance(value, (list, tuple)):
+            for index, item in enumerate(value):
+                self.leave_path(item, path + [index], fields)
+        else:
+            self.leave_path(value, path, fields)
+        return value
+
+    def leave_path(self, value, path, fields):
+        for field in fields:
+            self.paths[(id(value), id(field))].append((value, path))
+
+    def get_child_fields(self, info):
+        """Return the Field nodes selected beneath `info`'s field, including those in fragments.
+        (Fields of fragments on other types are included, and never resolved; finish() clears
+        their paths.)
+        """
+        key = tuple(id(field) for field in info.field_asts)
+        fields = self.child_fields.get(key)
+        if fields is None:
+            fields = []
+            selection_sets = [field.selection_set for field in info.field_asts
+                              if field.selection_set]
+            while selection_sets:
+                for selection in selection_sets.pop().selections:
+                    if isinstance(selection, Field):
+                        fields.append(selection)
+                    elif isinstance(selection, InlineFragment):
+                        selection_sets.append(selection.selection_set)
+                    elif isinstance(selection, FragmentSpread):
+                        fragment = info.fragments.get(selection.name.value)
+                        if fragment is not None:
+                            selection_sets.append(fragment.selection_set)
+            self.child_fields[key] = fields
+        return fields
+
+    def record(self, path, info, start):
+        self.resolvers.append({
+            'path': path,
+            'parentType': str(info.parent_type),
+            'fieldName': info.field_name,
+            'returnType': str(info.return_type),
+            'startOffset': start,
+            'duration': self.offset() - start,
+        })
+
+    def finish(self):
+        """Return the trace, in the Apollo tracing format, and append it to GRAPHQL_TRACING_FILE
+        if that is set.
+        """
+        duration = self.offset()
+        end_time = self.start_time + datetime.timedelta(microseconds=duration // 1000)
+        trace = {
+            'version': 1,
+            'startTime': format_time(self.start_time),
+            'endTime': format_time(end_time),
+            'duration': duration,
+            'execution': {'resolvers': self.resolvers},
+        }
+        self.paths.clear()
+        self.child_fields.clear()
+        path = getattr(settings, 'GRAPHQL_TRACING_FILE', None)
+        if path:
+            append_trace(path, {'operationName': self.operation_name, 'query': self.query,
+                                'tracing': trace})
+        return trace
+
+
+def start_tracing(request, query=None, operation_name=None):
+    """Return a Tracer if `request` is to be traced, or else None."""
+    if request.META.get(TRACING_HEADER) == '1' and (
+            getattr(settings, 'GRAPHQL_TRACING_HEADER', False) or is_staff(request)):
+        return Tracer(query, operation_name)
+    rate = getattr(settings, 'GRAPHQL_TRACING_SAMPLE_RATE', 0)
+    if rate and random.random() < rate:
+        return Tracer(query, operation_name)
+    return None
+
+
+def is_staff(request):
+    try:
+        user = get_user_from_auth_token(request)
+    except Exception:  # an unknown token
+        return False
+    return bool(user and user.is_staff)
+
+
+# ========== trace file ==========
+
+trace_file_lock = threading.Lock()
+
+def append_trace(path, record):
+    """Append `record` to the file at `path`, as one line of JSON. Failing to write a trace is no
+    reason to fail the request, so errors are only logged.
+    """
+    line = json.dumps(record, separators=(',', ':')) + '\n'
+    try:
+        with trace_file_lock, open(path, 'a') as f:
+            f.write(line)
+    except OSError:
+        logger.warning('Writing a trace to %s failed', path, exc_info=True)
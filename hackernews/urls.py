@@ -16,16 +16,16 @@ Including another URLconf
 from django.conf.urls import url
 from django.contrib import admin
 from django.views.decorators.csrf import csrf_exempt
-from graphene_django.views import GraphQLView
 
-from .settings import DEBUG
+from .views import GraphQLView, schema_sdl
 
+# The GraphQL endpoint is a token-authenticated API: clients send their token in an
+# 'Authorization: Bearer ...' header, and no session or other cookie identifies them. A cross-site
+# request can't add that header, so CSRF protection has nothing to protect there, and the view is
+# exempt from it (the /graphql/ middleware profile doesn't run CsrfViewMiddleware anyway; see
+# MIDDLEWARE_PROFILES in settings.py). The admin, which does use sessions, keeps its protection.
 urlpatterns = [
     url(r'^admin/', admin.site.urls),
+    url(r'^graphql/schema\.graphql$', schema_sdl),
+    url(r'^graphql/', csrf_exempt(GraphQLView.as_view(graphiql=True))),
 ]
-
-# Disable CSRF protection only if we're in development mode.
-if DEBUG:
-    urlpatterns.append(url(r'^graphql/', csrf_exempt(GraphQLView.as_view(graphiql=True))))
-else:
-    urlpatterns.append(url(r'^graphql/', GraphQLView.as_view(graphiql=True)))
@@ -21,11 +21,17 @@
 # OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION
 # WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
 
+import functools
+import hashlib
 import logging
+import sqlite3
 import sys
 import traceback
 
+from django.db import connections, router, transaction
+from django.db.models import prefetch_related_objects
 from graphql.error import GraphQLError
+from graphql.language.parser import parse
 
 
 # ========== graphql-core exception reporting ==========
@@ -96,3 +102,142 @@ def format_graphql_errors(errors):
         else:
             text.append(repr(e) + '\n')
     return ''.join(text)
+
+
+# ========== query documents ==========
+
+@functools.lru_cache(maxsize=256)
+def parse_query(query):
+    """Return the parsed Document of `query`, or None if it doesn't parse. Clients send the same
+    few documents over and over, so the view's checks on them (introspection_key(),
+    operation_type()) share one cached parse. The Document is shared: don't modify it.
+    """
+    try:
+        return parse(query)
+    except GraphQLError:
+        return None
+
+
+# ========== database helpers ==========
+
+def bulk_create_with_pks(model, objs, using=None, natural_key=None):
+    """Insert `objs` with a single bulk_create(), in one transaction, and make sure each of them
+    comes back with its primary key set, so that they can be returned as Relay nodes.
+
+    Django (1.11) only sets primary keys after bulk_create() on backends that can return them from
+    the INSERT (i.e. PostgreSQL). On SQLite, we rely on the fact that once our INSERT has taken the
+    database write lock, no other writer can insert until we commit, so the newest len(objs) rows
+    are ours, in insertion order. Other databases (MySQL, ...) let concurrent transactions insert
+    rows in between ours, so there the rows are fetched back by `natural_key`, a tuple of field
+    names identifying them, from among the rows newer than any before the INSERT. Rows with the same
+    natural key must be interchangeable, so it has to include every field the caller will read
+    back. Without one, ValueError is raised rather than guessing.
+    """
+    objs = list(objs)
+    if not objs:
+        return objs
+    using = using or router.db_for_write(model)
+    connection = connections[using]
+    if connection.features.can_return_ids_from_bulk_insert:
+        model.objects.using(using).bulk_create(objs)
+        return objs
+    if connection.vendor != 'sqlite' and not natural_key:
+        raise ValueError("Can't tell the primary keys of {} rows after a bulk insert on {} "
+                         "without a natural key".format(model.__name__, connection.vendor))
+    queryset = model.objects.using(using)
+    with transaction.atomic(using=using):
+        if connection.vendor == 'sqlite':
+            queryset.bulk_create(objs)
+            pks = list(reversed(queryset.order_by('-pk').values_list('pk', flat=True)[:len(objs)]))
+        else:
+            floor = queryset.order_by('-pk').values_list('pk', flat=True).first() or 0
+            queryset.bulk_create(objs)
+            keys = [tuple(getattr(obj, name) for name in natural_key) for obj in objs]
+            new = {}
+            for row in (queryset.filter(pk__gt=floor, **{natural_key[0] + '__in':
+                                                         set(key[0] for key in keys)})
+                        .order_by('pk').values_list('pk', *natural_key)):
+                new.setdefault(row[1:], []).append(row[0])
+            # rows with the same key are alike (see above), so any of them will do for any of ours
+            pks = [new[key].pop(0) if new.get(key) else None for key in keys]
+            if None in pks:
+                raise ValueError("Can't find the {} rows just inserted by {}".format(
+                    model.__name__, natural_key))
+        for obj, pk in zip(objs, pks):
+            obj.pk = pk
+            obj._state.adding = False
+            obj._state.db = using
+    return objs
+
+
+def supports_window_functions(using):
+    """Whether database `using` has ROW_NUMBER() OVER (...), which Django (1.11) doesn't know."""
+    connection = connections[using]
+    if connection.vendor == 'postgresql':
+        return True
+    if connection.vendor == 'sqlite':
+        return sqlite3.sqlite_version_info >= (3, 25, 0)
+    if connection.vendor == 'mysql':
+        return connection.mysql_version >= (8, 0)
+    return False
+
+
+def ranked_rows(queryset, partition_column, start=0, stop=None):
+    """Return the instances of `queryset` ranked start+1 to `stop` (or on, if None) by the
+    QuerySet's ordering within each value of `partition_column` (an attribute name such as
+    'posted_by_id'), with one query, using ROW_NUMBER(). That is, a page of each group's rows,
+    where slicing the QuerySet would give a page of all of them. Related objects that the QuerySet
+    would select or prefetch are prefetched. Check supports_window_functions() first.
+    """
+    model = queryset.model
+    using = queryset.db
+    connection = connections[using]
+    quote = connection.ops.quote_name
+
+    def column(name):
+        return quote(model._meta.pk.column if name == 'pk' else model._meta.get_field(name).column)
+
+    ordering = ', '.join(
+        column(name.lstrip('-')) + (' DESC' if name.startswith('-') else ' ASC')
+        for name in queryset.query.order_by)
+    attnames = [field.attname for field in model._meta.concrete_fields]
+    inner = queryset.order_by().values_list(*attnames)
+    sql, params = inner.query.get_compiler(using=using).as_sql()
+    sql = ('SELECT * FROM (SELECT page.*, ROW_NUMBER() OVER (PARTITION BY page.{partition} '
+           'ORDER BY {ordering}) AS row_rank FROM ({sql}) page) ranked '
+           'WHERE row_rank > %s{stop} ORDER BY {partition}, row_rank').format(
+               partition=column(partition_column), ordering=ordering or column('pk'), sql=sql,
+               stop=' AND row_rank <= %s' if stop is not None else '')
+    params = tuple(params) + (start,) + ((stop,) if stop is not None else ())
+    rows = list(model._default_manager.db_manager(using).raw(sql, params))
+    related = list(queryset._prefetch_related_lookups)
+    if isinstance(queryset.query.select_related, dict):
+        related.extend(queryset.query.select_related)
+    if related:
+        prefetch_related_objects(rows, *related)
+    return rows
+
+
+# ========== per-request state ==========
+
+def get_request_cache(context):
+    """Return a dict for caching things (such as DataLoaders) for the duration of one GraphQL
+    request, identified by its context (normally the Django HttpRequest). Without a context, the
+    dict is fresh on every call, i.e. nothing is cached.
+    """
+    if context is None:
+        return {}
+    try:
+        return context._hackernews_request_cache
+    except AttributeError:
+        context._hackernews_request_cache = {}
+        return context._hackernews_request_cache
+
+
+def client_id(request):
+    """Return an opaque, stable identifier for the client making `request`: a hash of its bearer
+    token, or, for anonymous clients, of its address.
+    """
+    auth = request.META.get('HTTP_AUTHORIZATION', '')
+    client = auth if auth.startswith('Bearer ') else request.META.get('REMOTE_ADDR', '')
+    return hashlib.sha256(client.encode()).hexdigest()
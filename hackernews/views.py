@@ -0,0 +1,246 @@
+# howtographql-graphene-tutorial-fixed -- hackernews/views.py
+#
+# Copyright © 2017 Sean Bolton.
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE
+# LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION
+# WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+import functools
+import json
+
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseNotModified, StreamingHttpResponse
+from graphene_django.settings import graphene_settings
+from graphene_django.views import GraphQLView as BaseGraphQLView
+from graphql.execution.middleware import MiddlewareManager
+from graphql.utils.get_operation_ast import get_operation_ast
+
+from hackernews.coalescing import get_single_flight
+from hackernews.deadline import deadline
+from hackernews.encoders import get_encoder, json_default
+from hackernews.introspection import get_introspection_cache
+from hackernews.profiling import profiling, requested_profiles
+from hackernews.ratelimit import RateLimitExceeded, check_rate_limit, get_admission_gate
+from hackernews.routers import (is_sticky, make_sticky, reading_from_primary,
+                                reading_from_replica)
+from hackernews.tracing import start_tracing
+from hackernews.utils import parse_query
+
+
+def etag_matches(request, etag):
+    """Whether `request` is a GET with an If-None-Match header matching `etag`."""
+    if request.method not in ('GET', 'HEAD'):
+        return False
+    if_none_match = request.META.get('HTTP_IF_NONE_MATCH', '')
+    return if_none_match.strip() == '*' or etag in [t.strip() for t in if_none_match.split(',')]
+
+
+def error_response(status, message, retry_after=None):
+    """Return a GraphQL-style JSON error response."""
+    response = HttpResponse(json.dumps({'errors': [{'message': message}]}), status=status,
+                            content_type='application/json')
+    if retry_after is not None:
+        response['Retry-After'] = str(retry_after)
+    return response
+
+
+@functools.lru_cache(maxsize=256)
+def operation_type(query, operation_name):
+    """Return the type ('query', 'mutation', ...) of the operation that executing `query` would
+    run, or None if it wouldn't run one. Clients send the same few documents over and over, so the
+    answers are cached (and the parse is shared with introspection_key()).
+    """
+    document = query and parse_query(query)
+    if not document:
+        return None
+    operation = get_operation_ast(document, operation_name)
+    return operation and operation.operation
+
+
+def can_coalesce(request, query, operation_name):
+    """Whether `request` may share its response with identical ones (see
+    hackernews/coalescing.py): an anonymous, non-sticky client's query operation.
+    """
+    return (getattr(settings, 'GRAPHQL_COALESCE_QUERIES', False)
+            and 'HTTP_AUTHORIZATION' not in request.META
+            and operation_type(query, operation_name) == 'query'
+            and not is_sticky(request))
+
+
+class GatedChunks(object):
+    """The chunks of a streamed response, which leaves the admission gate (see
+    hackernews/ratelimit.py) once they have all been sent, or the response is closed, since the
+    request is using the worker until then.
+    """
+    def __init__(self, chunks, gate):
+        self.chunks = chunks
+        self.gate = gate
+
+    def __iter__(self):
+        try:
+            yield from self.chunks
+        finally:
+            self.close()
+
+    def close(self):
+        # StreamingHttpResponse.close() calls this, even if the chunks were never iterated over
+        gate, self.gate = self.gate, None
+        if gate is not None:
+            gate.leave()
+
+
+# ========== GraphQL view ==========
+
+class GraphQLView(BaseGraphQLView):
+    """graphene-django's GraphQLView, answering introspection queries from memory (see
+    hackernews/introspection.py), routing queries to the read replica, if there is one (see
+    hackernews/routers.py), applying rate limits and admission control (see
+    hackernews/ratelimit.py), limiting each operation to GRAPHQL_OPERATION_TIMEOUT seconds
+    (see hackernews/deadline.py), coalescing identical concurrent anonymous queries (see
+    hackernews/coalescing.py), adding execution traces to the responses of traced requests (see
+    hackernews/tracing.py), profiling executions on staff users' demand (see
+    hackernews/profiling.py), and encoding responses with the pluggable encoder of
+    hackernews/encoders.py, optionally streaming them.
+    """
+    def execute(self, document, **kwargs):
+        request = kwargs.get('context_value')
+        kinds = request is not None and requested_profiles(request)
+        if kinds:
+            with profiling(kinds) as profile:
+                request.profile = profile  # filled in when profiling ends
+                return self.execute_operation(document, request, **kwargs)
+        return self.execute_operation(document, request, **kwargs)
+
+    def execute_operation(self, document, request, **kwargs):
+        operation = get_operation_ast(document, kwargs.get('operation_name'))
+        is_mutation = operation is not None and operation.operation == 'mutation'
+        if request is not None and not getattr(request, 'rate_limit_checked', False):
+            try:
+                check_rate_limit(request, 'mutation' if is_mutation else 'query')
+            except RateLimitExceeded as e:
+                request.retry_after = e.retry_after  # for dispatch(), to make this a 429
+                raise
+        timeout = getattr(settings, 'GRAPHQL_OPERATION_TIMEOUT', None)
+        if is_mutation:
+            with reading_from_primary(), deadline(timeout):
+                result = super().execute(document, **kwargs)
+            if request is not None:
+                make_sticky(request)
+            return result
+        with reading_from_replica(request), deadline(timeout):
+            return super().execute(document, **kwargs)
+
+    def get_response(self, request, data, show_graphiql=False):
+        if not self.batch and not show_graphiql:
+            query, variables, operation_name, _ = self.get_graphql_params(request, data)
+            result = get_introspection_cache(self.schema).get(query, operation_name)
+            if result is not None:
+                request.introspection_etag = result.etag
+                return result.body, 200
+            request.tracer = start_tracing(request, query, operation_name)
+            if request.tracer is None and can_coalesce(request, query, operation_name):
+                # Charge every client for its own request, even when it doesn't execute.
+                try:
+                    check_rate_limit(request, 'query')
+                except RateLimitExceeded as e:
+                    request.retry_after = e.retry_after
+                    return self.json_encode(request, {'errors': [self.format_error(e)]}), 400
+                request.rate_limit_checked = True
+                key = (query, json.dumps(variables, sort_keys=True), operation_name)
+                return get_single_flight().do(key, functools.partial(
+                    super().get_response, request, data, show_graphiql))
+            # (a shared, coalesced response has to exist in full anyway, so isn't streamed)
+            request.stream_response = getattr(settings, 'GRAPHQL_STREAMING_RESPONSES', False)
+        return super().get_response(request, data, show_graphiql)
+
+    def get_middleware(self, request):
+        tracer = getattr(request, 'tracer', None)
+        if tracer is None:
+            return self.middleware
+        # The tracer goes last, so it is outermost, and times the other middleware too; it passes
+        # Promises through itself, so needn't have every value wrapped in one.
+        return MiddlewareManager(*(self.middleware or []), tracer, wrap_in_promise=False)
+
+    def json_encode(self, request, d, pretty=False):
+        extensions = {}
+        tracer = getattr(request, 'tracer', None)
+        if tracer is not None:
+            request.tracer = None
+            extensions['tracing'] = tracer.finish()
+        profile = getattr(request, 'profile', None)
+        if profile is not None:
+            request.profile = None
+            extensions['profile'] = profile
+        if extensions:
+            d = dict(d, extensions=extensions)
+        if pretty or self.pretty:  # only for GraphiQL
+            return json.dumps(d, sort_keys=True, indent=2, separators=(',', ': '),
+                              default=json_default)
+        if getattr(request, 'stream_response', False):
+            # dispatch() streams the chunks instead of this (empty) content
+            request.stream_response = False
+            request.response_chunks = get_encoder().iterencode(d)
+            return ''
+        content = get_encoder().encode(d)
+        # batches are joined as str
+        return content.decode() if self.batch and isinstance(content, bytes) else content
+
+    def dispatch(self, request, *args, **kwargs):
+        gate = get_admission_gate()
+        if not gate.enter():
+            return error_response(503, 'The server is too busy, please retry later.',
+                                  getattr(settings, 'GRAPHQL_RETRY_AFTER', 1))
+        try:
+            response = super().dispatch(request, *args, **kwargs)
+            chunks = getattr(request, 'response_chunks', None)
+            if chunks is not None:
+                # the body is generated after this returns, and the gate is left after that
+                chunks, gate = GatedChunks(chunks, gate), None
+                streaming = StreamingHttpResponse(chunks, status=response.status_code)
+                for header, value in response.items():
+                    streaming[header] = value
+                streaming.cookies = response.cookies
+                response = streaming
+        finally:
+            if gate is not None:
+                gate.leave()
+        retry_after = getattr(request, 'retry_after', None)
+        if retry_after:
+            response.status_code = 429
+            response['Retry-After'] = str(retry_after)
+            return response
+        etag = getattr(request, 'introspection_etag', None)
+        if etag and response.status_code == 200:
+            if etag_matches(request, etag):
+                response = HttpResponseNotModified()
+            response['ETag'] = etag
+        return response
+
+
+# ========== schema SDL ==========
+
+def schema_sdl(request):
+    """Serve the schema in GraphQL SDL, for schema-diff tooling and the Relay compiler."""
+    sdl = get_introspection_cache(graphene_settings.SCHEMA).get_sdl()
+    if etag_matches(request, sdl.etag):
+        response = HttpResponseNotModified()
+    else:
+        response = HttpResponse(sdl.body, content_type='text/plain; charset=utf-8')
+    response['ETag'] = sdl.etag
+    return response
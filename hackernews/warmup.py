@@ -0,0 +1,135 @@
+# howtographql-graphene-tutorial-fixed -- hackernews/warmup.py
+#
+# Copyright © 2017 Sean Bolton.
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE
+# LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION
+# WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+"""Warming up a worker before its first request.
+
+A freshly started worker process has to import graphene and graphql-core, build the schema, load
+the URLconf, connect to the database and fill its in-memory caches, and without help it does all
+that while its first requests wait, which shows up as a p99 spike whenever autoscaling adds
+workers. warm_up(), called from hackernews/wsgi.py when WARMUP_ON_STARTUP is set, does it up front:
+
+- resolves the /graphql/ URL, which imports the URLconf, the views and the schema,
+- prepares the introspection cache (see hackernews/introspection.py),
+- runs each of WARMUP_QUERIES once, which primes graphql-core's code paths, the front page window
+  (links/frontpage.py) and the leaderboard (links/leaderboard.py), and
+- opens the database connections.
+
+Pre-fork servers (e.g. gunicorn --preload) import wsgi.py once in the master process and then fork
+the workers, which then share the master's memory copy-on-write. With WARMUP_PRE_FORK set,
+warm_up() makes that safe and effective: it closes the database connections afterwards, since a
+connection must never be shared between processes, and, on Python 3.7+, moves everything allocated
+so far out of the garbage collector's reach (gc.freeze()), so that collections in the workers don't
+touch, and thereby copy, the shared pages. Each worker then reconnects in after_fork(), which is
+registered to run in forked children automatically on Python 3.7+, and otherwise should be called
+from the server's post-fork hook.
+
+Warm-up failures (say, an unreachable database) are logged, not raised: a worker that serves its
+first requests slowly is better than one that doesn't start.
+"""
+
+import gc
+import logging
+import os
+
+from django.conf import settings
+from django.db import connections
+from django.urls import resolve
+
+from hackernews.introspection import prepare_introspection
+
+logger = logging.getLogger(__name__)
+
+# The operations that most requests are made of, run once during warm-up.
+WARMUP_QUERIES = (
+    # the front page
+    '''
+    query {
+      viewer {
+        allLinks(orderBy: createdAt_DESC, first: 30) {
+          edges { node { id url description voteCount viewerHasVoted postedBy { id name } } }
+          pageInfo { hasNextPage endCursor }
+        }
+      }
+    }
+    ''',
+    # the leaderboard
+    '''
+    query {
+      viewer {
+        topLinks(window: DAY, first: 10) { edges { node { id url description } } }
+      }
+    }
+    ''',
+)
+
+
+class WarmupContext(object):
+    """A stand-in for an anonymous request, as the context of the warm-up queries."""
+    META = {}
+
+
+def connect_databases():
+    for connection in connections.all():
+        connection.ensure_connection()
+
+
+def warm_up(schema=None, pre_fork=None):
+    """Do the work that a worker would otherwise do during its first requests."""
+    if pre_fork is None:
+        pre_fork = getattr(settings, 'WARMUP_PRE_FORK', False)
+    try:
+        resolve('/graphql/')
+        if schema is None:
+            from graphene_django.settings import graphene_settings
+            schema = graphene_settings.SCHEMA
+        prepare_introspection(schema)
+        for query in getattr(settings, 'WARMUP_QUERIES', WARMUP_QUERIES):
+            result = schema.execute(query, context_value=WarmupContext())
+            if result.errors:
+                logger.warning('Warm-up query failed: %s', result.errors[0])
+        if not pre_fork:
+            connect_databases()
+    except Exception:
+        logger.warning('Warm-up failed', exc_info=True)
+    finally:
+        if pre_fork:
+            connections.close_all()
+    if pre_fork:
+        prepare_fork()
+
+
+def prepare_fork():
+    """Get the process ready to fork workers that share its memory."""
+    if hasattr(gc, 'freeze'):
+        gc.collect()
+        gc.freeze()
+    if hasattr(os, 'register_at_fork'):
+        os.register_at_fork(after_in_child=after_fork)
+
+
+def after_fork():
+    """Reconnect to the databases in a newly forked worker."""
+    try:
+        connect_databases()
+    except Exception:
+        logger.warning('Connecting to the database after fork failed', exc_info=True)
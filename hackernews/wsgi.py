@@ -9,8 +9,16 @@ https://docs.djangoproject.com/en/1.11/howto/deployment/wsgi/
 
 import os
 
-from django.core.wsgi import get_wsgi_application
+from hackernews.handlers import get_wsgi_application
 
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "hackernews.settings")
 
+# Django's WSGIHandler, with a lean middleware profile for /graphql/; see hackernews/handlers.py.
 application = get_wsgi_application()
+
+# Do the first requests' one-time work now, including preparing the introspection cache. See
+# hackernews/warmup.py, also for WARMUP_PRE_FORK.
+from django.conf import settings
+from hackernews.warmup import warm_up
+if getattr(settings, 'WARMUP_ON_STARTUP', True):
+    warm_up()
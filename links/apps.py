@@ -1,5 +1,22 @@
 from django.apps import AppConfig
+from django.db.models.signals import post_delete, post_migrate, post_save
 
 
 class LinksConfig(AppConfig):
     name = 'links'
+
+    def ready(self):
+        from hackernews.nodecache import get_node_cache
+        from links.frontpage import link_deleted, link_saved
+        from links.search import install_search_index
+        from links import shards
+        post_migrate.connect(install_search_index, sender=self)
+        post_migrate.connect(shards.install_vote_sequences, sender=self)
+        LinkModel = self.get_model('LinkModel')
+        get_node_cache().register(LinkModel)
+        post_save.connect(link_saved, sender=LinkModel)
+        post_delete.connect(link_deleted, sender=LinkModel)
+        if shards.vote_shards():
+            post_delete.connect(shards.link_deleted, sender=LinkModel)
+            UserModel = self.apps.get_model('users', 'UserModel')
+            post_delete.connect(shards.user_deleted, sender=UserModel)
@@ -0,0 +1,213 @@
+# howtographql-graphene-tutorial-fixed -- links/frontpage.py
+#
+# Copyright © 2017 Sean Bolton.
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE
+# LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION
+# WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+"""An in-memory window of the newest links, for serving the front page without SQL.
+
+Most allLinks queries are for the first page of the front page, `allLinks(orderBy: createdAt_DESC,
+first: 30)`, over and over. FrontPage keeps the newest FRONT_PAGE_SIZE links in memory, newest
+first (ordered by created_at, then id, just as the database query is), and LinkConnection serves
+such queries from it when it can: ordered by createdAt_DESC, with no filter, with a 'first' no
+bigger than the window, and with no cursor or 'last'. Everything else (deeper pages, other
+orderings, searches) goes to the database as before. The cursors are the same offsets either way,
+so a client can page from the window into the database seamlessly.
+
+The window is updated in place, once the transaction commits, when this process:
+- saves or deletes a link (through model signals) or bulk-creates links (createLinks calls
+  add_links() itself), and
+- records votes (links.scores.record_votes() calls add_votes()), so that voteCount and hotScore
+  stay current.
+
+Other worker processes change the database behind our back, so at most every
+FRONT_PAGE_CHECK_INTERVAL seconds a request compares a version of the database, the highest link
+and vote ids, with the version the window was loaded at, and reloads the window (one query) if
+they differ. That catches new links and votes from other processes within the interval. Edits and
+deletes in other processes don't change those ids, so the window is also reloaded unconditionally
+every FRONT_PAGE_MAX_AGE seconds, which bounds how long those can go unnoticed. The window is
+always loaded and checked from the primary database (and the vote shards), even for a query that
+reads from a replica (see hackernews/routers.py), since a lagging replica would otherwise fill it
+with old rows, to be served to everyone until the next reload.
+
+The window holds each link's column values, not model instances: get_links() builds fresh
+instances for every request, so that nothing a request caches on them, such as the link's
+postedBy user (and their karma), is served to later requests.
+"""
+
+import threading
+import time
+
+from django.conf import settings
+from django.db import router, transaction
+from django.db.models import Max
+
+from hackernews.routers import reading_from_primary
+from links.models import LinkModel, VoteModel
+from links.shards import vote_databases
+
+
+class FrontPage(object):
+    """The newest `size` links, newest first, kept current in memory."""
+
+    # the columns of each link in the window, as a tuple of their values
+    COLUMNS = tuple(field.attname for field in LinkModel._meta.concrete_fields)
+    CREATED_AT = COLUMNS.index('created_at')
+    ID = COLUMNS.index('id')
+    VOTE_COUNT = COLUMNS.index('vote_count')
+    HOT_SCORE = COLUMNS.index('hot_score')
+
+    def __init__(self, size=100, check_interval=1.0, max_age=60.0):
+        self.size = size
+        self.check_interval = check_interval
+        self.max_age = max_age
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """Drop the window, so that the next request loads it afresh."""
+        self.links = None
+        # Whether the window holds every link there is. If not, it can only answer for pages
+        # shorter than itself, since it can't know whether there is a next page.
+        self.complete = False
+        self.version = None
+        self.loaded_at = self.checked_at = 0.0
+
+    @staticmethod
+    def current_version():
+        # the newest vote in each vote shard, see links/shards.py
+        return (LinkModel.objects.aggregate(Max('id'))['id__max'],) + tuple(
+            VoteModel.objects.using(alias).aggregate(Max('id'))['id__max']
+            for alias in vote_databases())
+
+    @classmethod
+    def sort_key(cls, row):
+        return (row[cls.CREATED_AT], row[cls.ID])
+
+    @classmethod
+    def row(cls, link):
+        return tuple(getattr(link, column) for column in cls.COLUMNS)
+
+    def load(self):
+        # Read the version first: a write that lands between the two queries makes the next check
+        # see a newer version, and reload, rather than be missed.
+        self.version = self.current_version()
+        self.links = list(LinkModel.objects.order_by('-created_at', '-id')
+                          .values_list(*self.COLUMNS)[:self.size])
+        self.complete = len(self.links) < self.size
+        self.loaded_at = self.checked_at = time.monotonic()
+
+    def refresh(self):
+        now = time.monotonic()
+        if self.links is not None:
+            if now - self.checked_at < self.check_interval:
+                return
+            if now - self.loaded_at < self.max_age:
+                self.checked_at = now
+                with reading_from_primary():
+                    if self.current_version() == self.version:
+                        return
+        with reading_from_primary():
+            self.load()
+
+    def get_links(self, args):
+        """Return the links for an allLinks query with arguments `args`, plus one more if there is
+        a next page, or None if the query can't be answered from the window.
+        """
+        first = args.get('first')
+        if (args.get('order_by') != '-created_at' or args.get('filter') or
+                not isinstance(first, int) or first < 0 or first > self.size or
+                args.get('after') or args.get('before') or args.get('last') is not None):
+            return None
+        with self.lock:
+            self.refresh()
+            if first >= len(self.links) and not self.complete:
+                return None
+            rows = self.links[:first + 1]
+        db = router.db_for_read(LinkModel)
+        return [LinkModel.from_db(db, self.COLUMNS, row) for row in rows]
+
+    def add_links(self, links):
+        """Add new or changed links to the window."""
+        with self.lock:
+            if self.links is None:
+                return
+            changed = {link.pk: self.row(link) for link in links}
+            merged = [row for row in self.links if row[self.ID] not in changed]
+            for row in changed.values():
+                # a link older than everything in an incomplete window may have newer ones
+                # between it and the window's oldest, so it can't be added
+                if self.complete or self.sort_key(row) > self.sort_key(self.links[-1]):
+                    merged.append(row)
+            merged.sort(key=self.sort_key, reverse=True)
+            if len(merged) > self.size:
+                del merged[self.size:]
+                self.complete = False
+            self.links = merged
+
+    def remove_link(self, pk):
+        with self.lock:
+            if self.links is not None:
+                self.links = [row for row in self.links if row[self.ID] != pk]
+
+    def add_votes(self, scores):
+        """Add new votes to the links' scores; `scores` maps link primary keys to tuples of
+        (votes, hot_score increment).
+        """
+        with self.lock:
+            if not self.links:
+                return
+            for i, row in enumerate(self.links):
+                if row[self.ID] in scores:
+                    votes, hot = scores[row[self.ID]]
+                    row = list(row)
+                    row[self.VOTE_COUNT] += votes
+                    row[self.HOT_SCORE] += hot
+                    self.links[i] = tuple(row)
+
+
+front_page = None
+front_page_lock = threading.Lock()
+
+def get_front_page():
+    """Return the process-wide FrontPage, creating it on first use."""
+    global front_page
+    with front_page_lock:
+        if front_page is None:
+            front_page = FrontPage(
+                size=getattr(settings, 'FRONT_PAGE_SIZE', 100),
+                check_interval=getattr(settings, 'FRONT_PAGE_CHECK_INTERVAL', 1.0),
+                max_age=getattr(settings, 'FRONT_PAGE_MAX_AGE', 60.0),
+            )
+        return front_page
+
+
+# ========== signal handlers ==========
+
+def link_saved(sender, instance, using=None, **kwargs):
+    if instance.get_deferred_fields():
+        # e.g. a row from hackernews/nodecache.py, without its counters: reload instead
+        transaction.on_commit(get_front_page().reset, using=using)
+    else:
+        transaction.on_commit(lambda: get_front_page().add_links([instance]), using=using)
+
+def link_deleted(sender, instance, using=None, **kwargs):
+    pk = instance.pk
+    transaction.on_commit(lambda: get_front_page().remove_link(pk), using=using)
@@ -0,0 +1,200 @@
+# howtographql-graphene-tutorial-fixed -- links/leaderboard.py
+#
+# Copyright © 2017 Sean Bolton.
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE
+# LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION
+# WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+"""Top links by votes over a sliding time window, for Viewer.topLinks.
+
+Ordering links by the number of votes they got in the last day or week would mean grouping the
+votes table over that window for every request. Instead, Leaderboard keeps per-hour vote counts in
+memory, one Counter of {link pk: votes} per hour, and for each window a running total of the
+buckets inside it. A new vote adds to its bucket and to every window's total; when the hour
+changes, the buckets that slid out of a window are subtracted from its total, and buckets older
+than the longest window are dropped. A top-N query is then a heapq.nlargest() over one Counter.
+
+A window covers the current, partial hour and the whole hours before it, so 'the last 24 hours' is
+really between 23 and 24 hours, which is plenty precise for a leaderboard.
+
+The counts are built from VoteModel.created_at when the leaderboard is first used in a process,
+with one grouped query over the longest window (per vote shard, see links/shards.py). After that:
+
+- votes created in this process are added as soon as their transaction commits (save_vote(),
+  createVotes and the write-behind flusher call add_votes()), and
+- at most every LEADERBOARD_SYNC_INTERVAL seconds, votes with ids above the highest one seen so
+  far (in each vote shard) are fetched, so that other processes' votes are counted too. Votes this
+  process already added are recognized by id and skipped.
+
+Transactions may commit out of id order, so a sync can occasionally miss a vote whose id is
+below one it has already seen. The leaderboard is therefore rebuilt from scratch every
+LEADERBOARD_REBUILD_INTERVAL seconds.
+"""
+
+import heapq
+import threading
+import time
+from collections import Counter
+from datetime import datetime
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, Max
+from django.db.models.functions import TruncHour
+from django.utils import timezone
+
+from hackernews.routers import reading_from_primary
+from links.models import VoteModel
+from links.shards import shard_for_link, shard_for_vote, vote_databases
+
+
+def hour_of(when):
+    """Return the number of the hour that the aware datetime `when` falls in."""
+    return int(when.timestamp() // 3600)
+
+
+class Leaderboard(object):
+    """Vote counts per link over sliding windows of the last `windows` hours."""
+
+    def __init__(self, windows=(24, 168), sync_interval=1.0, rebuild_interval=3600.0):
+        self.windows = tuple(windows)
+        self.sync_interval = sync_interval
+        self.rebuild_interval = rebuild_interval
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """Drop all counts, so that the next query rebuilds them from the database."""
+        self.buckets = None  # hour -> Counter
+        self.totals = None  # window -> Counter
+        self.hour = None  # the current hour, as of the last advance()
+        self.synced_ids = {}  # vote database -> the highest vote id seen in it
+        self.added_ids = set()  # ids of votes added by add_votes() above synced_ids
+        self.built_at = self.synced_at = 0.0
+
+    def advance(self, hour):
+        """Slide the windows forward to `hour`."""
+        if hour <= self.hour:
+            return
+        for window in self.windows:
+            if hour - self.hour >= window:
+                self.totals[window] = Counter()
+                continue
+            total = self.totals[window]
+            for old in range(self.hour - window + 1, hour - window + 1):
+                if old in self.buckets:
+                    total.subtract(self.buckets[old])
+            self.totals[window] = +total  # drop links that no longer have any votes
+        oldest = hour - max(self.windows) + 1
+        for old in [old for old in self.buckets if old < oldest]:
+            del self.buckets[old]
+        self.hour = hour
+
+    def count(self, votes):
+        """Add `votes`, an iterable of (link pk, hour, number of votes) tuples."""
+        for link_id, hour, n in votes:
+            if hour > self.hour:
+                self.advance(hour)
+            if hour <= self.hour - max(self.windows):
+                continue
+            self.buckets.setdefault(hour, Counter())[link_id] += n
+            for window in self.windows:
+                if hour > self.hour - window:
+                    self.totals[window][link_id] += n
+
+    def build(self):
+        now = timezone.now()
+        self.buckets = {}
+        self.totals = {window: Counter() for window in self.windows}
+        self.hour = hour_of(now)
+        self.added_ids = set()
+        since = datetime.fromtimestamp((self.hour - max(self.windows) + 1) * 3600, timezone.utc)
+        for alias in vote_databases():
+            votes = VoteModel.objects.using(alias)
+            # read the highest id first, so that votes committed meanwhile are fetched by sync()
+            synced_id = self.synced_ids[alias] = votes.aggregate(Max('id'))['id__max'] or 0
+            rows = (votes.filter(created_at__gte=since, pk__lte=synced_id)
+                    .annotate(hour=TruncHour('created_at')).order_by()
+                    .values_list('link_id', 'hour').annotate(n=Count('id')))
+            self.count((link_id, hour_of(hour), n) for link_id, hour, n in rows)
+        self.built_at = self.synced_at = time.monotonic()
+
+    def sync(self):
+        for alias in vote_databases():
+            rows = list(VoteModel.objects.using(alias).filter(pk__gt=self.synced_ids.get(alias, 0))
+                        .order_by('pk').values_list('pk', 'link_id', 'created_at'))
+            self.count((link_id, hour_of(created_at), 1) for pk, link_id, created_at in rows
+                       if pk not in self.added_ids)
+            if rows:
+                synced_id = self.synced_ids[alias] = rows[-1][0]
+                self.added_ids = set(pk for pk in self.added_ids
+                                     if pk > synced_id or shard_for_vote(pk) != alias)
+        self.synced_at = time.monotonic()
+
+    def refresh(self):
+        now = time.monotonic()
+        # from the primary (and the vote shards), even inside reading_from_replica(): counts from
+        # a lagging replica would be kept, and the votes it hasn't got yet never synced
+        with reading_from_primary():
+            if self.buckets is None or now - self.built_at >= self.rebuild_interval:
+                self.build()
+            elif now - self.synced_at >= self.sync_interval:
+                self.sync()
+        self.advance(hour_of(timezone.now()))
+
+    def top(self, window, first):
+        """Return the (link pk, votes) of the `first` links with the most votes in the last
+        `window` hours, most votes first (and newest link first among equals).
+        """
+        with self.lock:
+            self.refresh()
+            return heapq.nlargest(first, self.totals[window].items(),
+                                  key=lambda item: (item[1], item[0]))
+
+    def add_votes(self, votes):
+        """Count newly committed votes, a list of VoteModel instances."""
+        with self.lock:
+            if self.buckets is None:
+                return
+            votes = [vote for vote in votes
+                     if vote.pk > self.synced_ids.get(shard_for_link(vote.link_id), 0)]
+            self.added_ids.update(vote.pk for vote in votes)
+            self.count((vote.link_id, hour_of(vote.created_at), 1) for vote in votes)
+
+
+leaderboard = None
+leaderboard_lock = threading.Lock()
+
+def get_leaderboard():
+    """Return the process-wide Leaderboard, creating it on first use."""
+    global leaderboard
+    with leaderboard_lock:
+        if leaderboard is None:
+            leaderboard = Leaderboard(
+                sync_interval=getattr(settings, 'LEADERBOARD_SYNC_INTERVAL', 1.0),
+                rebuild_interval=getattr(settings, 'LEADERBOARD_REBUILD_INTERVAL', 3600.0),
+            )
+        return leaderboard
+
+
+def note_votes(votes):
+    """Count `votes` on the leaderboard once the current transaction commits."""
+    votes = list(votes)
+    if votes:
+        transaction.on_commit(lambda: get_leaderboard().add_votes(votes))
@@ -0,0 +1,62 @@
+# howtographql-graphene-tutorial-fixed -- links/management/commands/backfill_links.py
+#
+# Copyright © 2017 Sean Bolton.
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE
+# LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION
+# WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from hackernews.nodecache import get_node_cache
+from links.models import LinkModel
+
+
+class Command(BaseCommand):
+    help = ('Fill in the columns that LinkModel derives from each link URL (e.g. domain), for links '
+            'that were created before those columns existed, or by bulk_create().')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500,
+                            help='The number of links to update per transaction.')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        fields = LinkModel.URL_FIELDS
+        last_pk = 0
+        updated = 0
+        while True:
+            batch = list(LinkModel.objects.filter(pk__gt=last_pk).order_by('pk')
+                         .only('pk', 'url', *fields)[:batch_size])
+            if not batch:
+                break
+            last_pk = batch[-1].pk
+            changed = []
+            with transaction.atomic():
+                for link in batch:
+                    old = [getattr(link, field) for field in fields]
+                    link.update_url_fields()
+                    if [getattr(link, field) for field in fields] != old:
+                        LinkModel.objects.filter(pk=link.pk).update(
+                            **{field: getattr(link, field) for field in fields})
+                        changed.append(link.pk)
+            # update() sends no signals, so the cached rows must be invalidated here
+            get_node_cache().invalidate(LinkModel, changed)
+            updated += len(changed)
+        self.stdout.write('Updated {} link(s).'.format(updated))
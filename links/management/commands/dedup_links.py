@@ -0,0 +1,119 @@
+# howtographql-graphene-tutorial-fixed -- links/management/commands/dedup_links.py
+#
+# Copyright © 2017 Sean Bolton.
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE
+# LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION
+# WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+from django.core.management.base import BaseCommand
+from django.db.models import Case, Count, F, IntegerField, Value, When
+
+from links.models import LinkModel, VoteModel
+from links.shards import atomic_for_votes, create_votes, group_by_shard, shard_for_link
+from users.models import UserModel
+
+
+def chunks(items, size):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+class Command(BaseCommand):
+    help = ('Merge links that have the same canonical URL into the oldest of them, moving their '
+            'votes over. Run backfill_links first, so that every link has its url_hash.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500,
+                            help='The number of votes to re-point per UPDATE.')
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Only report what would be merged.')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        dry_run = options['dry_run']
+        hashes = list(LinkModel.objects.exclude(url_hash='').values('url_hash')
+                      .annotate(n=Count('id')).filter(n__gt=1).values_list('url_hash', flat=True))
+        merged = moved = dropped = 0
+        for url_hash in hashes:
+            pks = list(LinkModel.objects.filter(url_hash=url_hash).order_by('pk')
+                       .values_list('pk', flat=True))
+            keep, duplicates = pks[0], pks[1:]
+            # With sharded votes, the duplicates' votes may be in other shards than keep's.
+            target = shard_for_link(keep)
+            with atomic_for_votes(pks):
+                # A user who voted on more than one of the duplicates keeps only one vote.
+                voters = set(VoteModel.objects.using(target).filter(link_id=keep)
+                             .values_list('user_id', flat=True))
+                move, copy, drop = [], [], {}
+                for alias, links in group_by_shard(duplicates).items():
+                    for pk, user_id, created_at in (
+                            VoteModel.objects.using(alias).filter(link_id__in=links)
+                            .order_by('pk').values_list('pk', 'user_id', 'created_at')):
+                        if user_id in voters:
+                            drop.setdefault(alias, []).append(pk)
+                        elif alias == target:
+                            voters.add(user_id)
+                            move.append(pk)
+                        else:
+                            voters.add(user_id)
+                            copy.append((user_id, created_at))
+                            drop.setdefault(alias, []).append(pk)
+                merged += len(duplicates)
+                moved += len(move) + len(copy)
+                dropped += sum(len(votes) for votes in drop.values()) - len(copy)
+                if dry_run:
+                    continue
+                for batch in chunks(move, batch_size):
+                    VoteModel.objects.using(target).filter(pk__in=batch).update(link_id=keep)
+                # Votes can't move between shards, so they are copied, keeping their creation
+                # time, and the originals are deleted.
+                for batch in chunks(copy, batch_size):
+                    copies = create_votes([VoteModel(user_id=user_id, link_id=keep)
+                                           for user_id, _ in batch])
+                    for vote, (_, created_at) in zip(copies, batch):
+                        (VoteModel.objects.using(target).filter(pk=vote.pk)
+                         .update(created_at=created_at))
+                for alias, votes in drop.items():
+                    for batch in chunks(votes, batch_size):
+                        VoteModel.objects.using(alias).filter(pk__in=batch).delete()
+                # A user's karma is the vote_count of the links they have posted (see
+                # links/scores.py): the posters lose the duplicates' counts, and keep's poster
+                # gets its new count in place of the old one.
+                karma = {}
+                for posted_by_id, vote_count in (LinkModel.objects.filter(pk__in=pks)
+                                                 .values_list('posted_by_id', 'vote_count')):
+                    if posted_by_id is not None:
+                        karma[posted_by_id] = karma.get(posted_by_id, 0) - vote_count
+                keep_posted_by_id = (LinkModel.objects.filter(pk=keep)
+                                     .values_list('posted_by_id', flat=True).get())
+                if keep_posted_by_id is not None:
+                    karma[keep_posted_by_id] += len(voters)
+                karma = {pk: n for pk, n in karma.items() if n}
+                if karma:
+                    UserModel.objects.filter(pk__in=karma.keys()).update(
+                        karma=F('karma') + Case(
+                            *[When(pk=pk, then=Value(n)) for pk, n in karma.items()],
+                            default=Value(0), output_field=IntegerField()),
+                    )
+                LinkModel.objects.filter(pk__in=duplicates).delete()
+                # The hot_score is left for the next recompute_scores run to correct.
+                LinkModel.objects.filter(pk=keep).update(vote_count=len(voters))
+        self.stdout.write('{}Merged {} duplicate link(s), moving {} vote(s) and dropping {} '
+                          'duplicate vote(s).'.format(dry_run and '(dry run) ' or '',
+                                                      merged, moved, dropped))
@@ -0,0 +1,95 @@
+# howtographql-graphene-tutorial-fixed -- links/management/commands/recompute_scores.py
+#
+# Copyright © 2017 Sean Bolton.
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE
+# LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION
+# WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.db.models import Case, IntegerField, Sum, Value, When
+from django.utils import timezone
+
+from links.models import LinkModel
+from links.scores import decay, decay_scores, hot_score, update_scores
+from links.shards import count_votes
+from users.models import UserModel
+
+
+class Command(BaseCommand):
+    help = ('Recompute the precomputed link scores, applying time decay to every hot_score. Run '
+            'this periodically, e.g. from cron every few minutes.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500,
+                            help='The number of links to update per UPDATE.')
+        parser.add_argument('--recount', action='store_true',
+                            help=('Also recount each vote_count from the votes table, and each '
+                                  "user's karma from the vote counts."))
+
+    def handle(self, *args, **options):
+        # Each UPDATE binds a few parameters per row: three per link for decay_scores(), five for
+        # update_scores(), and three per user for the karma recount. Keep batches within the
+        # database's limit on them (999 on SQLite before 3.32), which Django (1.11) tells through
+        # bulk_batch_size(), given a field per parameter.
+        params_per_row = 5 if options['recount'] else 3
+        batch_size = max(1, connection.ops.bulk_batch_size(['pk'] * params_per_row,
+                                                           range(options['batch_size'])))
+        now = timezone.now()
+        last_pk = 0
+        updated = 0
+        while True:
+            batch = list(LinkModel.objects.filter(pk__gt=last_pk).order_by('pk')
+                         .values_list('pk', 'created_at')[:batch_size])
+            if not batch:
+                break
+            last_pk = batch[-1][0]
+            if options['recount']:
+                # counted per vote shard, rather than joined, see links/shards.py
+                counts = count_votes([pk for pk, _ in batch])
+                with transaction.atomic():
+                    update_scores({pk: (counts.get(pk, 0),
+                                        hot_score(counts.get(pk, 0), created_at, now))
+                                   for pk, created_at in batch})
+            else:
+                # Only the decay: the vote counts are left to record_votes(), which may be adding
+                # to them right now.
+                decay_scores({pk: decay(created_at, now) for pk, created_at in batch})
+            updated += len(batch)
+        self.stdout.write('Recomputed scores for {} link(s).'.format(updated))
+        if options['recount']:
+            self.recount_karma(batch_size)
+
+    def recount_karma(self, batch_size):
+        last_pk = 0
+        updated = 0
+        while True:
+            pks = list(UserModel.objects.filter(pk__gt=last_pk).order_by('pk')
+                       .values_list('pk', flat=True)[:batch_size])
+            if not pks:
+                break
+            last_pk = pks[-1]
+            karma = dict(LinkModel.objects.filter(posted_by_id__in=pks).order_by()
+                         .values_list('posted_by_id').annotate(Sum('vote_count')))
+            with transaction.atomic():
+                UserModel.objects.filter(pk__in=pks).update(karma=Case(
+                    *[When(pk=pk, then=Value(karma.get(pk) or 0)) for pk in pks],
+                    output_field=IntegerField()))
+            updated += len(pks)
+        self.stdout.write('Recounted karma for {} user(s).'.format(updated))
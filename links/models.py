@@ -1,12 +1,57 @@
+from django.conf import settings
 from django.db import models
 
+from links.urlnorm import normalize_domain, url_hash
+
+
 class LinkModel(models.Model):
     description = models.TextField(null=True, blank=True)
     url = models.URLField()
     created_at = models.DateTimeField(auto_now_add=True)
     posted_by = models.ForeignKey('users.UserModel', null=True)
+    # Columns derived from 'url' by update_url_fields(). Links written with bulk_create(), or before
+    # a column existed, can be filled in with './manage.py backfill_links'.
+    domain = models.CharField(max_length=253, blank=True, default='', db_index=True)
+    # hash of the canonicalized URL, for finding resubmissions of the same page
+    url_hash = models.CharField(max_length=64, blank=True, default='', db_index=True)
+
+    # Precomputed scores for the votes_DESC and hot_DESC orderings, see links/scores.py.
+    vote_count = models.IntegerField(default=0, db_index=True)
+    hot_score = models.FloatField(default=0.0, db_index=True)
+
+    URL_FIELDS = ('domain', 'url_hash')
+    # columns that change with every vote, which hackernews/nodecache.py doesn't cache
+    COUNTER_FIELDS = ('vote_count', 'hot_score')
+
+    def update_url_fields(self):
+        """Set the columns derived from 'url'."""
+        self.domain = normalize_domain(self.url)
+        self.url_hash = url_hash(self.url)
+
+    def save(self, *args, **kwargs):
+        self.update_url_fields()
+        super().save(*args, **kwargs)
+
+
+# With sharded votes (see links/shards.py), votes live in other databases than the links and users
+# they refer to, so their foreign keys can have neither constraints nor cascading deletes.
+SHARDED_VOTES = bool(getattr(settings, 'VOTE_SHARDS', None))
+VOTE_FK_OPTIONS = {'db_constraint': False, 'on_delete': models.DO_NOTHING} if SHARDED_VOTES else {}
+
+
+class VoteManager(models.Manager):
+    def create(self, **kwargs):
+        # QuerySet.create() picks the database before the instance exists, so the router can't
+        # see the link, and choose its shard; Model.save() lets it.
+        vote = self.model(**kwargs)
+        vote.save(force_insert=True, using=self._db)
+        return vote
 
 
 class VoteModel(models.Model):
-    user = models.ForeignKey('users.UserModel')
-    link = models.ForeignKey('links.LinkModel', related_name='votes')
+    user = models.ForeignKey('users.UserModel', **VOTE_FK_OPTIONS)
+    link = models.ForeignKey('links.LinkModel', related_name='votes', **VOTE_FK_OPTIONS)
+    # for the time windows of links/leaderboard.py
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    objects = VoteManager()
@@ -22,14 +22,32 @@
 # WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
 
 import django_filters
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count
 
 import graphene
 from graphene import ObjectType, relay
 from graphene.relay import Node
 from graphene_django import DjangoObjectType
-
+from promise import Promise
+from promise.dataloader import DataLoader
+
+from hackernews.fields import QuerySetConnectionField
+from hackernews.idempotency import idempotent
+from hackernews.nodecache import get_node_cache
+from hackernews.rows import is_row_of
+from hackernews.utils import bulk_create_with_pks, get_request_cache
+from links.frontpage import get_front_page
+from links.leaderboard import get_leaderboard, note_votes
 from links.models import LinkModel, VoteModel
-from users.schema import get_user_from_auth_token, User
+from links.scores import record_votes
+from links.search import search_links
+from links.shards import atomic_for_votes, create_votes, existing_votes, get_vote, votes
+from links.urlnorm import normalize_domain
+from links.votequeue import save_vote
+from users.schema import get_user_from_auth_token
 
 
 # ========== Vote ==========
@@ -56,6 +74,16 @@ class Vote(DjangoObjectType):
         # different types with the same name in the schema: VoteConnection, VoteConnection."
         use_connection = False
 
+    @classmethod
+    def get_node(cls, info, id):
+        # the vote's id says which shard holds it, see links/shards.py
+        return get_vote(id)
+
+    @classmethod
+    def is_type_of(cls, root, info):
+        # connection pages may hold compact rows, rather than models, see hackernews/rows.py
+        return is_row_of(root, VoteModel) or super().is_type_of(root, info)
+
 
 class IdInput(graphene.InputObjectType):
     id = graphene.ID(required=True)
@@ -86,8 +114,10 @@ class VoteConnection(relay.Connection):
 
     def resolve_count(self, info, **args):
         """Return the count of votes in the VoteConnection query."""
-        # self.iterable is the QuerySet of VoteModels
-        return self.iterable.count()
+        # QuerySetConnectionField has already counted them, as self.length. Otherwise,
+        # self.iterable is the QuerySet of VoteModels.
+        length = getattr(self, 'length', None)
+        return self.iterable.count() if length is None else length
 
     # -------- Vote-related resolvers used by other classes --------
 
@@ -104,8 +134,7 @@ class VoteConnection(relay.Connection):
     @staticmethod
     def resolve_all_votes(_, info, **args):
         """Resolve a field returning a (possibly filtered view of) all Votes."""
-        qs = VoteModel.objects.all()
-        filter = args.get('filter', None)
+        filter = args.get('filter', None) or {}
         if filter:
             # We don't get the free input marshalling that DjangoFilterConnectionField provides, so
             # we have to do that ourselves.
@@ -118,15 +147,16 @@ class VoteConnection(relay.Connection):
                     id = field.get('id', None)
                     if id:
                         _, filter[key] = Node.from_global_id(id)
-            qs = VotesFilterSet(data=filter, queryset=qs).qs
-        return qs
+        # With sharded votes, the votes on a link are all on one shard, and otherwise the filter
+        # runs on every shard; see links/shards.py.
+        return votes(link_id=filter.get('link', None),
+                     filter=filter and (lambda qs: VotesFilterSet(data=filter, queryset=qs).qs))
 
     @staticmethod
     def resolve_votes(parent, info, **args):
         """Resolve the 'votes' field on Link by returning all votes made by this user."""
         # parent is a LinkModel
-        qs = VoteModel.objects.filter(link_id=parent.pk)
-        return qs
+        return votes(link_id=parent.pk)
 
 
 class CreateVote(relay.ClientIDMutation):
@@ -156,6 +186,7 @@ class CreateVote(relay.ClientIDMutation):
         link_id = graphene.ID(required=True)
 
     @classmethod
+    @idempotent
     def mutate_and_get_payload(cls, root, info, link_id, user_id, client_mutation_id=None):
         user = get_user_from_auth_token(info.context) or None
         if not user:
@@ -167,15 +198,107 @@ class CreateVote(relay.ClientIDMutation):
         link = Node.get_node_from_global_id(info, link_id)
         if not link:
             raise Exception('Requested link not found!')
-        if VoteModel.objects.filter(user_id=user.pk, link_id=link.pk).count() > 0:
+        if existing_votes([user.pk], [link.pk]):
             raise Exception('A vote already exists for this user and link!')
 
         vote = VoteModel(user_id=user.pk, link_id=link.pk)
-        vote.save()
+        # possibly batched with other votes, see links/votequeue.py
+        save_vote(vote, link=link)
 
         return CreateVote(vote=vote)
 
 
+def check_bulk_size(items):
+    """Raise if a bulk mutation was given more items than BULK_MUTATION_MAX_ITEMS allows."""
+    max_items = getattr(settings, 'BULK_MUTATION_MAX_ITEMS', 100)
+    if len(items) > max_items:
+        raise Exception('Too many items in one request (the limit is {})!'.format(max_items))
+
+
+def pk_from_global_id(global_id, type_name):
+    """Decode a global id without touching the database, returning the primary key if the id is
+    for a node of type `type_name`, or None otherwise.
+    """
+    try:
+        _type, pk = Node.from_global_id(global_id)
+        if _type == type_name:
+            return int(pk)
+    except Exception:
+        pass
+    return None
+
+
+class CreateVotesResult(ObjectType):
+    """The outcome for one item of a createVotes mutation: either the new vote, or an error."""
+    vote = graphene.Field(Vote)
+    error = graphene.String()
+
+
+class CreateVotes(relay.ClientIDMutation):
+    # The bulk version of createVote, for integrations that vote on many links at once. Rather than
+    # one round trip and one transaction per vote, this authenticates once, checks all the links and
+    # existing votes with one 'IN' query each, and writes all the new votes with one bulk_create().
+    # Per-item failures don't fail the whole mutation; they are reported in 'results', which are in
+    # the same order as the input 'linkIds'.
+    # mutation CreateVotesMutation($input: CreateVotesInput!) {
+    #   createVotes(input: $input) {
+    #     results {
+    #       vote { id }
+    #       error
+    #     }
+    #   }
+    # }
+    # example variables:
+    #   input {
+    #     userId: 'VXNlcjox',
+    #     linkIds: ['TGluazoy', 'TGluazoz'],
+    #     clientMutationId: ''
+    #   }
+
+    results = graphene.List(graphene.NonNull(CreateVotesResult), required=True)
+
+    class Input:
+        user_id = graphene.ID()
+        link_ids = graphene.List(graphene.NonNull(graphene.ID), required=True)
+
+    @classmethod
+    @idempotent
+    def mutate_and_get_payload(cls, root, info, link_ids, user_id=None, client_mutation_id=None):
+        user = get_user_from_auth_token(info.context) or None
+        if not user:
+            raise Exception('Only logged-in users may vote!')
+        if user_id and pk_from_global_id(user_id, 'User') != user.pk:
+            raise Exception('Supplied user id does not match logged-in user!')
+        check_bulk_size(link_ids)
+
+        link_pks = [pk_from_global_id(link_id, 'Link') for link_id in link_ids]
+        wanted = set(pk for pk in link_pks if pk is not None)
+        found = {pk: (created_at, posted_by_id) for pk, created_at, posted_by_id
+                 in LinkModel.objects.filter(pk__in=wanted)
+                 .values_list('pk', 'created_at', 'posted_by_id')}
+        voted = set(link_pk for _, link_pk in existing_votes([user.pk], found))
+
+        results = []
+        new_votes = []
+        for link_pk in link_pks:
+            if link_pk not in found:
+                results.append(CreateVotesResult(vote=None, error='Requested link not found!'))
+            elif link_pk in voted:
+                results.append(CreateVotesResult(
+                    vote=None, error='A vote already exists for this user and link!'))
+            else:
+                voted.add(link_pk)  # catch duplicates within this request, too
+                vote = VoteModel(user_id=user.pk, link_id=link_pk)
+                new_votes.append(vote)
+                results.append(CreateVotesResult(vote=vote, error=None))
+        with atomic_for_votes(vote.link_id for vote in new_votes):
+            create_votes(new_votes)
+            record_votes({vote.link_id: 1 for vote in new_votes}, links=found)
+            note_votes(new_votes)
+
+        return CreateVotes(results=results)
+
+
 # ========== Link ==========
 
 # The GraphQL schema used by the front-end tutorial uses GraphQL Enums for specifying the sort order
@@ -200,18 +323,62 @@ class CreateVote(relay.ClientIDMutation):
 # LinkConnection, and DjangoFilterConnectionType makes no provision for custom enums in FilterSets.
 # So, we're back to using a custom Connection.
 
+class ViewerVotesLoader(DataLoader):
+    """Loads whether a user has voted on links, given the links' primary keys. A DataLoader
+    collects all the load() calls made while resolving a page of links, and then hands all the keys
+    to batch_load_fn() at once, so the whole page takes one query.
+    """
+    def __init__(self, user):
+        super().__init__()
+        self.user = user
+
+    def batch_load_fn(self, link_pks):
+        voted = set(link_pk for _, link_pk in existing_votes([self.user.pk], link_pks))
+        return Promise.resolve([pk in voted for pk in link_pks])
+
+
 class Link(DjangoObjectType):
     class Meta:
         model = LinkModel
         interfaces = (Node, )
         use_connection = False  # a custom Connection will be provided
+        # url_hash is only for finding duplicates (see links/urlnorm.py), not part of the API
+        exclude_fields = ('url_hash',)
+
+    # the columns that the resolvers below need, when resolving from rows (see hackernews/rows.py)
+    ROW_COLUMNS = {'votes': ('id',), 'viewerHasVoted': ('id',)}
+
+    @classmethod
+    def get_node(cls, info, id):
+        # served from hackernews/nodecache.py, rather than a query per lookup
+        return get_node_cache().get(LinkModel, id)
 
-    votes = relay.ConnectionField(
+    @classmethod
+    def is_type_of(cls, root, info):
+        # connection pages may hold compact rows, rather than models, see hackernews/rows.py
+        return is_row_of(root, LinkModel) or super().is_type_of(root, info)
+
+    votes = QuerySetConnectionField(
         VoteConnection,
         resolver=VoteConnection.resolve_votes,
         #**VoteConnection.get_votes_input_fields() -- no input fields (yet)
     )
 
+    # Whether the logged-in user has voted on this link, so the front end can grey out the upvote
+    # arrow without an allVotes query per link. Always false for anonymous requests.
+    viewer_has_voted = graphene.Boolean()
+
+    def resolve_viewer_has_voted(self, info):
+        # The loader (and with it the user lookup and its cached results) lasts for one request.
+        cache = get_request_cache(info.context)
+        if 'viewer_votes_loader' not in cache:
+            user = info.context is not None and get_user_from_auth_token(info.context) or None
+            cache['viewer_votes_loader'] = user and ViewerVotesLoader(user)
+        loader = cache['viewer_votes_loader']
+        if not loader:
+            return False
+        return loader.load(self.pk)
+
 class LinkOrderBy(graphene.Enum):
     """This provides the schema's LinkOrderBy Enum type, for ordering LinkConnection."""
     # The class name ('LinkOrderBy') is what the GraphQL schema Enum type name should be, the
@@ -223,12 +390,38 @@ class LinkOrderBy(graphene.Enum):
     description_DESC = '-description'
     id_ASC = 'id'
     id_DESC = '-id'
+    # These two are not in the Graphcool schema. They order by precomputed, indexed scores; see
+    # links/scores.py.
+    votes_DESC = '-vote_count'
+    hot_DESC = '-hot_score'
     #updatedAt_ASC = 'updated_at'   -- these are present in the Graphcool schema, but not needed by
     #updatedAt_DESC = '-updated_at'    the tutorial, nor implemented in LinkModel
     url_ASC = 'url'
     url_DESC = '-url'
 
 
+class LinkFilter(graphene.InputObjectType):
+    """The input object for filtered allLinks queries."""
+    # Full-text search over description and url. Matching links are ordered by relevance, unless
+    # an orderBy is also given. See links/search.py.
+    search = graphene.String()
+    # Links from this domain, e.g. "github.com". The domain is normalized the same way as
+    # LinkModel.domain, so "https://WWW.GitHub.com/" works too.
+    domain = graphene.String()
+
+
+class DomainCount(ObjectType):
+    """The number of links from one domain, for Viewer.topDomains."""
+    domain = graphene.String(required=True)
+    count = graphene.Int(required=True)
+
+
+class TopLinksWindow(graphene.Enum):
+    """The time windows of Viewer.topLinks; the values are lengths in hours."""
+    DAY = 24
+    WEEK = 168
+
+
 class LinkConnection(relay.Connection):
     """A custom Connection for queries on Link."""
     class Meta:
@@ -237,19 +430,61 @@ class LinkConnection(relay.Connection):
     @staticmethod
     def get_all_links_input_fields():
         return {
+            'filter': graphene.Argument(LinkFilter),
             # this creates an input field using the LinkOrderBy custom enum
             'order_by': graphene.Argument(LinkOrderBy)
         }
 
     def resolve_all_links(self, info, **args):
+        # the first page of the front page is usually served from memory, see links/frontpage.py
+        links = get_front_page().get_links(args)
+        if links is not None:
+            return links
         qs = LinkModel.objects.all()
+        filter = args.get('filter', None) or {}
         order_by = args.get('order_by', None)
+        domain = filter.get('domain', None)
+        if domain is not None:
+            qs = qs.filter(domain=normalize_domain(domain))
+        search = filter.get('search', None)
+        if search is not None:
+            qs = search_links(qs, search)
+            if not order_by:
+                qs = qs.order_by('-search_rank', '-id')
         if order_by:
             # Graphene has already translated the over-the-wire enum value (e.g. 'createdAt_DESC')
-            # to our internal value ('-created_at') needed by Django.
-            qs = qs.order_by(order_by)
+            # to our internal value ('-created_at') needed by Django. Break ties by id, so that
+            # pagination is stable.
+            qs = qs.order_by(order_by, '-id')
         return qs
 
+    @staticmethod
+    def resolve_top_links(_, info, window=None, **args):
+        """Resolve Viewer.topLinks: the links with the most votes in the last day or week, most
+        first, from the in-memory counts of links/leaderboard.py. Only the top LEADERBOARD_SIZE
+        links are ranked.
+        """
+        window = window or TopLinksWindow.DAY.value
+        top = get_leaderboard().top(window, getattr(settings, 'LEADERBOARD_SIZE', 100))
+        links = LinkModel.objects.in_bulk([pk for pk, _ in top])
+        return [links[pk] for pk, _ in top if pk in links]
+
+    @staticmethod
+    def resolve_top_domains(_, info, first=10):
+        """Resolve Viewer.topDomains: the domains with the most links, most first. This is a
+        grouped query over the whole links table, so the result is cached for
+        TOP_DOMAINS_CACHE_TTL seconds.
+        """
+        first = max(0, min(first, 100))
+        key = 'top_domains:{}'.format(first)
+        counts = cache.get(key)
+        if counts is None:
+            counts = list(LinkModel.objects.exclude(domain='').values('domain')
+                          .annotate(count=Count('id')).order_by('-count', 'domain')
+                          .values_list('domain', 'count')[:first])
+            cache.set(key, counts, getattr(settings, 'TOP_DOMAINS_CACHE_TTL', 60))
+        return [DomainCount(domain=domain, count=count) for domain, count in counts]
+
 
 class CreateLink(relay.ClientIDMutation):
     # mutation CreateLinkMutation($input: CreateLinkInput!) {
@@ -276,10 +511,14 @@ class CreateLink(relay.ClientIDMutation):
         description = graphene.String(required=True)
         url = graphene.String(required=True)
         posted_by_id = graphene.ID()
+        # If a link to the same page (by canonical URL, see links/urlnorm.py) already exists,
+        # return it instead of creating a new one. Defaults to the RETURN_EXISTING_LINKS setting.
+        return_existing = graphene.Boolean()
 
     @classmethod
+    @idempotent
     def mutate_and_get_payload(cls, root, info, url, description, posted_by_id=None,
-                               client_mutation_id=None):
+                               return_existing=None, client_mutation_id=None):
         # In order to have this work with early stages of the front-end tutorial, this will allow
         # links to be created without a user auth token or postedById. If a postedById is present,
         # then the auth token must be as well. If both are present, then they must agree.
@@ -298,11 +537,108 @@ class CreateLink(relay.ClientIDMutation):
             description=description,
             posted_by=user,
         )
+        link.update_url_fields()
+        if should_return_existing(return_existing):
+            existing = LinkModel.objects.filter(url_hash=link.url_hash).order_by('pk').first()
+            if existing:
+                return CreateLink(link=existing)
         link.save()
 
         return CreateLink(link=link)
 
 
+def should_return_existing(return_existing):
+    if return_existing is None:
+        return getattr(settings, 'RETURN_EXISTING_LINKS', False)
+    return return_existing
+
+
+class CreateLinksItem(graphene.InputObjectType):
+    """One link to be created by a createLinks mutation."""
+    description = graphene.String(required=True)
+    url = graphene.String(required=True)
+
+
+class CreateLinksResult(ObjectType):
+    """The outcome for one item of a createLinks mutation: either the new link, or an error."""
+    link = graphene.Field(Link)
+    error = graphene.String()
+
+
+class CreateLinks(relay.ClientIDMutation):
+    # The bulk version of createLink. Unlike createLink, this requires a logged-in user, since it
+    # exists for integrations rather than for the front-end tutorial. All the links are written with
+    # one bulk_create(), in a single transaction, and the 'results' are in input order.
+    # mutation CreateLinksMutation($input: CreateLinksInput!) {
+    #   createLinks(input: $input) {
+    #     results {
+    #       link { id url }
+    #       error
+    #     }
+    #   }
+    # }
+    # example variables:
+    #   input {
+    #       links: [{ description: "New Link", url: "http://example.com" }],
+    #       postedById: "VXNlcjox",
+    #       clientMutationId: "",
+    #   }
+
+    results = graphene.List(graphene.NonNull(CreateLinksResult), required=True)
+
+    class Input:
+        links = graphene.List(graphene.NonNull(CreateLinksItem), required=True)
+        posted_by_id = graphene.ID()
+        # as for createLink, but checked for all the links with one query
+        return_existing = graphene.Boolean()
+
+    @classmethod
+    @idempotent
+    def mutate_and_get_payload(cls, root, info, links, posted_by_id=None, return_existing=None,
+                               client_mutation_id=None):
+        user = get_user_from_auth_token(info.context) or None
+        if not user:
+            raise Exception('Only logged-in users may create links!')
+        if posted_by_id and pk_from_global_id(posted_by_id, 'User') != user.pk:
+            raise Exception('postedById does not match user ID!')
+        check_bulk_size(links)
+
+        items = []
+        for item in links:
+            url = item.get('url').strip()
+            link = url and LinkModel(url=url, description=item.get('description'), posted_by=user)
+            if link:
+                link.update_url_fields()  # bulk_create() doesn't call save()
+            items.append(link)
+        return_existing = should_return_existing(return_existing)
+        existing = {}
+        if return_existing:
+            hashes = set(link.url_hash for link in items if link)
+            for link in LinkModel.objects.filter(url_hash__in=hashes).order_by('-pk'):
+                existing[link.url_hash] = link  # the oldest one wins
+
+        results = []
+        new_links = []
+        for link in items:
+            if not link:
+                results.append(CreateLinksResult(link=None, error='A link must have a URL!'))
+                continue
+            if link.url_hash in existing:
+                link = existing[link.url_hash]
+            else:
+                new_links.append(link)
+                if return_existing:
+                    existing[link.url_hash] = link  # duplicates within this request, too
+            results.append(CreateLinksResult(link=link, error=None))
+        # the description too: the same url may be posted twice here, with different descriptions
+        bulk_create_with_pks(LinkModel, new_links,
+                             natural_key=('posted_by_id', 'url', 'description'))
+        # bulk_create() sends no post_save signals, see links/frontpage.py
+        transaction.on_commit(lambda: get_front_page().add_links(new_links))
+
+        return CreateLinks(results=results)
+
+
 # ========== schema structure ==========
 
 # A common question I've seen regarding graphene, and GraphQL back-ends in general, is "what creates
@@ -317,18 +653,32 @@ class Viewer(ObjectType):
     class Meta:
         interfaces = (Node, )
 
-    all_links = relay.ConnectionField(
+    all_links = QuerySetConnectionField(
         LinkConnection,
         resolver=LinkConnection.resolve_all_links,
         **LinkConnection.get_all_links_input_fields()
     )
 
-    all_votes = relay.ConnectionField(
+    all_votes = QuerySetConnectionField(
         VoteConnection,
         resolver=VoteConnection.resolve_all_votes,
         **VoteConnection.get_all_votes_input_fields()
     )
 
+    top_links = QuerySetConnectionField(
+        LinkConnection,
+        # Graphene (2.0) prints an enum default_value as its value ('24'), not its name, which
+        # makes the printed schema invalid, so the DAY default is applied by the resolver instead.
+        window=graphene.Argument(TopLinksWindow),
+        resolver=LinkConnection.resolve_top_links,
+    )
+
+    top_domains = graphene.List(
+        graphene.NonNull(DomainCount),
+        first=graphene.Int(default_value=10),
+        resolver=LinkConnection.resolve_top_domains,
+    )
+
     instance = None # a lazily-initialized singleton for get_node()
 
     @classmethod
@@ -348,4 +698,6 @@ class Query(object):
 
 class Mutation(object):
     create_link = CreateLink.Field()
+    create_links = CreateLinks.Field()
     create_vote = CreateVote.Field()
+    create_votes = CreateVotes.Field()
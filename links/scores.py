@@ -0,0 +1,133 @@
+# howtographql-graphene-tutorial-fixed -- links/scores.py
+#
+# Copyright © 2017 Sean Bolton.
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE
+# LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION
+# WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+"""Precomputed link scores, for the votes_DESC and hot_DESC allLinks orderings.
+
+Ordering by vote count or "hotness" on the fly would mean aggregating the votes table for every
+page, so LinkModel keeps both scores in indexed columns instead:
+
+- vote_count is the number of votes on the link. record_votes() increments it whenever votes are
+  created.
+
+- hot_score is the vote count decayed by the link's age, as on Hacker News:
+      votes / (age_in_hours + 2) ** HOT_SCORE_GRAVITY
+  Each new vote adds its share at the link's age at the time of the vote. Since every link's score
+  keeps decaying as time passes, the recompute_scores management command recomputes all of them
+  from the current time, and should be run periodically (e.g. from cron every few minutes). It
+  only writes hot_score, computed from vote_count within the same UPDATE, so that it can't undo
+  the increments of votes arriving while it runs.
+  Between runs, older votes count for a little more than they should, which only matters for
+  links whose scores are very close.
+
+A user's karma is the number of votes on the links they have posted. record_votes() maintains it
+along with the link scores, so that profile pages never need to aggregate the votes table.
+"""
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Case, F, FloatField, IntegerField, Value, When
+from django.utils import timezone
+
+from links.frontpage import get_front_page
+from links.models import LinkModel
+from users.models import UserModel
+
+
+def decay(created_at, now=None):
+    """Return the factor by which a vote on a link created at `created_at` counts in its hot
+    score.
+    """
+    now = now or timezone.now()
+    age_hours = max(0.0, (now - created_at).total_seconds() / 3600.0)
+    return 1.0 / (age_hours + 2) ** getattr(settings, 'HOT_SCORE_GRAVITY', 1.8)
+
+
+def hot_score(votes, created_at, now=None):
+    """Return the hot score for a link with `votes` votes created at `created_at`."""
+    return votes * decay(created_at, now)
+
+
+def decay_scores(decays):
+    """Recompute the hot_score of many links from their current vote_count with one UPDATE.
+    `decays` maps link primary keys to their decay() factors. The vote counts are read by the
+    UPDATE itself, so votes that record_votes() adds meanwhile are never lost.
+    """
+    if not decays:
+        return
+    LinkModel.objects.filter(pk__in=decays.keys()).update(
+        hot_score=F('vote_count') * Case(
+            *[When(pk=pk, then=Value(factor)) for pk, factor in decays.items()],
+            output_field=FloatField()),
+    )
+
+
+def update_scores(scores):
+    """Set the vote_count and hot_score of many links with one UPDATE. `scores` maps link
+    primary keys to (vote_count, hot_score) tuples. This overwrites vote counts, so it is only for
+    recounting them from the votes table ('recompute_scores --recount').
+    """
+    if not scores:
+        return
+    LinkModel.objects.filter(pk__in=scores.keys()).update(
+        vote_count=Case(*[When(pk=pk, then=Value(votes)) for pk, (votes, _) in scores.items()],
+                        output_field=IntegerField()),
+        hot_score=Case(*[When(pk=pk, then=Value(hot)) for pk, (_, hot) in scores.items()],
+                       output_field=FloatField()),
+    )
+
+
+def record_votes(counts, links=None):
+    """Add new votes to the precomputed scores: the links' vote_count and hot_score, and the karma
+    of the users who posted them, with one UPDATE each. `counts` maps link primary keys to the
+    number of new votes for each link. `links` maps the same keys to (created_at, posted_by_id)
+    tuples, and is looked up if not given.
+    """
+    counts = {pk: n for pk, n in counts.items() if n}
+    if not counts:
+        return
+    if links is None:
+        links = {pk: (created_at, posted_by_id) for pk, created_at, posted_by_id
+                 in LinkModel.objects.filter(pk__in=counts.keys())
+                 .values_list('pk', 'created_at', 'posted_by_id')}
+    now = timezone.now()
+    scores = {pk: (n, hot_score(n, links[pk][0], now)) for pk, n in counts.items() if pk in links}
+    LinkModel.objects.filter(pk__in=counts.keys()).update(
+        vote_count=F('vote_count') + Case(
+            *[When(pk=pk, then=Value(n)) for pk, n in counts.items()],
+            default=Value(0), output_field=IntegerField()),
+        hot_score=F('hot_score') + Case(
+            *[When(pk=pk, then=Value(hot)) for pk, (_, hot) in scores.items()],
+            default=Value(0.0), output_field=FloatField()),
+    )
+    transaction.on_commit(lambda: get_front_page().add_votes(scores))
+    karma = {}
+    for pk, n in counts.items():
+        posted_by_id = links.get(pk, (None, None))[1]
+        if posted_by_id is not None:
+            karma[posted_by_id] = karma.get(posted_by_id, 0) + n
+    if karma:
+        UserModel.objects.filter(pk__in=karma.keys()).update(
+            karma=F('karma') + Case(
+                *[When(pk=pk, then=Value(n)) for pk, n in karma.items()],
+                default=Value(0), output_field=IntegerField()),
+        )
@@ -0,0 +1,169 @@
+# howtographql-graphene-tutorial-fixed -- links/search.py
+#
+# Copyright © 2017 Sean Bolton.
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE
+# LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION
+# WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+"""Full-text search over link descriptions and URLs.
+
+allLinks(filter: { search: "..." }) is backed by a real full-text index rather than an 'icontains'
+scan of the links table:
+
+- On SQLite, an FTS5 virtual table, links_linkmodel_fts, indexes the description and url columns
+  of links_linkmodel as an "external content" table. Triggers on links_linkmodel keep it in sync,
+  so every way of writing links (createLink, createLinks' bulk_create(), the admin, imports) is
+  covered. Relevance is FTS5's bm25 rank.
+
+- On PostgreSQL, a GIN expression index over to_tsvector() of the same columns is used, and
+  relevance is ts_rank(). The expression index is maintained by PostgreSQL itself.
+
+install_search_index() creates whichever of these the database needs; it runs after every
+migrate, via the post_migrate signal (see links/apps.py). On any other database, or on an SQLite
+built without FTS5, search falls back to a (slow) case-insensitive substring match.
+"""
+
+import logging
+import re
+
+from django.db import connections, router
+from django.db.models import Q
+from django.db.utils import OperationalError
+
+logger = logging.getLogger(__name__)
+
+FTS_TABLE = 'links_linkmodel_fts'
+
+# Only changes to the indexed columns re-index a link: votes update vote_count and hot_score on
+# every link they touch, and the decay runs update every link's hot_score.
+SQLITE_UPDATE_TRIGGER_SQL = (
+    "CREATE TRIGGER {fts}_update AFTER UPDATE OF description, url ON links_linkmodel BEGIN "
+    "INSERT INTO {fts}({fts}, rowid, description, url) "
+    "VALUES ('delete', old.id, old.description, old.url); "
+    "INSERT INTO {fts}(rowid, description, url) VALUES (new.id, new.description, new.url); END"
+)
+
+SQLITE_INDEX_SQL = [
+    "CREATE VIRTUAL TABLE {fts} USING fts5("
+    "description, url, content='links_linkmodel', content_rowid='id')",
+    "CREATE TRIGGER {fts}_insert AFTER INSERT ON links_linkmodel BEGIN "
+    "INSERT INTO {fts}(rowid, description, url) VALUES (new.id, new.description, new.url); END",
+    "CREATE TRIGGER {fts}_delete AFTER DELETE ON links_linkmodel BEGIN "
+    "INSERT INTO {fts}({fts}, rowid, description, url) "
+    "VALUES ('delete', old.id, old.description, old.url); END",
+    SQLITE_UPDATE_TRIGGER_SQL,
+    # index any links that existed before the index did
+    "INSERT INTO {fts}({fts}) VALUES ('rebuild')",
+]
+
+POSTGRESQL_DOCUMENT = "to_tsvector('english', coalesce(links_linkmodel.description, '') || ' ' || " \
+                      "links_linkmodel.url)"
+
+POSTGRESQL_INDEX_SQL = [
+    "CREATE INDEX IF NOT EXISTS links_linkmodel_search ON links_linkmodel "
+    "USING GIN ((" + POSTGRESQL_DOCUMENT + "))",
+]
+
+# Database aliases known to have a usable index, so search_links() doesn't have to ask every time.
+indexed_aliases = set()
+
+
+def install_search_index(using='default', **kwargs):
+    """Create the full-text index for database `using`, if it doesn't already exist. Suitable for
+    connecting to the post_migrate signal.
+    """
+    if not router.allow_migrate(using, 'links', model_name='linkmodel'):
+        return  # e.g. a vote shard, see links/shards.py
+    connection = connections[using]
+    with connection.cursor() as cursor:
+        if connection.vendor == 'sqlite':
+            if FTS_TABLE in connection.introspection.table_names(cursor):
+                upgrade_sqlite_update_trigger(cursor)
+                indexed_aliases.add(using)
+                return
+            try:
+                for sql in SQLITE_INDEX_SQL:
+                    cursor.execute(sql.format(fts=FTS_TABLE))
+            except OperationalError as e:
+                logger.warning('Full-text link search unavailable, no SQLite FTS5 support: %s', e)
+                return
+        elif connection.vendor == 'postgresql':
+            for sql in POSTGRESQL_INDEX_SQL:
+                cursor.execute(sql)
+        else:
+            return
+    indexed_aliases.add(using)
+
+
+def upgrade_sqlite_update_trigger(cursor):
+    """Replace an existing index's update trigger, if it predates SQLITE_UPDATE_TRIGGER_SQL (it
+    used to fire on every update of a link, rather than only on changes to the indexed columns).
+    """
+    sql = SQLITE_UPDATE_TRIGGER_SQL.format(fts=FTS_TABLE)
+    cursor.execute("SELECT sql FROM sqlite_master WHERE type = 'trigger' AND name = %s",
+                   [FTS_TABLE + '_update'])
+    row = cursor.fetchone()
+    if row is None or row[0] != sql:
+        cursor.execute('DROP TRIGGER IF EXISTS {}_update'.format(FTS_TABLE))
+        cursor.execute(sql)
+
+
+def has_search_index(using):
+    if using not in indexed_aliases:
+        connection = connections[using]
+        if connection.vendor == 'postgresql':
+            indexed_aliases.add(using)
+        elif connection.vendor == 'sqlite':
+            with connection.cursor() as cursor:
+                if FTS_TABLE in connection.introspection.table_names(cursor):
+                    indexed_aliases.add(using)
+    return using in indexed_aliases
+
+
+def search_links(qs, terms):
+    """Filter a LinkModel QuerySet down to the links matching all the words in `terms`, annotated
+    with 'search_rank', which is higher for more relevant links.
+    """
+    words = re.findall(r'\w+', terms)
+    if not words:
+        return qs.extra(select={'search_rank': '0'}).none()
+    vendor = connections[qs.db].vendor
+    if not has_search_index(qs.db):
+        for word in words:
+            qs = qs.filter(Q(description__icontains=word) | Q(url__icontains=word))
+        return qs.extra(select={'search_rank': '0'})
+    if vendor == 'sqlite':
+        # Quote each word, so nothing in the user's input is taken as FTS5 query syntax. A list
+        # of quoted words matches rows containing all of them.
+        query = ' '.join('"{}"'.format(word) for word in words)
+        return qs.extra(
+            tables=[FTS_TABLE],
+            where=[FTS_TABLE + '.rowid = links_linkmodel.id', FTS_TABLE + ' MATCH %s'],
+            params=[query],
+            select={'search_rank': '-' + FTS_TABLE + '.rank'},
+        )
+    # PostgreSQL
+    query = ' '.join(words)
+    return qs.extra(
+        where=[POSTGRESQL_DOCUMENT + " @@ plainto_tsquery('english', %s)"],
+        params=[query],
+        select={'search_rank': 'ts_rank(' + POSTGRESQL_DOCUMENT +
+                               ", plainto_tsquery('english', %s))"},
+        select_params=[query],
+    )
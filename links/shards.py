@@ -0,0 +1,207 @@
+# howtographql-graphene-tutorial-fixed -- links/shards.py
+#
+# Copyright © 2017 Sean Bolton.
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE
+# LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION
+# WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+"""Hash-sharded vote storage.
+
+VoteModel is the biggest and fastest-growing table. With VOTE_SHARD_URLS set, settings.py adds one
+database per URL ('votes_0', 'votes_1', ..., listed in VOTE_SHARDS), and votes are stored in those
+instead of the default database. All the votes on a link live in the same shard, chosen by a hash
+of the link's id, so the queries that name a link (Link.votes, allVotes filtered by link, the
+duplicate-vote checks and the vote counts) each go to a single shard. The rest (unfiltered
+allVotes, allVotes filtered by user, User.votes) are scattered to every shard and gathered with
+hackernews.sharding.ConcatenatedQuerySet. Shard i's vote ids start above i * VOTE_SHARD_ID_SPAN, so
+ids stay unique across shards, and a Relay node lookup knows which shard to ask.
+
+Votes can't have foreign keys to links and users in another database, so with sharding, VoteModel's
+foreign keys have no database constraints and no cascading deletes; deleting a link or a user
+deletes its votes from the shards with a signal handler instead. Writes that add votes are atomic
+on the vote shards and the default database (hackernews.sharding.atomic()), with the votes
+committed first. Should the second commit fail, the links' counters are short, which
+'./manage.py recompute_scores --recount' corrects.
+
+Without VOTE_SHARDS, everything here routes votes to the default database, or the replica (see
+hackernews/routers.py), as before. To try it with local SQLite files:
+
+    $ export VOTE_SHARD_URLS=sqlite:///votes0.sqlite3,sqlite:///votes1.sqlite3
+    $ ./manage.py migrate
+    $ ./manage.py migrate --database votes_0 && ./manage.py migrate --database votes_1
+    $ ./manage.py test links.tests.ShardedVoteTests
+"""
+
+from collections import OrderedDict
+
+from django.conf import settings
+from django.db.models import Count
+
+from hackernews.sharding import ConcatenatedQuerySet, atomic, set_id_floor, shard_index
+from hackernews.utils import bulk_create_with_pks
+from links.models import LinkModel, VoteModel
+
+
+def vote_shards():
+    """Return the aliases of the vote shard databases, or an empty list if votes aren't sharded."""
+    return getattr(settings, 'VOTE_SHARDS', None) or []
+
+
+def vote_databases():
+    """Return every database holding votes, in vote id order. None means the usual routing."""
+    return vote_shards() or [None]
+
+
+def id_span():
+    return getattr(settings, 'VOTE_SHARD_ID_SPAN', 10 ** 12)
+
+
+def shard_for_link(link_id):
+    """Return the database holding the votes on link `link_id` (None: the usual routing)."""
+    shards = vote_shards()
+    return shards[shard_index(link_id, len(shards))] if shards else None
+
+
+def shard_for_vote(pk):
+    """Return the database that would hold the vote with primary key `pk`."""
+    shards = vote_shards()
+    if not shards:
+        return None
+    return shards[min(max(int(pk) // id_span(), 0), len(shards) - 1)]
+
+
+def group_by_shard(link_ids):
+    """Return an OrderedDict mapping databases to the ones of `link_ids` whose votes they hold."""
+    groups = OrderedDict()
+    for link_id in link_ids:
+        groups.setdefault(shard_for_link(link_id), []).append(link_id)
+    return groups
+
+
+# ========== reads ==========
+
+def votes(link_id=None, filter=None, reverse=False):
+    """Return the votes on link `link_id`, or on all links, in id order, or newest first if
+    `reverse`. `filter`, if given, is a function applied to each database's QuerySet. The result is
+    a QuerySet when only one database is involved, and a ConcatenatedQuerySet otherwise.
+    """
+    aliases = [shard_for_link(link_id)] if link_id is not None else vote_databases()
+    if reverse:
+        aliases = aliases[::-1]
+    querysets = []
+    for alias in aliases:
+        qs = VoteModel.objects.using(alias).order_by('-id' if reverse else 'id')
+        if link_id is not None:
+            qs = qs.filter(link_id=link_id)
+        querysets.append(filter(qs) if filter else qs)
+    return querysets[0] if len(querysets) == 1 else ConcatenatedQuerySet(querysets)
+
+
+def get_vote(pk):
+    """Return the vote with primary key `pk`, or None."""
+    return VoteModel.objects.using(shard_for_vote(pk)).filter(pk=pk).first()
+
+
+def existing_votes(user_ids, link_ids):
+    """Return the set of (user_id, link_id) pairs, from `user_ids` and `link_ids`, that have votes,
+    with one query per shard involved.
+    """
+    found = set()
+    for alias, ids in group_by_shard(set(link_ids)).items():
+        found.update(VoteModel.objects.using(alias).filter(user_id__in=user_ids, link_id__in=ids)
+                     .values_list('user_id', 'link_id'))
+    return found
+
+
+def count_votes(link_ids):
+    """Return a dict mapping each of `link_ids` that has votes to its number of votes."""
+    counts = {}
+    for alias, ids in group_by_shard(link_ids).items():
+        counts.update(VoteModel.objects.using(alias).filter(link_id__in=ids).order_by()
+                      .values_list('link_id').annotate(Count('id')))
+    return counts
+
+
+# ========== writes ==========
+
+def atomic_for_votes(link_ids):
+    """Return a context manager that is atomic on the default database and on the shards holding
+    the votes on `link_ids`, which commit first.
+    """
+    return atomic(None, *group_by_shard(link_ids))
+
+
+def create_votes(new_votes):
+    """Insert `new_votes` with one bulk_create() per shard, setting their primary keys."""
+    groups = OrderedDict()
+    for vote in new_votes:
+        groups.setdefault(shard_for_link(vote.link_id), []).append(vote)
+    for alias, group in groups.items():
+        bulk_create_with_pks(VoteModel, group, using=alias, natural_key=('user_id', 'link_id'))
+    return new_votes
+
+
+def link_deleted(sender, instance, **kwargs):
+    """post_delete handler for LinkModel, standing in for the cascade with sharded votes."""
+    VoteModel.objects.using(shard_for_link(instance.pk)).filter(link_id=instance.pk).delete()
+
+
+def user_deleted(sender, instance, **kwargs):
+    """post_delete handler for UserModel, standing in for the cascade with sharded votes."""
+    for alias in vote_shards():
+        VoteModel.objects.using(alias).filter(user_id=instance.pk).delete()
+
+
+def install_vote_sequences(using='default', **kwargs):
+    """Start the vote ids of shard `using` at its id floor. Suitable for connecting to the
+    post_migrate signal.
+    """
+    shards = vote_shards()
+    if using in shards:
+        set_id_floor(using, VoteModel, shards.index(using) * id_span())
+
+
+# ========== database router ==========
+
+class VoteShardRouter(object):
+    """Sends reads and writes of a vote instance (and of a link's votes) to their shard, and keeps
+    the votes table on the shards and everything else off them. Otherwise it has no opinion, and
+    the next router decides; QuerySets over votes choose their shard with using(), see votes().
+    """
+    def db_for_read(self, model, **hints):
+        if model is VoteModel and vote_shards():
+            instance = hints.get('instance')
+            if isinstance(instance, VoteModel) and instance.link_id is not None:
+                return shard_for_link(instance.link_id)
+            if isinstance(instance, LinkModel) and instance.pk is not None:
+                return shard_for_link(instance.pk)
+        return None
+
+    db_for_write = db_for_read
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        shards = vote_shards()
+        if not shards:
+            return None
+        if app_label == 'links' and model_name == 'votemodel':
+            return db in shards
+        return False if db in shards else None
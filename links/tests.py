@@ -21,14 +21,38 @@
 # OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION
 # WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
 
-from django.test import TestCase
+import datetime
+import io
+import threading
+import time
+from collections import Counter
+from contextlib import ExitStack
+from unittest import mock, skipUnless
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.management import call_command
+from django.db import connection
+from django.db.models import F
+from django.db.models.signals import post_delete, post_save
+from django.test import TestCase, TransactionTestCase
+from django.utils import timezone
 
 import graphene
 from graphene.relay import Node
 
+from hackernews.nodecache import NodeCache, get_node_cache
 from hackernews.schema import Mutation, Query
 from hackernews.utils import format_graphql_errors, quiet_graphql, unquiet_graphql
+from links.frontpage import FrontPage, get_front_page
+from links import shards
+from links.leaderboard import Leaderboard, get_leaderboard
 from links.models import LinkModel, VoteModel
+from links import scores, search
+from links.scores import hot_score, record_votes
+from links.urlnorm import canonicalize_url, normalize_domain
+from links.votequeue import PendingVote, VoteWriter, save_vote
+from users.models import UserModel
 from users.tests import create_test_user
 
 
@@ -144,6 +168,8 @@ class ViewerTests(TestCase):
 
 class RelayNodeTests(TestCase):
     """Test that model nodes can be retreived via the Relay Node interface."""
+    multi_db = True  # votes may live in the vote shards (see links/shards.py)
+
     def test_node_for_link(self):
         link = LinkModel.objects.create(description='Test', url='http://a.com')
         link_gid = Node.to_global_id('Link', link.pk)
@@ -227,6 +253,96 @@ class RelayNodeTests(TestCase):
         self.assertEqual(result.data, expected, msg='\n'+repr(expected)+'\n'+repr(result.data))
 
 
+# ========== Node cache tests ==========
+
+class NodeCacheTests(TestCase):
+    def setUp(self):
+        caches['default'].clear()
+        get_node_cache().clear()
+        self.user = create_test_user()
+        self.link = LinkModel.objects.create(url='http://example.com', description='Cached',
+                                             posted_by=self.user)
+        self.link_gid = Node.to_global_id('Link', self.link.pk)
+        self.query = '''
+          query {
+            node(id: "%s") {
+              ...on Link { description voteCount }
+            }
+          }
+        ''' % self.link_gid
+        self.schema = graphene.Schema(query=Query, mutation=Mutation)
+
+    def execute(self):
+        result = self.schema.execute(self.query)
+        self.assertIsNone(result.errors, msg=format_graphql_errors(result.errors))
+        return result.data['node']
+
+    def test_repeated_lookup_is_cached(self):
+        cache = get_node_cache()
+        self.assertEqual(cache.get(LinkModel, self.link.pk).description, 'Cached')
+        with self.assertNumQueries(0):
+            link = cache.get(LinkModel, str(self.link.pk))
+            self.assertEqual(link.url, 'http://example.com')
+            self.assertEqual(link.posted_by_id, self.user.pk)
+        get_node_cache().clear()  # the shared tier still has it
+        with self.assertNumQueries(0):
+            cache.get(LinkModel, self.link.pk)
+
+    def test_missing_and_invalid_pks(self):
+        cache = get_node_cache()
+        self.assertIsNone(cache.get(LinkModel, self.link.pk + 1))
+        self.assertIsNone(cache.get(LinkModel, 'not a pk'))
+
+    def test_save_and_delete_invalidate(self):
+        self.assertEqual(self.execute()['description'], 'Cached')
+        self.link.description = 'Edited'
+        self.link.save()
+        self.assertEqual(self.execute()['description'], 'Edited')
+        self.link.delete()
+        self.assertIsNone(self.execute())
+
+    def test_counters_are_not_cached(self):
+        """vote counts are read from the database, so votes never invalidate the cache"""
+        self.assertEqual(self.execute()['voteCount'], 0)
+        record_votes({self.link.pk: 2})
+        self.assertEqual(self.execute()['voteCount'], 2)
+        self.assertEqual(get_node_cache().get(UserModel, self.user.pk).karma, 2)
+
+    def test_concurrent_misses_load_once(self):
+        cache = NodeCache()
+        cache.register(LinkModel)
+        self.addCleanup(post_save.disconnect, cache.on_change, sender=LinkModel)
+        self.addCleanup(post_delete.disconnect, cache.on_change, sender=LinkModel)
+        values = (self.link.pk, 'Cached', 'http://example.com')
+        loads = []
+        def slow_load(model, pk, key):
+            loads.append(pk)
+            time.sleep(0.05)
+            return values
+        cache.fields[LinkModel] = ('id', 'description', 'url')
+        with mock.patch.object(cache, 'load', side_effect=slow_load):
+            threads = [threading.Thread(target=cache.get, args=(LinkModel, self.link.pk))
+                       for _ in range(8)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        self.assertEqual(loads, [self.link.pk])
+
+    def test_lease_timeout_in_whole_seconds(self):
+        """a fractional timeout would be truncated to 0 (never expire) by memcached"""
+        shared = mock.Mock()
+        shared.get.return_value = None
+        with mock.patch.object(NodeCache, 'cache', new_callable=mock.PropertyMock,
+                               return_value=shared):
+            self.assertEqual(get_node_cache().get(LinkModel, self.link.pk).description, 'Cached')
+        (key, value, timeout), _ = shared.add.call_args
+        self.assertTrue(key.endswith(':lease'))
+        self.assertIsInstance(timeout, int)
+        self.assertGreaterEqual(timeout, 1)
+        shared.delete.assert_called_once_with(key)
+
+
 # ========== allLinks query tests ==========
 
 def create_Link_orderBy_test_data():
@@ -421,6 +537,279 @@ class LinkTests(TestCase):
         assert result.data == expected, '\n'+repr(expected)+'\n'+repr(result.data)
 
 
+class LinkSearchTests(TestCase):
+    def setUp(self):
+        LinkModel.objects.create(description='A new Rust compiler release', url='http://a.com')
+        LinkModel.objects.create(description='Compiler construction', url='http://rust.org/b')
+        LinkModel.objects.create(description='Rust, Rust and more rust', url='http://c.com/rust')
+        LinkModel.objects.create(description='Nothing relevant', url='http://d.com')
+        self.query = '''
+          query AllLinksSearchTest($search: String, $first: Int) {
+            viewer {
+              allLinks(filter: { search: $search }, first: $first) {
+                edges {
+                  node {
+                    url
+                  }
+                }
+              }
+            }
+          }
+        '''
+        self.schema = graphene.Schema(query=Query)
+
+    def search(self, search, first=None):
+        result = self.schema.execute(self.query,
+                                     variable_values={'search': search, 'first': first})
+        self.assertIsNone(result.errors, msg=format_graphql_errors(result.errors))
+        return [edge['node']['url'] for edge in result.data['viewer']['allLinks']['edges']]
+
+    def test_search(self):
+        """search matches all the words, in description or url, most relevant first"""
+        self.assertEqual(sorted(self.search('rust compiler')), ['http://a.com', 'http://rust.org/b'])
+        self.assertEqual(self.search('rust')[0], 'http://c.com/rust')
+        self.assertEqual(self.search('rust', first=2), self.search('rust')[:2])
+
+    def test_search_syntax(self):
+        """characters that mean something to the full-text engine are just separators"""
+        self.assertEqual(self.search('"compiler" OR -nothing*'), [])
+        self.assertEqual(self.search('  '), [])
+
+    def test_search_index_in_sync(self):
+        """the search index follows changes to links, including bulk ones"""
+        LinkModel.objects.bulk_create([LinkModel(description='Bulk rust', url='http://e.com')])
+        LinkModel.objects.filter(url='http://d.com').update(description='Rust after all')
+        LinkModel.objects.filter(url='http://c.com/rust').delete()
+        self.assertEqual(sorted(self.search('rust')),
+                         ['http://a.com', 'http://d.com', 'http://e.com', 'http://rust.org/b'])
+
+    @skipUnless(connection.vendor == 'sqlite', 'tests the SQLite FTS5 triggers')
+    def test_score_updates_leave_index_alone(self):
+        """only changes to the description or url re-index a link, not vote count updates"""
+        if not search.has_search_index('default'):
+            self.skipTest('no SQLite FTS5 support')
+        def changes(**update):
+            with connection.cursor() as cursor:
+                cursor.execute('SELECT total_changes()')
+                before = cursor.fetchone()[0]
+                LinkModel.objects.filter(url='http://d.com').update(**update)
+                cursor.execute('SELECT total_changes()')
+                return cursor.fetchone()[0] - before
+        self.assertEqual(changes(vote_count=F('vote_count') + 1), 1)
+        self.assertGreater(changes(description='Rust after all'), 1)
+        self.assertEqual(self.search('after'), ['http://d.com'])
+
+    @skipUnless(connection.vendor == 'sqlite', 'tests the SQLite FTS5 triggers')
+    def test_update_trigger_upgraded(self):
+        """an index whose update trigger fires on every update gets the narrower trigger"""
+        if not search.has_search_index('default'):
+            self.skipTest('no SQLite FTS5 support')
+        old = search.SQLITE_UPDATE_TRIGGER_SQL.replace(' OF description, url', '')
+        with connection.cursor() as cursor:
+            cursor.execute('DROP TRIGGER {}_update'.format(search.FTS_TABLE))
+            cursor.execute(old.format(fts=search.FTS_TABLE))
+        search.install_search_index('default')
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT sql FROM sqlite_master WHERE name = %s",
+                           [search.FTS_TABLE + '_update'])
+            self.assertEqual(cursor.fetchone()[0],
+                             search.SQLITE_UPDATE_TRIGGER_SQL.format(fts=search.FTS_TABLE))
+
+    def test_search_without_index(self):
+        """without a full-text index, search falls back to substring matching"""
+        with mock.patch('links.search.has_search_index', return_value=False):
+            self.assertEqual(sorted(self.search('rust compiler')),
+                             ['http://a.com', 'http://rust.org/b'])
+
+
+class LinkDomainTests(TestCase):
+    def setUp(self):
+        caches['default'].clear()
+        for url in ('https://github.com/a', 'http://WWW.GitHub.com:8080/b', 'http://example.com/',
+                    'http://docs.python.org/3/', 'https://github.com./c'):
+            LinkModel.objects.create(description='Description', url=url)
+        self.schema = graphene.Schema(query=Query)
+
+    def test_normalize_domain(self):
+        """domains are lower-cased, without port or 'www.', from URLs or bare domain names"""
+        self.assertEqual(normalize_domain('HTTPS://www.Example.COM:443/path?q=1'), 'example.com')
+        self.assertEqual(normalize_domain('www.example.com'), 'example.com')
+        self.assertEqual(normalize_domain('http://'), '')
+
+    def test_domain_filter(self):
+        """allLinks can be filtered by domain"""
+        query = '''
+          query {
+            viewer {
+              allLinks(filter: { domain: "https://www.github.com" }, orderBy: id_ASC) {
+                edges { node { url } }
+              }
+            }
+          }
+        '''
+        result = self.schema.execute(query)
+        self.assertIsNone(result.errors, msg=format_graphql_errors(result.errors))
+        urls = [edge['node']['url'] for edge in result.data['viewer']['allLinks']['edges']]
+        self.assertEqual(urls, ['https://github.com/a', 'http://WWW.GitHub.com:8080/b',
+                                'https://github.com./c'])
+
+    def test_top_domains(self):
+        """topDomains counts links per domain, most first, and caches the result"""
+        query = '''
+          query {
+            viewer {
+              topDomains(first: 2) { domain count }
+            }
+          }
+        '''
+        expected = {
+            'viewer': {
+                'topDomains': [
+                    { 'domain': 'github.com', 'count': 3 },
+                    { 'domain': 'docs.python.org', 'count': 1 },
+                ]
+            }
+        }
+        result = self.schema.execute(query)
+        self.assertIsNone(result.errors, msg=format_graphql_errors(result.errors))
+        self.assertEqual(result.data, expected, msg='\n'+repr(expected)+'\n'+repr(result.data))
+        with self.assertNumQueries(0):
+            result = self.schema.execute(query)
+        self.assertEqual(result.data, expected, msg='\n'+repr(expected)+'\n'+repr(result.data))
+
+    def test_backfill_links(self):
+        """the backfill_links command fills in missing domains"""
+        LinkModel.objects.update(domain='')
+        call_command('backfill_links', batch_size=2, stdout=io.StringIO())
+        self.assertEqual(LinkModel.objects.filter(domain='github.com').count(), 3)
+        self.assertFalse(LinkModel.objects.filter(domain='').exists())
+
+
+# ========== front page window tests ==========
+
+FRONT_PAGE_QUERY = '''
+  query {
+    viewer {
+      allLinks(orderBy: createdAt_DESC, first: %d) {
+        edges { cursor node { description voteCount } }
+        pageInfo { hasNextPage endCursor }
+      }
+    }
+  }
+'''
+
+class FrontPageTests(TestCase):
+    def setUp(self):
+        get_front_page().reset()
+        for i in range(3):
+            LinkModel.objects.create(url='http://example.com/%d' % i, description='Link %d' % i)
+        self.schema = graphene.Schema(query=Query, mutation=Mutation)
+
+    def all_links(self, first):
+        result = self.schema.execute(FRONT_PAGE_QUERY % first)
+        self.assertIsNone(result.errors, msg=format_graphql_errors(result.errors))
+        return result.data['viewer']['allLinks']
+
+    def test_first_page_served_from_memory(self):
+        first_load = self.all_links(2)
+        with self.assertNumQueries(0):
+            links = self.all_links(2)
+        self.assertEqual(links, first_load)
+        self.assertEqual([e['node']['description'] for e in links['edges']], ['Link 2', 'Link 1'])
+        self.assertTrue(links['pageInfo']['hasNextPage'])
+        with self.assertNumQueries(0):
+            self.assertFalse(self.all_links(3)['pageInfo']['hasNextPage'])
+
+    def test_same_cursors_as_database(self):
+        """a client can page from the window into the database"""
+        links = self.all_links(2)
+        get_front_page().reset()
+        with mock.patch.object(FrontPage, 'get_links', return_value=None):
+            self.assertEqual(self.all_links(2), links)
+
+    def test_other_queries_use_database(self):
+        self.all_links(2)
+        front_page = get_front_page()
+        self.assertIsNone(front_page.get_links({'order_by': '-created_at', 'first': 2,
+                                                'after': 'YXJyYXljb25uZWN0aW9uOjE='}))
+        self.assertIsNone(front_page.get_links({'order_by': '-id', 'first': 2}))
+        self.assertIsNone(front_page.get_links({'order_by': '-created_at', 'first': 2,
+                                                'filter': {'domain': 'example.com'}}))
+        self.assertIsNone(front_page.get_links({'order_by': '-created_at'}))
+        self.assertIsNone(front_page.get_links({'order_by': '-created_at',
+                                                'first': front_page.size + 1}))
+
+    def test_version_check_sees_other_writers(self):
+        self.all_links(2)
+        # bulk_create() sends no signals, like a write by another process
+        LinkModel.objects.bulk_create([LinkModel(url='http://example.com/new',
+                                                 description='Elsewhere')])
+        self.assertEqual(self.all_links(1)['edges'][0]['node']['description'], 'Link 2')
+        get_front_page().checked_at = 0.0  # the check interval has passed
+        self.assertEqual(self.all_links(1)['edges'][0]['node']['description'], 'Elsewhere')
+
+    def test_posted_by_not_kept(self):
+        """the window holds no related users, so a postedBy served from it is current"""
+        user = create_test_user()
+        LinkModel.objects.filter(description='Link 2').update(posted_by=user)
+        query = '{ viewer { allLinks(orderBy: createdAt_DESC, first: 1) { edges { node { ' \
+                'postedBy { karma } } } } } }'
+        def karma():
+            result = self.schema.execute(query)
+            self.assertIsNone(result.errors, msg=format_graphql_errors(result.errors))
+            return result.data['viewer']['allLinks']['edges'][0]['node']['postedBy']['karma']
+        self.assertEqual(karma(), 0)
+        UserModel.objects.filter(pk=user.pk).update(karma=5)
+        self.assertEqual(karma(), 5)
+
+    def test_incomplete_window(self):
+        front_page = FrontPage(size=2)
+        self.assertEqual(len(front_page.get_links({'order_by': '-created_at', 'first': 1})), 2)
+        self.assertIsNone(front_page.get_links({'order_by': '-created_at', 'first': 2}))
+
+
+class FrontPageUpdateTests(TransactionTestCase):
+    multi_db = True  # votes may live in the vote shards (see links/shards.py)
+
+    def setUp(self):
+        caches['default'].clear()
+        get_node_cache().clear()
+        get_front_page().reset()
+        self.user = create_test_user()
+        self.schema = graphene.Schema(query=Query, mutation=Mutation)
+
+    def test_mutations_update_window_in_place(self):
+        LinkModel.objects.create(url='http://example.com/old', description='Old')
+        self.schema.execute(FRONT_PAGE_QUERY % 5)  # load the window
+        class Auth(object):
+            META = {'HTTP_AUTHORIZATION': 'Bearer {}'.format(self.user.token)}
+        create_link = '''
+          mutation {
+            createLink(input: { url: "http://example.com/new", description: "New" }) {
+              link { id }
+            }
+          }
+        '''
+        result = self.schema.execute(create_link, context_value=Auth)
+        self.assertIsNone(result.errors, msg=format_graphql_errors(result.errors))
+        link_gid = result.data['createLink']['link']['id']
+        create_vote = '''
+          mutation CreateVote($input: CreateVoteInput!) {
+            createVote(input: $input) { vote { id } }
+          }
+        '''
+        variables = {'input': {'linkId': link_gid,
+                               'userId': Node.to_global_id('User', self.user.pk)}}
+        result = self.schema.execute(create_vote, variable_values=variables, context_value=Auth)
+        self.assertIsNone(result.errors, msg=format_graphql_errors(result.errors))
+        with self.assertNumQueries(0):
+            result = self.schema.execute(FRONT_PAGE_QUERY % 5)
+        self.assertIsNone(result.errors, msg=format_graphql_errors(result.errors))
+        nodes = [e['node'] for e in result.data['viewer']['allLinks']['edges']]
+        self.assertEqual(nodes, [{'description': 'New', 'voteCount': 1},
+                                 {'description': 'Old', 'voteCount': 0}])
+
+
 # ========== createLink mutation tests ==========
 
 class CreateLinkBasicTest(TestCase):
@@ -566,9 +955,297 @@ class CreateLinkTests(TestCase):
         self.assertEqual(result.data, expected, msg='\n'+repr(expected)+'\n'+repr(result.data))
 
 
+class DuplicateLinkTests(TestCase):
+    multi_db = True  # votes may live in the vote shards (see links/shards.py)
+
+    def setUp(self):
+        self.original = LinkModel.objects.create(description='Original',
+                                                 url='https://www.example.com/story/?id=1')
+        self.query = '''
+          mutation CreateLinkMutation($input: CreateLinkInput!) {
+            createLink(input: $input) {
+              link { id description }
+            }
+          }
+        '''
+        self.schema = graphene.Schema(query=Query, mutation=Mutation)
+
+    def create_link(self, url, return_existing=None):
+        class Context(object):
+            META = {}
+        variables = { 'input': { 'description': 'Resubmitted', 'url': url } }
+        if return_existing is not None:
+            variables['input']['returnExisting'] = return_existing
+        result = self.schema.execute(self.query, variable_values=variables, context_value=Context)
+        self.assertIsNone(result.errors, msg=format_graphql_errors(result.errors))
+        return result.data['createLink']['link']
+
+    def test_url_hash_not_exposed(self):
+        self.assertNotIn('urlHash', self.schema.get_type('Link').fields)
+
+    def test_canonicalize_url(self):
+        """trivial variations of a URL have the same canonical form"""
+        canonical = canonicalize_url('http://example.com/story?id=1&page=2')
+        for url in ('https://WWW.example.com:443/story/?page=2&id=1#comments',
+                    'http://example.com/story?utm_source=feed&id=1&page=2&fbclid=abc'):
+            self.assertEqual(canonicalize_url(url), canonical)
+        self.assertNotEqual(canonicalize_url('http://example.com/story?id=2&page=2'), canonical)
+
+    def test_return_existing(self):
+        """with returnExisting, createLink returns the existing link for a resubmitted URL"""
+        link = self.create_link('http://example.com/story?id=1&utm_medium=email', True)
+        self.assertEqual(link['description'], 'Original')
+        self.assertEqual(LinkModel.objects.count(), 1)
+        link = self.create_link('http://example.com/story?id=2', True)
+        self.assertEqual(link['description'], 'Resubmitted')
+        self.assertEqual(LinkModel.objects.count(), 2)
+
+    def test_return_existing_default(self):
+        """without returnExisting, the RETURN_EXISTING_LINKS setting decides"""
+        self.assertEqual(self.create_link('http://example.com/story?id=1')['description'],
+                         'Resubmitted')
+        with self.settings(RETURN_EXISTING_LINKS=True):
+            self.assertEqual(self.create_link('http://example.com/story?id=1')['description'],
+                             'Original')
+            self.assertEqual(self.create_link('http://example.com/story?id=1', False)
+                             ['description'], 'Resubmitted')
+
+    def test_dedup_links(self):
+        """dedup_links merges duplicates into the oldest link, keeping one vote per user"""
+        user1 = create_test_user()
+        user2 = create_test_user(name='Another User', password='zyz987', email='ano@user.com')
+        dup1 = LinkModel.objects.create(description='Dup 1', url='http://example.com/story?id=1')
+        dup2 = LinkModel.objects.create(description='Dup 2', url='http://example.com/story/?id=1')
+        other = LinkModel.objects.create(description='Other', url='http://example.com/other')
+        VoteModel.objects.create(link=self.original, user=user1)
+        VoteModel.objects.create(link=dup1, user=user1)
+        VoteModel.objects.create(link=dup1, user=user2)
+        VoteModel.objects.create(link=dup2, user=user2)
+        VoteModel.objects.create(link=other, user=user2)
+        call_command('dedup_links', batch_size=1, stdout=io.StringIO())
+        self.assertEqual(sorted(LinkModel.objects.values_list('description', flat=True)),
+                         ['Original', 'Other'])
+        self.assertEqual(sorted(self.original.votes.values_list('user_id', flat=True)),
+                         [user1.pk, user2.pk])
+        self.assertEqual(shards.votes().count(), 3)
+
+    def test_dedup_links_karma(self):
+        """dedup_links moves the duplicates' karma to the kept link's poster"""
+        user1 = create_test_user()
+        user2 = create_test_user(name='Another User', password='zyz987', email='ano@user.com')
+        LinkModel.objects.filter(pk=self.original.pk).update(posted_by=user1)
+        dup = LinkModel.objects.create(description='Dup', url='http://example.com/story?id=1',
+                                       posted_by=user2)
+        VoteModel.objects.create(link=self.original, user=user1)
+        VoteModel.objects.create(link=dup, user=user1)
+        VoteModel.objects.create(link=dup, user=user2)
+        record_votes({self.original.pk: 1, dup.pk: 2})
+        self.assertEqual([UserModel.objects.get(pk=user.pk).karma for user in (user1, user2)],
+                         [1, 2])
+        call_command('dedup_links', stdout=io.StringIO())
+        self.assertEqual(LinkModel.objects.get(pk=self.original.pk).vote_count, 2)
+        self.assertEqual([UserModel.objects.get(pk=user.pk).karma for user in (user1, user2)],
+                         [2, 0])
+
+
+# ========== idempotent mutation tests ==========
+
+class IdempotentMutationTests(TestCase):
+    def setUp(self):
+        caches['default'].clear()
+        self.user = create_test_user()
+        self.query = '''
+          mutation CreateLinkMutation($input: CreateLinkInput!) {
+            createLink(input: $input) {
+              link { id }
+              clientMutationId
+            }
+          }
+        '''
+        self.schema = graphene.Schema(query=Query, mutation=Mutation)
+
+    def auth(self, token=True):
+        class Auth(object):
+            META = token and {'HTTP_AUTHORIZATION': 'Bearer {}'.format(self.user.token)} or {}
+        return Auth
+
+    def variables(self, client_mutation_id):
+        return {
+            'input': {
+                'description': 'Description',
+                'url': 'http://example.com',
+                'clientMutationId': client_mutation_id,
+            }
+        }
+
+    def execute(self, client_mutation_id, token=True):
+        result = self.schema.execute(self.query, variable_values=self.variables(client_mutation_id),
+                                     context_value=self.auth(token))
+        self.assertIsNone(result.errors, msg=format_graphql_errors(result.errors))
+        return result.data['createLink']
+
+    def test_replay_returns_cached_payload(self):
+        """a retried createLink returns the original link, without touching the database"""
+        first = self.execute('retry_me')
+        with self.assertNumQueries(0):
+            second = self.execute('retry_me')
+        self.assertEqual(first, second)
+        self.assertEqual(LinkModel.objects.count(), 1)
+
+    def test_new_request_is_not_replay(self):
+        """createLink requests with different clientMutationIds each create a link"""
+        first = self.execute('request_1')
+        second = self.execute('request_2')
+        self.assertNotEqual(first['link']['id'], second['link']['id'])
+        self.assertEqual(LinkModel.objects.count(), 2)
+
+    def test_anonymous_not_cached(self):
+        """without an auth token, there's no telling replays from new requests, so don't try"""
+        self.execute('same_id', token=False)
+        self.execute('same_id', token=False)
+        self.assertEqual(LinkModel.objects.count(), 2)
+
+    def test_concurrent_replay(self):
+        """a replay arriving while the original is executing doesn't run the mutation again"""
+        from users.schema import get_user_from_auth_token
+        replays = []
+        def interleave(context):
+            # the original has reserved its key; replay it now, before it finishes
+            if not replays:
+                replays.append(None)
+                with self.settings(IDEMPOTENCY_WAIT=0):
+                    replays[0] = self.schema.execute(
+                        self.query, variable_values=self.variables('retry_me'),
+                        context_value=context)
+            return get_user_from_auth_token(context)
+        with mock.patch('links.schema.get_user_from_auth_token', side_effect=interleave):
+            first = self.execute('retry_me')
+        self.assertEqual([error.message for error in replays[0].errors],
+                         ['This request is already in progress; retry it later.'])
+        self.assertEqual(LinkModel.objects.count(), 1)
+        self.assertEqual(self.execute('retry_me'), first)
+
+    def test_concurrent_replay_waits(self):
+        """a replay that waits for the original gets the original's payload"""
+        from users.schema import get_user_from_auth_token
+        replays, threads = [], []
+        def replay(context):
+            replays.append(self.schema.execute(
+                self.query, variable_values=self.variables('retry_me'), context_value=context))
+        def interleave(context):
+            # replay from another thread, which waits until this request stores its payload
+            thread = threading.Thread(target=replay, args=(context,))
+            thread.start()
+            threads.append(thread)
+            time.sleep(0.1)
+            return get_user_from_auth_token(context)
+        with mock.patch('links.schema.get_user_from_auth_token', side_effect=interleave):
+            first = self.execute('retry_me')
+        threads[0].join()
+        self.assertIsNone(replays[0].errors, msg=format_graphql_errors(replays[0].errors))
+        self.assertEqual(replays[0].data['createLink'], first)
+        self.assertEqual(LinkModel.objects.count(), 1)
+
+    def test_failure_releases_key(self):
+        """a failed mutation releases its key, so retrying it runs the mutation again"""
+        with mock.patch('links.schema.get_user_from_auth_token', side_effect=Exception('Boom')):
+            result = self.schema.execute(self.query, variable_values=self.variables('retry_me'),
+                                         context_value=self.auth())
+        self.assertEqual([error.message for error in result.errors], ['Boom'])
+        self.execute('retry_me')
+        self.assertEqual(LinkModel.objects.count(), 1)
+
+
+# ========== createLinks mutation tests ==========
+
+class CreateLinksTests(TestCase):
+    def setUp(self):
+        self.user = create_test_user()
+        self.query = '''
+          mutation CreateLinksMutation($input: CreateLinksInput!) {
+            createLinks(input: $input) {
+              results {
+                link {
+                  url
+                  postedBy { name }
+                }
+                error
+              }
+              clientMutationId
+            }
+          }
+        '''
+        self.variables = {
+            'input': {
+                'links': [
+                    { 'description': 'Link A', 'url': 'http://a.com' },
+                    { 'description': 'No URL', 'url': ' ' },
+                    { 'description': 'Link B', 'url': 'http://b.com' },
+                ],
+                'clientMutationId': 'give_this_back_to_me',
+            }
+        }
+        self.schema = graphene.Schema(query=Query, mutation=Mutation)
+
+    def context_with_token(self):
+        class Auth(object):
+            META = {'HTTP_AUTHORIZATION': 'Bearer {}'.format(self.user.token)}
+        return Auth
+
+    def test_create_links(self):
+        """createLinks creates the valid links, and reports errors for the others, in input order"""
+        LinkModel.objects.create(description='Existing', url='http://existing.com')
+        result = self.schema.execute(self.query, variable_values=self.variables,
+                                     context_value=self.context_with_token())
+        self.assertIsNone(result.errors, msg=format_graphql_errors(result.errors))
+        user = { 'name': self.user.name }
+        expected = {
+            'createLinks': {
+                'results': [
+                    { 'link': { 'url': 'http://a.com', 'postedBy': user }, 'error': None },
+                    { 'link': None, 'error': 'A link must have a URL!' },
+                    { 'link': { 'url': 'http://b.com', 'postedBy': user }, 'error': None },
+                ],
+                'clientMutationId': 'give_this_back_to_me',
+            }
+        }
+        self.assertEqual(result.data, expected, msg='\n'+repr(expected)+'\n'+repr(result.data))
+        self.assertEqual(LinkModel.objects.filter(posted_by=self.user).count(), 2)
+
+    def test_create_links_node_ids(self):
+        """the links returned by createLinks must have the ids of the stored links"""
+        query = '''
+          mutation CreateLinksMutation($input: CreateLinksInput!) {
+            createLinks(input: $input) {
+              results { link { id description } }
+            }
+          }
+        '''
+        result = self.schema.execute(query, variable_values=self.variables,
+                                     context_value=self.context_with_token())
+        self.assertIsNone(result.errors, msg=format_graphql_errors(result.errors))
+        for item in result.data['createLinks']['results']:
+            if item['link']:
+                _, pk = Node.from_global_id(item['link']['id'])
+                self.assertEqual(LinkModel.objects.get(pk=pk).description,
+                                 item['link']['description'])
+
+    def test_create_links_not_logged(self):
+        """createLinks requires a logged-in user"""
+        class Context(object):
+            META = {}
+        result = self.schema.execute(self.query, variable_values=self.variables,
+                                     context_value=Context)
+        self.assertIsNotNone(result.errors, msg='createLinks should have failed: no user logged-in')
+        self.assertIn('Only logged-in users may create links', repr(result.errors))
+        self.assertEqual(LinkModel.objects.count(), 0)
+
+
 # ========== Vote query tests ==========
 
 class VotesOnLinkTests(TestCase):
+    multi_db = True  # votes may live in the vote shards (see links/shards.py)
+
     def test_votes_count_on_link_test(self):
         """test count field on votes field on Link type"""
         # first link will have one vote, last link will have two
@@ -618,6 +1295,8 @@ class VotesOnLinkTests(TestCase):
 
 
 class AdHocCheckVoteQueryTests(TestCase):
+    multi_db = True  # votes may live in the vote shards (see links/shards.py)
+
     def test_ad_hoc_check_vote_query(self):
         """As of 11/4/2017, the tutorial contains an query done outside Relay, to check whether a
         vote already exists. (On the client side? Really? Ask forgiveness rather than permisson,
@@ -677,9 +1356,66 @@ class AdHocCheckVoteQueryTests(TestCase):
         self.assertEqual(result.data, expected, msg='\n'+repr(expected)+'\n'+repr(result.data))
 
 
+class ViewerHasVotedTests(TestCase):
+    multi_db = True  # votes may live in the vote shards (see links/shards.py)
+
+    def setUp(self):
+        create_Link_orderBy_test_data()
+        self.user = create_test_user()
+        user2 = create_test_user(name='Another User', password='zyz987', email='ano@user.com')
+        VoteModel.objects.create(link=LinkModel.objects.get(url='http://b.com'), user=self.user)
+        VoteModel.objects.create(link=LinkModel.objects.get(url='http://c.com'), user=user2)
+        self.query = '''
+          query {
+            viewer {
+              allLinks(orderBy: url_ASC) {
+                edges {
+                  node {
+                    url
+                    viewerHasVoted
+                  }
+                }
+              }
+            }
+          }
+        '''
+        self.schema = graphene.Schema(query=Query)
+
+    def voted(self, result):
+        self.assertIsNone(result.errors, msg=format_graphql_errors(result.errors))
+        return [(edge['node']['url'], edge['node']['viewerHasVoted'])
+                for edge in result.data['viewer']['allLinks']['edges']]
+
+    def test_viewer_has_voted(self):
+        """viewerHasVoted is resolved for the whole page with one votes query"""
+        class Auth(object):
+            META = {'HTTP_AUTHORIZATION': 'Bearer {}'.format(self.user.token)}
+        # one query each for the links and the user, and one for the user's votes on those links
+        # from each database holding them
+        expected = Counter({'default': 2})
+        for database in shards.group_by_shard(LinkModel.objects.values_list('pk', flat=True)):
+            expected[database or 'default'] += 1
+        with ExitStack() as stack:
+            for database, count in expected.items():
+                stack.enter_context(self.assertNumQueries(count, using=database))
+            result = self.schema.execute(self.query, context_value=Auth)
+        self.assertEqual(self.voted(result),
+                         [('http://a.com', False), ('http://b.com', True), ('http://c.com', False)])
+
+    def test_viewer_has_voted_anonymous(self):
+        """viewerHasVoted is false for anonymous requests"""
+        class Context(object):
+            META = {}
+        result = self.schema.execute(self.query, context_value=Context)
+        self.assertEqual(self.voted(result),
+                         [('http://a.com', False), ('http://b.com', False), ('http://c.com', False)])
+
+
 # ========== createVote mutation tests ==========
 
 class CreateVoteTests(TestCase):
+    multi_db = True  # votes may live in the vote shards (see links/shards.py)
+
     def setUp(self):
         create_Link_orderBy_test_data()
         self.link_gid = Node.to_global_id('Link', LinkModel.objects.latest('created_at').pk)
@@ -746,9 +1482,10 @@ class CreateVoteTests(TestCase):
         self.assertIsNone(result.errors, msg=format_graphql_errors(result.errors))
         expected = self.expected()
         self.assertEqual(result.data, expected, msg='\n'+repr(expected)+'\n'+repr(result.data))
-        # verify that a second vote can't be created
-        result = self.schema.execute(self.query,
-                                     variable_values=self.variables(self.link_gid, self.user_gid),
+        # verify that a second vote can't be created (by a new request, not a replay of the first)
+        variables = self.variables(self.link_gid, self.user_gid)
+        variables['input']['clientMutationId'] = 'a_new_request'
+        result = self.schema.execute(self.query, variable_values=variables,
                                      context_value=self.context_with_token())
         self.assertIsNotNone(result.errors,
                              msg='createVote should have failed: duplicate votes not allowed')
@@ -811,3 +1548,416 @@ class CreateVoteTests(TestCase):
         self.assertIn('link not found', repr(result.errors))
         expected = { 'createVote': None }
         self.assertEqual(result.data, expected, msg='\n'+repr(expected)+'\n'+repr(result.data))
+
+
+# ========== createVotes mutation tests ==========
+
+class CreateVotesTests(TestCase):
+    multi_db = True  # votes may live in the vote shards (see links/shards.py)
+
+    def setUp(self):
+        create_Link_orderBy_test_data()
+        self.link_gids = [Node.to_global_id('Link', link.pk)
+                          for link in LinkModel.objects.order_by('pk')]
+        self.user = create_test_user()
+        self.user_gid = Node.to_global_id('User', self.user.pk)
+        self.query = '''
+          mutation CreateVotesMutation($input: CreateVotesInput!) {
+            createVotes(input: $input) {
+              results {
+                vote {
+                  link { id }
+                }
+                error
+              }
+            }
+          }
+        '''
+        self.schema = graphene.Schema(query=Query, mutation=Mutation)
+
+    def context_with_token(self):
+        class Auth(object):
+            META = {'HTTP_AUTHORIZATION': 'Bearer {}'.format(self.user.token)}
+        return Auth
+
+    def execute(self, link_gids, user_gid=None):
+        variables = { 'input': { 'linkIds': link_gids, 'userId': user_gid or self.user_gid } }
+        return self.schema.execute(self.query, variable_values=variables,
+                                   context_value=self.context_with_token())
+
+    def test_create_votes(self):
+        """createVotes votes on each valid link once, reporting errors in input order"""
+        VoteModel.objects.create(link_id=LinkModel.objects.order_by('pk').last().pk,
+                                 user_id=self.user.pk)
+        missing_gid = Node.to_global_id('Link', LinkModel.objects.order_by('pk').last().pk + 1)
+        link_gids = [self.link_gids[0], missing_gid, self.link_gids[1], self.link_gids[0],
+                     self.link_gids[2], self.user_gid]
+        result = self.execute(link_gids)
+        self.assertIsNone(result.errors, msg=format_graphql_errors(result.errors))
+        expected = {
+            'createVotes': {
+                'results': [
+                    { 'vote': { 'link': { 'id': self.link_gids[0] } }, 'error': None },
+                    { 'vote': None, 'error': 'Requested link not found!' },
+                    { 'vote': { 'link': { 'id': self.link_gids[1] } }, 'error': None },
+                    { 'vote': None, 'error': 'A vote already exists for this user and link!' },
+                    { 'vote': None, 'error': 'A vote already exists for this user and link!' },
+                    { 'vote': None, 'error': 'Requested link not found!' },
+                ]
+            }
+        }
+        self.assertEqual(result.data, expected, msg='\n'+repr(expected)+'\n'+repr(result.data))
+        self.assertEqual(shards.votes(filter=lambda qs: qs.filter(user_id=self.user.pk)).count(),
+                         3)
+
+    def test_create_votes_user_mismatch(self):
+        """createVotes fails as a whole if the userId doesn't match the logged-in user"""
+        user2 = create_test_user(name='Another User', password='zyz987', email='ano@user.com')
+        result = self.execute(self.link_gids, Node.to_global_id('User', user2.pk))
+        self.assertIsNotNone(result.errors,
+                             msg='createVotes should have failed: userId and logged user mismatch')
+        self.assertIn('user id does not match logged-in user', repr(result.errors))
+        self.assertEqual(shards.votes().count(), 0)
+
+    def test_create_votes_too_many(self):
+        """createVotes rejects requests with more than BULK_MUTATION_MAX_ITEMS items"""
+        with self.settings(BULK_MUTATION_MAX_ITEMS=2):
+            result = self.execute(self.link_gids)
+        self.assertIsNotNone(result.errors, msg='createVotes should have failed: too many items')
+        self.assertIn('Too many items', repr(result.errors))
+        self.assertEqual(shards.votes().count(), 0)
+
+
+# ========== precomputed score tests ==========
+
+class LinkScoreTests(TestCase):
+    multi_db = True  # votes may live in the vote shards (see links/shards.py)
+
+    def setUp(self):
+        create_Link_orderBy_test_data()  # a.com is the oldest, then c.com, then b.com
+        self.links = {link.url: link for link in LinkModel.objects.all()}
+        self.users = [create_test_user(name='User {}'.format(i), email='{}@user.com'.format(i))
+                      for i in range(3)]
+        self.schema = graphene.Schema(query=Query, mutation=Mutation)
+
+    def vote(self, user, *urls):
+        class Auth(object):
+            META = {'HTTP_AUTHORIZATION': 'Bearer {}'.format(user.token)}
+        query = '''
+          mutation CreateVotesMutation($input: CreateVotesInput!) {
+            createVotes(input: $input) { results { error } }
+          }
+        '''
+        link_ids = [Node.to_global_id('Link', self.links[url].pk) for url in urls]
+        result = self.schema.execute(query, variable_values={'input': {'linkIds': link_ids}},
+                                     context_value=Auth)
+        self.assertIsNone(result.errors, msg=format_graphql_errors(result.errors))
+
+    def ordered_urls(self, order_by):
+        query = '''
+          query {
+            viewer {
+              allLinks(orderBy: %s) {
+                edges { node { url } }
+              }
+            }
+          }
+        ''' % order_by
+        result = self.schema.execute(query)
+        self.assertIsNone(result.errors, msg=format_graphql_errors(result.errors))
+        return [edge['node']['url'] for edge in result.data['viewer']['allLinks']['edges']]
+
+    def test_votes_order(self):
+        """votes_DESC orders by the vote counts maintained by the vote mutations"""
+        self.vote(self.users[0], 'http://a.com', 'http://c.com')
+        self.vote(self.users[1], 'http://a.com')
+        self.vote(self.users[2], 'http://a.com', 'http://b.com')
+        self.assertEqual(LinkModel.objects.get(url='http://a.com').vote_count, 3)
+        # b.com and c.com both have one vote, and c.com has the higher id
+        self.assertEqual(self.ordered_urls('votes_DESC'),
+                         ['http://a.com', 'http://c.com', 'http://b.com'])
+
+    def test_hot_order(self):
+        """hot_DESC orders by votes decayed by age, and recompute_scores recomputes the decay"""
+        # a.com was created 400 seconds before b.com, which is enough to lose a tie, but not to
+        # beat two votes with one
+        self.vote(self.users[0], 'http://a.com', 'http://b.com')
+        self.vote(self.users[1], 'http://a.com')
+        self.assertEqual(self.ordered_urls('hot_DESC'),
+                         ['http://a.com', 'http://b.com', 'http://c.com'])
+        shards.votes(link_id=self.links['http://a.com'].pk).filter(user=self.users[1]).delete()
+        LinkModel.objects.update(hot_score=0)
+        call_command('recompute_scores', '--recount', stdout=io.StringIO())
+        self.assertEqual(LinkModel.objects.get(url='http://a.com').vote_count, 1)
+        self.assertEqual(self.ordered_urls('hot_DESC'),
+                         ['http://b.com', 'http://a.com', 'http://c.com'])
+
+    def test_decay_keeps_votes(self):
+        """the periodic decay pass only writes hot_score, from the vote_count at UPDATE time"""
+        link = self.links['http://a.com']
+        LinkModel.objects.filter(pk=link.pk).update(vote_count=2, hot_score=0)
+        real_decay = scores.decay
+        def decay_with_a_vote_meanwhile(created_at, now=None):
+            # a vote recorded between reading the batch and the UPDATE
+            record_votes({link.pk: 1})
+            return real_decay(created_at, now)
+        with mock.patch('links.management.commands.recompute_scores.decay',
+                        decay_with_a_vote_meanwhile):
+            call_command('recompute_scores', stdout=io.StringIO())
+        link.refresh_from_db()
+        self.assertEqual(link.vote_count, 5)  # 2, plus one vote per link in the batch
+        self.assertAlmostEqual(link.hot_score, hot_score(5, link.created_at), places=6)
+
+    def test_batches_within_parameter_limit(self):
+        """recompute_scores keeps each UPDATE's parameters within the database's limit"""
+        command = 'links.management.commands.recompute_scores.'
+        def bulk_batch_size(fields, objs):  # as if the limit were 7 parameters
+            return min(len(objs), 7 // len(fields))
+        with mock.patch.object(connection.ops, 'bulk_batch_size', side_effect=bulk_batch_size), \
+                mock.patch(command + 'decay_scores', wraps=scores.decay_scores) as decay_scores, \
+                mock.patch(command + 'update_scores', wraps=scores.update_scores) as update_scores:
+            call_command('recompute_scores', batch_size=500, stdout=io.StringIO())
+            call_command('recompute_scores', '--recount', batch_size=500, stdout=io.StringIO())
+        self.assertEqual([len(args[0]) for args, _ in decay_scores.call_args_list], [2, 1])
+        self.assertEqual([len(args[0]) for args, _ in update_scores.call_args_list], [1, 1, 1])
+
+
+# ========== topLinks leaderboard tests ==========
+
+class LeaderboardTests(TestCase):
+    multi_db = True  # votes may live in the vote shards (see links/shards.py)
+
+    def setUp(self):
+        get_leaderboard().reset()
+        self.links = [LinkModel.objects.create(url='http://example.com/%d' % i,
+                                               description='Link %d' % i) for i in range(3)]
+        self.users = [create_test_user(email='user%d@example.com' % i) for i in range(2)]
+        self.schema = graphene.Schema(query=Query)
+
+    def vote(self, link, user):
+        return VoteModel.objects.create(link=link, user=user)
+
+    def top_links(self, window):
+        query = '''
+          query {
+            viewer {
+              topLinks(window: %s, first: 5) {
+                edges { node { description } }
+              }
+            }
+          }
+        ''' % window
+        result = self.schema.execute(query)
+        self.assertIsNone(result.errors, msg=format_graphql_errors(result.errors))
+        return [edge['node']['description'] for edge in result.data['viewer']['topLinks']['edges']]
+
+    def test_top_links_by_window(self):
+        self.vote(self.links[1], self.users[0])
+        self.vote(self.links[1], self.users[1])
+        self.vote(self.links[0], self.users[0])
+        old = self.vote(self.links[2], self.users[0])
+        shards.votes(link_id=old.link_id).filter(pk=old.pk).update(
+            created_at=timezone.now() - datetime.timedelta(days=3))
+        self.assertEqual(self.top_links('DAY'), ['Link 1', 'Link 0'])
+        # ties go to the newer link
+        self.assertEqual(self.top_links('WEEK'), ['Link 1', 'Link 2', 'Link 0'])
+
+    def test_other_processes_votes_are_synced(self):
+        self.assertEqual(self.top_links('DAY'), [])
+        self.vote(self.links[2], self.users[0])  # not passed to add_votes(), as if elsewhere
+        added = self.vote(self.links[0], self.users[0])
+        leaderboard = get_leaderboard()
+        leaderboard.add_votes([added])
+        self.assertEqual(self.top_links('DAY'), ['Link 0'])
+        leaderboard.synced_at = 0.0  # the sync interval has passed
+        self.assertEqual(self.top_links('DAY'), ['Link 2', 'Link 0'])
+        self.assertEqual(leaderboard.top(24, 5), [(self.links[2].pk, 1), (self.links[0].pk, 1)])
+
+    def test_windows_slide(self):
+        leaderboard = Leaderboard(windows=(2, 4))
+        leaderboard.buckets = {}
+        leaderboard.totals = {2: Counter(), 4: Counter()}
+        leaderboard.hour = 100
+        leaderboard.count([(1, 97, 5), (1, 99, 1), (2, 100, 2), (1, 100, 1)])
+        self.assertEqual(leaderboard.totals, {2: {1: 2, 2: 2}, 4: {1: 7, 2: 2}})
+        leaderboard.advance(101)
+        self.assertEqual(leaderboard.totals, {2: {1: 1, 2: 2}, 4: {1: 2, 2: 2}})
+        self.assertEqual(sorted(leaderboard.buckets), [99, 100])
+        leaderboard.advance(110)
+        self.assertEqual(leaderboard.totals, {2: {}, 4: {}})
+        self.assertEqual(leaderboard.buckets, {})
+
+
+# ========== write-behind vote ingestion tests ==========
+
+class VoteWriterFlushTests(TestCase):
+    multi_db = True  # votes may live in the vote shards (see links/shards.py)
+
+    def test_flush(self):
+        """a flush writes the whole batch, except for votes that duplicate existing ones"""
+        create_Link_orderBy_test_data()
+        user = create_test_user()
+        links = list(LinkModel.objects.order_by('pk'))
+        VoteModel.objects.create(link_id=links[0].pk, user_id=user.pk)
+        batch = [PendingVote(VoteModel(link_id=link.pk, user_id=user.pk))
+                 for link in links + links[2:]]
+        VoteWriter.flush(batch)
+        self.assertTrue(all(p.done.is_set() for p in batch))
+        errors = [p.error and str(p.error) for p in batch]
+        duplicate = 'A vote already exists for this user and link!'
+        self.assertEqual(errors, [duplicate, None, None, duplicate])
+        self.assertEqual([p.vote.pk is not None for p in batch], [False, True, True, False])
+        self.assertEqual(shards.votes(filter=lambda qs: qs.filter(user_id=user.pk)).count(), 3)
+
+
+class WriteBehindCreateVoteTests(TransactionTestCase):
+    multi_db = True  # votes may live in the vote shards (see links/shards.py)
+
+    def test_create_vote_write_behind(self):
+        """createVote returns only once the flusher thread has committed the vote"""
+        create_Link_orderBy_test_data()
+        link = LinkModel.objects.latest('created_at')
+        link_gid = Node.to_global_id('Link', link.pk)
+        user = create_test_user()
+        query = '''
+          mutation CreateVoteMutation($input: CreateVoteInput!) {
+            createVote(input: $input) {
+              vote {
+                id
+                link { votes { count } }
+              }
+            }
+          }
+        '''
+        user_gid = Node.to_global_id('User', user.pk)
+        variables = { 'input': { 'linkId': link_gid, 'userId': user_gid } }
+        class Auth(object):
+            META = {'HTTP_AUTHORIZATION': 'Bearer {}'.format(user.token)}
+        schema = graphene.Schema(query=Query, mutation=Mutation)
+        writer = VoteWriter(max_batch=10, max_delay=0.001)
+        with self.settings(VOTE_WRITE_BEHIND=True), \
+                mock.patch('links.votequeue.get_vote_writer', return_value=writer):
+            try:
+                result = schema.execute(query, variable_values=variables, context_value=Auth)
+            finally:
+                writer.stop()
+        self.assertIsNone(result.errors, msg=format_graphql_errors(result.errors))
+        vote = shards.votes(link_id=link.pk).get(user_id=user.pk)
+        expected = {
+            'createVote': {
+                'vote': {
+                    'id': Node.to_global_id('Vote', vote.pk),
+                    'link': { 'votes': { 'count': 1 } },
+                }
+            }
+        }
+        self.assertEqual(result.data, expected, msg='\n'+repr(expected)+'\n'+repr(result.data))
+
+
+# ========== sharded vote storage tests ==========
+
+@skipUnless(settings.VOTE_SHARDS, 'set VOTE_SHARD_URLS to run these tests')
+class ShardedVoteTests(TestCase):
+    """Tests against real vote shard databases, see links/shards.py."""
+    multi_db = True
+
+    def setUp(self):
+        self.user = create_test_user()
+        self.links = [LinkModel.objects.create(url='http://{}.example.com'.format(i))
+                      for i in range(8)]
+        self.schema = graphene.Schema(query=Query, mutation=Mutation)
+
+    def vote(self, link, user=None):
+        return save_vote(VoteModel(link_id=link.pk, user_id=(user or self.user).pk), link=link)
+
+    def execute(self, query, variables=None):
+        class Auth(object):
+            META = {'HTTP_AUTHORIZATION': 'Bearer {}'.format(self.user.token)}
+        result = self.schema.execute(query, variable_values=variables, context_value=Auth)
+        self.assertIsNone(result.errors, msg=format_graphql_errors(result.errors))
+        return result.data
+
+    def test_votes_stored_in_their_links_shard(self):
+        """each vote is stored in its link's shard, with an id in that shard's range"""
+        for link in self.links:
+            vote = self.vote(link)
+            shard = shards.shard_for_link(link.pk)
+            self.assertEqual(vote.pk // settings.VOTE_SHARD_ID_SPAN,
+                             settings.VOTE_SHARDS.index(shard))
+            for alias in settings.VOTE_SHARDS:
+                self.assertEqual(VoteModel.objects.using(alias).filter(pk=vote.pk).exists(),
+                                 alias == shard)
+        self.assertGreater(len(set(shards.shard_for_link(link.pk) for link in self.links)), 1)
+
+    def test_vote_queries(self):
+        """allVotes gathers every shard, in id order; single-link queries use the link's shard"""
+        votes = sorted((self.vote(link) for link in self.links), key=lambda vote: vote.pk)
+        gids = [Node.to_global_id('Vote', vote.pk) for vote in votes]
+        data = self.execute('{ viewer { allVotes(first: 5) { count edges { node { id } } } } }')
+        self.assertEqual(data['viewer']['allVotes']['count'], len(votes))
+        self.assertEqual([edge['node']['id'] for edge in data['viewer']['allVotes']['edges']],
+                         gids[:5])
+        link_gid = Node.to_global_id('Link', votes[-1].link_id)
+        data = self.execute('''
+          query($link: ID!) {
+            viewer { allVotes(filter: { link: { id: $link } }) { count } }
+            node(id: $link) { ... on Link { votes { edges { node { id } } } } }
+          }''', {'link': link_gid})
+        self.assertEqual(data['viewer']['allVotes']['count'], 1)
+        self.assertEqual(data['node']['votes']['edges'], [{'node': {'id': gids[-1]}}])
+        user_gid = Node.to_global_id('User', self.user.pk)
+        data = self.execute('''
+          query($user: ID!, $vote: ID!) {
+            node(id: $user) { ... on User { votes(first: 3) { count edges { node { id } } } } }
+            vote: node(id: $vote) { ... on Vote { link { id } } }
+          }''', {'user': user_gid, 'vote': gids[-1]})
+        self.assertEqual(data['node']['votes']['count'], len(votes))
+        self.assertEqual([edge['node']['id'] for edge in data['node']['votes']['edges']],
+                         gids[::-1][:3])
+        self.assertEqual(data['vote'], {'link': {'id': link_gid}})
+
+    def test_create_votes(self):
+        """createVotes writes to every shard involved, and finds duplicates in each"""
+        self.vote(self.links[0])
+        link_gids = [Node.to_global_id('Link', link.pk) for link in self.links]
+        data = self.execute('''
+          mutation($input: CreateVotesInput!) { createVotes(input: $input) { results { error } } }
+        ''', {'input': {'linkIds': link_gids}})
+        self.assertEqual([result['error'] for result in data['createVotes']['results']],
+                         ['A vote already exists for this user and link!'] + [None] * 7)
+        self.assertEqual(shards.count_votes([link.pk for link in self.links]),
+                         {link.pk: 1 for link in self.links})
+        self.assertEqual(list(LinkModel.objects.values_list('vote_count', flat=True).distinct()),
+                         [1])
+
+    def test_deletes_and_recount(self):
+        """deleting a link or user deletes its votes from the shards, and --recount counts them"""
+        user2 = create_test_user(name='Another User', password='zyz987', email='ano@user.com')
+        for link in self.links:
+            self.vote(link)
+            self.vote(link, user2)
+        self.links[0].delete()
+        user2.delete()
+        self.assertEqual(shards.count_votes([link.pk for link in self.links]),
+                         {link.pk: 1 for link in self.links[1:]})
+        LinkModel.objects.update(vote_count=0)
+        call_command('recompute_scores', recount=True, stdout=io.StringIO())
+        self.assertEqual(list(LinkModel.objects.values_list('vote_count', flat=True).distinct()),
+                         [1])
+
+    def test_dedup_links_across_shards(self):
+        """dedup_links copies votes on duplicates in another shard to the kept link's shard"""
+        keep = self.links[0]
+        while True:  # any duplicates in keep's shard are merged too, they have no votes
+            duplicate = LinkModel.objects.create(url='http://0.example.com/')
+            if shards.shard_for_link(duplicate.pk) != shards.shard_for_link(keep.pk):
+                break
+        user2 = create_test_user(name='Another User', password='zyz987', email='ano@user.com')
+        self.vote(keep)
+        self.vote(duplicate)
+        old = self.vote(duplicate, user2)
+        call_command('dedup_links', stdout=io.StringIO())
+        self.assertFalse(LinkModel.objects.filter(url='http://0.example.com/').exists())
+        self.assertEqual(shards.count_votes([keep.pk, duplicate.pk]), {keep.pk: 2})
+        moved = VoteModel.objects.using(shards.shard_for_link(keep.pk)).get(user_id=user2.pk)
+        self.assertEqual(moved.created_at, old.created_at)
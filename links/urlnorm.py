@@ -0,0 +1,78 @@
+# howtographql-graphene-tutorial-fixed -- links/urlnorm.py
+#
+# Copyright © 2017 Sean Bolton.
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE
+# LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION
+# WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+"""URL normalization, for the derived columns on LinkModel."""
+
+import hashlib
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+# Query parameters that only track where a click came from, and never change the page.
+TRACKING_PARAMS = ('fbclid', 'gclid', 'mc_cid', 'mc_eid', 'ref', 'ref_src')
+
+
+def normalize_domain(url):
+    """Return the normalized domain name of `url`, which may also be a bare domain name: the host
+    name, lower-cased, without any port, trailing dot, or leading 'www.'. Returns '' if there is no
+    host name to be found.
+    """
+    url = (url or '').strip()
+    if '://' not in url:
+        url = '//' + url
+    try:
+        host = urlsplit(url).hostname or ''
+    except ValueError:
+        return ''
+    host = host.rstrip('.')
+    if host.startswith('www.'):
+        host = host[4:]
+    return host
+
+
+def canonicalize_url(url):
+    """Return a canonical form of `url`, so that trivial variations of a URL for the same page
+    canonicalize to the same string: the scheme ('https' is treated as 'http'), host name and
+    port are normalized as in normalize_domain(), default ports and the fragment are dropped, as
+    are tracking query parameters ('utm_*' and TRACKING_PARAMS), the remaining query parameters
+    are sorted, and a trailing slash is removed from the path.
+    """
+    url = (url or '').strip()
+    try:
+        parts = urlsplit(url if '://' in url else 'http://' + url)
+        port = parts.port
+    except ValueError:
+        return url
+    scheme = parts.scheme.lower()
+    if scheme == 'https':
+        scheme = 'http'
+    netloc = normalize_domain(url)
+    if port and port not in (80, 443):
+        netloc = '{}:{}'.format(netloc, port)
+    path = parts.path.rstrip('/')
+    query = sorted((key, value) for key, value in parse_qsl(parts.query, keep_blank_values=True)
+                   if not key.startswith('utm_') and key not in TRACKING_PARAMS)
+    return urlunsplit((scheme, netloc, path, urlencode(query), ''))
+
+
+def url_hash(url):
+    """Return the hex SHA-256 digest of the canonical form of `url`."""
+    return hashlib.sha256(canonicalize_url(url).encode()).hexdigest()
@@ -3,3 +3,7 @@ from django.apps import AppConfig
 
 class UsersConfig(AppConfig):
     name = 'users'
+
+    def ready(self):
+        from hackernews.nodecache import get_node_cache
+        get_node_cache().register(self.get_model('UserModel'))
@@ -21,3 +21,10 @@ class UserModel(models.Model):
     password = models.CharField(max_length=128)
     email = models.EmailField(unique=True)
     token = models.CharField(max_length=64, default=new_token)
+    # the number of votes on links this user has posted, maintained by links.scores.record_votes()
+    karma = models.IntegerField(default=0)
+    # Staff may ask for the profiling of their requests (see hackernews/profiling.py).
+    is_staff = models.BooleanField(default=False)
+
+    # columns that change with every vote, which hackernews/nodecache.py doesn't cache
+    COUNTER_FIELDS = ('karma',)
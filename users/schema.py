@@ -21,11 +21,23 @@
 # OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION
 # WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
 
+from collections import Counter, OrderedDict
+
+from django.db.models import Count
+
 import graphene
 from graphene import relay
 from graphene.relay import Node
 from graphene_django import DjangoObjectType
+from promise import Promise
+from promise.dataloader import DataLoader
 
+from hackernews.fields import ConnectionSlice, QuerySetConnectionField, connection_page
+from hackernews.nodecache import get_node_cache
+from hackernews.sharding import ConcatenatedQuerySet
+from hackernews.utils import get_request_cache, ranked_rows, supports_window_functions
+from links.models import LinkModel
+from links.shards import vote_shards, votes
 from users.models import UserModel
 
 
@@ -41,10 +53,110 @@ def get_user_from_auth_token(context):
         raise Exception('User not found!')
 
 
+def links_posted_by(user_pks):
+    return LinkModel.objects.filter(posted_by_id__in=user_pks).order_by('-created_at', '-id')
+
+
+def votes_cast_by(user_pks):
+    def by_users(qs):
+        qs = qs.filter(user_id__in=user_pks)
+        # sharded votes can't be joined to the links in the default database
+        return qs.prefetch_related('link') if vote_shards() else qs.select_related('link')
+    # from every vote shard, if votes are sharded (see links/shards.py)
+    return votes(filter=by_users, reverse=True)
+
+
+class UserItemsLoader(DataLoader):
+    """Loads a page of the links or votes of users, given (user primary key, offset, limit) keys,
+    as from connection_page(). `items_for` returns the QuerySet (or ConcatenatedQuerySet, from
+    the vote shards) of the items of a list of users, in order, and `user_column` names the items'
+    user id attribute.
+
+    A page of users (e.g. the postedBy of each link on the front page) that all want their links
+    would otherwise take a count and a page query each. Resolved together, they take one COUNT
+    query, grouped by user, and one query for the page of each of them, using ROW_NUMBER() (see
+    hackernews.utils.ranked_rows()), per database. A single user, as on a profile page, or a
+    database without window functions, gets the QuerySet itself, for QuerySetConnectionField to
+    paginate.
+    """
+    def __init__(self, items_for, user_column):
+        super().__init__()
+        self.items_for = items_for
+        self.user_column = user_column
+
+    def batch_load_fn(self, keys):
+        pages = OrderedDict()
+        for pk, offset, limit in keys:
+            pages.setdefault((offset, limit), []).append(pk)
+        loaded = {}
+        for (offset, limit), user_pks in pages.items():
+            items = self.items_for(user_pks)
+            querysets = items.querysets if isinstance(items, ConcatenatedQuerySet) else [items]
+            if len(user_pks) == 1 or not all(supports_window_functions(qs.db) for qs in querysets):
+                for pk in user_pks:
+                    loaded[(pk, offset, limit)] = self.items_for([pk])
+                continue
+            for pk, page in self.load_pages(querysets, user_pks, offset, limit).items():
+                loaded[(pk, offset, limit)] = page
+        return Promise.resolve([loaded[key] for key in keys])
+
+    def load_pages(self, querysets, user_pks, offset, limit):
+        stop = None if limit is None else offset + limit
+        # With several databases, a user's page can come from any of them: take each one's first
+        # `stop` rows, and the page from those, in order.
+        start = offset if len(querysets) == 1 else 0
+        counts = Counter()
+        rows = {pk: [] for pk in user_pks}
+        for qs in querysets:
+            counts.update(dict(qs.order_by().values_list(self.user_column)
+                               .annotate(Count('pk'))))
+            for row in ranked_rows(qs, self.user_column, start, stop):
+                rows[getattr(row, self.user_column)].append(row)
+        end = None if stop is None else stop - start
+        return {pk: ConnectionSlice(rows[pk][offset - start:end], offset, counts[pk])
+                for pk in user_pks}
+
+
+def get_user_items_loader(info, items_for, user_column):
+    # one loader of each kind per request
+    cache = get_request_cache(info.context)
+    key = 'user_items_loader:' + items_for.__name__
+    if key not in cache:
+        cache[key] = UserItemsLoader(items_for, user_column)
+    return cache[key]
+
+
 class User(DjangoObjectType):
     class Meta:
         model = UserModel
         interfaces = (Node, )
+        exclude_fields = ('is_staff',)
+
+    @classmethod
+    def get_node(cls, info, id):
+        # served from hackernews/nodecache.py, rather than a query per lookup
+        return get_node_cache().get(UserModel, id)
+
+    # The links this user has posted, newest first, and the votes they have cast, most recent
+    # first. The connection types are named by string because links.schema imports this module.
+    # For a single user, both are paginated in SQL by QuerySetConnectionField, and 'count' on the
+    # votes connection is a COUNT query, so a profile page costs the same however active the user
+    # has been. Several users resolved together share their queries, still paginated in SQL (see
+    # UserItemsLoader).
+    links = QuerySetConnectionField('links.schema.LinkConnection')
+    votes = QuerySetConnectionField('links.schema.VoteConnection')
+
+    def resolve_links(self, info, **args):
+        page = connection_page(args)
+        if page is None:
+            return links_posted_by([self.pk])
+        return get_user_items_loader(info, links_posted_by, 'posted_by_id').load((self.pk,) + page)
+
+    def resolve_votes(self, info, **args):
+        page = connection_page(args)
+        if page is None:
+            return votes_cast_by([self.pk])
+        return get_user_items_loader(info, votes_cast_by, 'user_id').load((self.pk,) + page)
 
 
 class Query(object):
@@ -21,13 +21,21 @@
 # OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION
 # WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
 
+import io
+from contextlib import ExitStack
+
+from django.core.management import call_command
+from django.db import connections
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
 
 import graphene
 from graphene.relay import Node
 
 from hackernews.schema import Mutation, Query
 from hackernews.utils import format_graphql_errors, quiet_graphql, unquiet_graphql
+from links.models import LinkModel
+from links.shards import vote_databases
 from .models import UserModel
 from .schema import get_user_from_auth_token
 
@@ -133,6 +141,148 @@ class RelayNodeTests(TestCase):
         self.assertEqual(result.data, expected, msg='\n'+repr(expected)+'\n'+repr(result.data))
 
 
+# ========== User links, votes and karma tests ==========
+
+class UserConnectionTests(TestCase):
+    multi_db = True  # votes may live in the vote shards (see links/shards.py)
+
+    def setUp(self):
+        self.poster = create_test_user()
+        self.voter = create_test_user(name='Voter', email='voter@user.com')
+        self.links = [LinkModel.objects.create(url='http://example.com/%d' % i,
+                                               description='Link %d' % i, posted_by=self.poster)
+                      for i in range(3)]
+        self.poster_gid = Node.to_global_id('User', self.poster.pk)
+        self.voter_gid = Node.to_global_id('User', self.voter.pk)
+        self.schema = graphene.Schema(query=Query, mutation=Mutation)
+
+    def vote(self, user, link):
+        query = '''
+          mutation CreateVote($input: CreateVoteInput!) {
+            createVote(input: $input) { vote { id } }
+          }
+        '''
+        variables = {
+            'input': {
+                'userId': Node.to_global_id('User', user.pk),
+                'linkId': Node.to_global_id('Link', link.pk),
+            }
+        }
+        class Context(object):
+            META = {'HTTP_AUTHORIZATION': 'Bearer {}'.format(user.token)}
+        result = self.schema.execute(query, variable_values=variables, context_value=Context())
+        self.assertIsNone(result.errors, msg=format_graphql_errors(result.errors))
+
+    def test_user_links_paginated(self):
+        query = '''
+          query {
+            node(id: "%s") {
+              ...on User {
+                links(first: 2) {
+                  edges { node { description } }
+                  pageInfo { hasNextPage }
+                }
+              }
+            }
+          }
+        ''' % self.poster_gid
+        result = self.schema.execute(query)
+        self.assertIsNone(result.errors, msg=format_graphql_errors(result.errors))
+        links = result.data['node']['links']
+        self.assertEqual([e['node']['description'] for e in links['edges']], ['Link 2', 'Link 1'])
+        self.assertTrue(links['pageInfo']['hasNextPage'])
+
+    def test_user_votes_and_karma(self):
+        self.vote(self.voter, self.links[0])
+        self.vote(self.voter, self.links[2])
+        query = '''
+          query {
+            voter: node(id: "%s") {
+              ...on User {
+                karma
+                votes(first: 1) {
+                  count
+                  edges { node { link { description } } }
+                }
+              }
+            }
+            poster: node(id: "%s") {
+              ...on User { karma }
+            }
+          }
+        ''' % (self.voter_gid, self.poster_gid)
+        result = self.schema.execute(query)
+        self.assertIsNone(result.errors, msg=format_graphql_errors(result.errors))
+        voter = result.data['voter']
+        self.assertEqual(voter['karma'], 0)
+        self.assertEqual(voter['votes']['count'], 2)
+        self.assertEqual([e['node']['link']['description'] for e in voter['votes']['edges']],
+                         ['Link 2'])
+        self.assertEqual(result.data['poster']['karma'], 2)
+
+    def test_recount_karma(self):
+        self.vote(self.voter, self.links[1])
+        UserModel.objects.filter(pk=self.poster.pk).update(karma=42)
+        call_command('recompute_scores', '--recount', stdout=io.StringIO())
+        self.assertEqual(UserModel.objects.get(pk=self.poster.pk).karma, 1)
+        self.assertEqual(UserModel.objects.get(pk=self.voter.pk).karma, 0)
+
+    def test_users_links_and_votes_batched(self):
+        """the links and votes of every user on a page are fetched together, a page per user"""
+        others = [create_test_user(name='Poster %d' % i, email='poster%d@user.com' % i)
+                  for i in range(3)]
+        for i, user in enumerate(others):
+            LinkModel.objects.create(url='http://example.com/other/%d' % i,
+                                     description='Other %d' % i, posted_by=user)
+        self.vote(others[1], self.links[0])
+        query = '''
+          query {
+            viewer {
+              allLinks {
+                edges {
+                  node {
+                    postedBy {
+                      links(first: 1) {
+                        edges { node { description } }
+                        pageInfo { hasNextPage }
+                      }
+                      votes(first: 1) { count }
+                    }
+                  }
+                }
+              }
+            }
+          }
+        '''
+        class Context(object):
+            META = {}
+        databases = [alias or 'default' for alias in vote_databases()]
+        with ExitStack() as stack:
+            captures = {alias: stack.enter_context(CaptureQueriesContext(connections[alias]))
+                        for alias in set(['default'] + databases)}
+            result = self.schema.execute(query, context_value=Context())
+        self.assertIsNone(result.errors, msg=format_graphql_errors(result.errors))
+        # for each of links and votes, per database: one count, and one query for every user's
+        # page, paginated in SQL
+        def queries(alias, user_column):
+            return [query['sql'] for query in captures[alias].captured_queries
+                    if '."{}" IN ('.format(user_column) in query['sql']]
+        for alias, user_column in ([('default', 'posted_by_id')]
+                                   + [(alias, 'user_id') for alias in databases]):
+            found = queries(alias, user_column)
+            self.assertEqual(len(found), 2, msg=found)
+            self.assertIn('row_rank <= 1', found[1])
+        edges = result.data['viewer']['allLinks']['edges']
+        posted_by = [edge['node']['postedBy'] for edge in edges]
+        self.assertEqual(len(posted_by), 6)
+        self.assertIn({'links': {'edges': [{'node': {'description': 'Link 2'}}],
+                                 'pageInfo': {'hasNextPage': True}},
+                       'votes': {'count': 0}}, posted_by)
+        self.assertIn({'links': {'edges': [{'node': {'description': 'Other 1'}}],
+                                 'pageInfo': {'hasNextPage': False}},
+                       'votes': {'count': 1}}, posted_by)
+
+
 # ========== createUser mutation tests ==========
 
 class CreateUserTests(TestCase):